@@ -0,0 +1,167 @@
+#aggregate.py: Per-product reliability aggregates of reports, kept free of model loading like report.py.
+#Aggregates only hold sums, so the aggregates of new reports can be published as deltas and merged by adding them up.
+#They also list the ids of the latest deltas merged into them, so a delta that was published twice is only merged once.
+import hashlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from analyzer.issues import criticalities
+from analyzer.report import Keyframe, Report
+
+@dataclass(slots=True)
+class SentimentBin:
+    start_day: int
+    weight: float
+    sentiment_sum: float
+
+@dataclass(slots=True)
+class IssueBin:
+    classification: str
+    start_day: Optional[int]
+    count: float
+    criticality_sum: float
+
+@dataclass(slots=True)
+class ReliabilityAggregate:
+    product_id: str
+    bin_days: int
+    reports: int
+    sentiment: list[SentimentBin]
+    issues: list[IssueBin]
+    delta_ids: list[str] = field(default_factory=list)
+
+#Number of delta ids an aggregate remembers, which keeps its size independent of the number of reviews
+DELTA_HISTORY = 64
+
+class ReliabilityAggregator:
+    '''
+    Accumulates the reports of one product into bins of bin_days days since the first keyframe of each review:
+    the weighted sentiment of keyframes, interpolated across the bins between two keyframes,
+    and the number of issues per class, weighted by report weight and criticality.
+    Adding reports takes time in the number of new reports only.
+    Reports of reviews that were already added are skipped. Merged deltas are remembered by their id,
+    so merging one of the last history deltas again is skipped as well.
+    The reports added directly form one more delta, whose id is delta_id or a digest of their review ids.
+    '''
+
+    def __init__(self, product_id: str, bin_days: int, delta_id: Optional[str] = None, history: int = DELTA_HISTORY) -> None:
+        self.product_id = product_id
+        self.bin_days = bin_days
+        self.delta_id = delta_id
+        self.reports = 0
+        self.__review_ids: set[str] = set()
+        self.__delta_ids: deque[str] = deque(maxlen=history)
+        self.__sentiment: dict[int, list[float]] = {} # start_day -> [weight, sentiment_sum]
+        self.__issues: dict[tuple[str, Optional[int]], list[float]] = {} # (classification, start_day) -> [count, criticality_sum]
+
+    def add(self, report: Report) -> None:
+        if report.review_id in self.__review_ids:
+            return
+        self.__review_ids.add(report.review_id)
+
+        weight = report.report_weight
+        keyframes = sorted(report.reliability_keyframes, key=lambda k: k.rel_timestamp)
+        for keyframe in keyframes:
+            self.__add_sentiment(self.__bin(keyframe.rel_timestamp), weight, keyframe.sentiment)
+        for keyframe, following in zip(keyframes, keyframes[1:]):
+            if keyframe.interp == "linear":
+                self.__interpolate(keyframe, following, weight)
+
+        for issue in report.issues:
+            classification = issue.classification or "UNKNOWN_ISSUE"
+            criticality = issue.criticality if issue.criticality is not None else criticalities.get(classification, 0.5)
+            start_day = self.__bin(issue.rel_timestamp) if issue.rel_timestamp is not None else None
+            self.__add_issue(classification, start_day, weight, weight * criticality)
+
+        self.reports += 1
+
+    def merge(self, aggregate: ReliabilityAggregate) -> None:
+        if aggregate.product_id != self.product_id:
+            raise ValueError(f"Can not merge the aggregate of {aggregate.product_id} into {self.product_id}")
+        if aggregate.bin_days != self.bin_days:
+            raise ValueError(f"Can not merge aggregates with bins of {aggregate.bin_days} and {self.bin_days} days")
+
+        # A redelivered or republished message publishes the same delta again
+        merged = [delta_id for delta_id in aggregate.delta_ids if delta_id in self.__delta_ids]
+        if merged and len(merged) == len(aggregate.delta_ids):
+            return
+        if merged:
+            raise ValueError(f"The aggregate of {aggregate.product_id} already contains {len(merged)} of the "
+                f"{len(aggregate.delta_ids)} deltas being merged, recompute it from the reports instead")
+        self.__delta_ids.extend(aggregate.delta_ids)
+
+        for sentiment in aggregate.sentiment:
+            totals = self.__sentiment.setdefault(sentiment.start_day, [0, 0])
+            totals[0] += sentiment.weight
+            totals[1] += sentiment.sentiment_sum
+        for issue in aggregate.issues:
+            self.__add_issue(issue.classification, issue.start_day, issue.count, issue.criticality_sum)
+        self.reports += aggregate.reports
+
+    def aggregate(self) -> ReliabilityAggregate:
+        return ReliabilityAggregate(
+            product_id=self.product_id,
+            bin_days=self.bin_days,
+            reports=self.reports,
+            sentiment=[SentimentBin(start_day, weight, sentiment_sum)
+                for start_day, (weight, sentiment_sum) in sorted(self.__sentiment.items())],
+            issues=[IssueBin(classification, start_day, count, criticality_sum)
+                for (classification, start_day), (count, criticality_sum)
+                in sorted(self.__issues.items(), key=lambda item: (item[0][0], item[0][1] is not None, item[0][1] or 0))],
+            delta_ids=self.__latest_delta_ids())
+
+    def __latest_delta_ids(self) -> list[str]:
+        delta_ids = deque(self.__delta_ids, maxlen=self.__delta_ids.maxlen)
+        if self.__review_ids:
+            delta_ids.append(self.delta_id or hashlib.sha1("\n".join(sorted(self.__review_ids)).encode()).hexdigest())
+        return list(delta_ids)
+
+    def __bin(self, day: int) -> int:
+        return day // self.bin_days * self.bin_days
+
+    def __add_sentiment(self, start_day: int, weight: float, sentiment: float) -> None:
+        totals = self.__sentiment.setdefault(start_day, [0, 0])
+        totals[0] += weight
+        totals[1] += weight * sentiment
+
+    def __add_issue(self, classification: str, start_day: Optional[int], count: float, criticality_sum: float) -> None:
+        totals = self.__issues.setdefault((classification, start_day), [0, 0])
+        totals[0] += count
+        totals[1] += criticality_sum
+
+    def __interpolate(self, keyframe: Keyframe, following: Keyframe, weight: float) -> None:
+        '''
+        Adds the linearly interpolated sentiment at the middle of every bin strictly between the bins of two keyframes.
+        '''
+        span = following.rel_timestamp - keyframe.rel_timestamp
+        for start_day in range(self.__bin(keyframe.rel_timestamp) + self.bin_days, self.__bin(following.rel_timestamp), self.bin_days):
+            progress = (start_day + self.bin_days / 2 - keyframe.rel_timestamp) / span
+            self.__add_sentiment(start_day, weight, keyframe.sentiment + (following.sentiment - keyframe.sentiment) * progress)
+
+def aggregate_reports(product_id: str, reports: Iterable[Report], bin_days: int, delta_id: Optional[str] = None) -> ReliabilityAggregate:
+    '''
+    Aggregate of the given reports, e.g. the delta for the reports of one message, with the message's digest as delta_id.
+    '''
+    aggregator = ReliabilityAggregator(product_id, bin_days, delta_id)
+    for report in reports:
+        aggregator.add(report)
+    return aggregator.aggregate()
+
+def merge_aggregates(aggregates: Iterable[ReliabilityAggregate]) -> ReliabilityAggregate:
+    '''
+    Adds up aggregates of the same product, e.g. the stored aggregate and the deltas published since.
+    '''
+    merged = list(aggregates)
+    if not merged:
+        raise ValueError("No aggregates to merge")
+    aggregator = ReliabilityAggregator(merged[0].product_id, merged[0].bin_days)
+    for aggregate in merged:
+        aggregator.merge(aggregate)
+    return aggregator.aggregate()
+
+def sentiment_curve(aggregate: ReliabilityAggregate) -> list[tuple[int, float]]:
+    '''
+    Mean sentiment per bin, as (start_day, sentiment) pairs.
+    '''
+    return [(sentiment.start_day, sentiment.sentiment_sum / sentiment.weight) for sentiment in aggregate.sentiment if sentiment.weight]
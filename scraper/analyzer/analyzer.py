@@ -1,11 +1,14 @@
 #analyzer.py: Main script of the analyzer module. 
 #See README.md and docstrings/comments for more information.
-from dataclasses import dataclass
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from dateutil.parser import isoparse
-from typing import Tuple, Optional, Any
+from functools import lru_cache
+from typing import Iterator, Tuple, Optional, Any
 import os
+import time
 
+import numpy as np
 import spacy
 from spacy.tokens import Doc, Token, Span
 from spacy.symbols import xcomp, ccomp, aux
@@ -13,14 +16,22 @@ from textblob.classifiers import NaiveBayesClassifier
 from sutime import SUTime
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
+from analyzer.cascade import NEAR_THRESHOLD, TIME_WITHOUT_CLAUSE, CascadeRouter, Route, clause_ambiguities, \
+    near_threshold, reports_agree
 from analyzer.issues import criticalities
+from analyzer.report import Keyframe, Issue, Report
+from analyzer.trace import ReviewTrace, trace_sink_from_env
 from parsing.amazon import Review
-from utils.env import get_env
+from utils.env import get_env, get_env_bool, get_env_float, get_env_int
+from utils.metrics import registry
 
-# Large EN model has word vectors and a bunch of goodies, but maybe slightly slower.
-# You can swap the uncommented and commented lines below to test performance with both.
-_nlp = spacy.load("en_core_web_lg")
-#_nlp = spacy.load("en_core_web_sm")
+# Large EN model has word vectors and a bunch of goodies, but is slower than en_core_web_sm.
+_nlp_model = get_env("ANALYZER_NLP_MODEL")
+_nlp = spacy.load(_nlp_model)
+# In cascade mode every review is parsed with the small model first, and again with the large one only if the result is ambiguous
+_nlp_small_model = get_env("ANALYZER_CASCADE_SMALL_MODEL") if get_env_bool("ANALYZER_CASCADE") else ""
+_nlp_small = spacy.load(_nlp_small_model) if _nlp_small_model else None
+cascade = CascadeRouter(margin=get_env_float("ANALYZER_CASCADE_MARGIN"), audit_rate=get_env_float("ANALYZER_CASCADE_AUDIT_RATE"))
 
 #Trains classifiers for:
 #Relevance of clause to product ownership experience
@@ -35,62 +46,48 @@ with open('analyzer/train_issue_detection.json', 'r') as fp:
 with open('analyzer/train_issue_class.json', 'r', encoding='utf-8') as fp:
     _cl_issue_class = NaiveBayesClassifier(fp, format="json")
 
+# Many reviews share short clauses such as "Works great", so classifier results are cached by text
+_classifier_cache_size = get_env_int("ANALYZER_CLASSIFIER_CACHE_SIZE")
+_classify_relevance = lru_cache(maxsize=_classifier_cache_size)(_cl_relevance.prob_classify)
+_classify_issue_detect = lru_cache(maxsize=_classifier_cache_size)(_cl_issue_detect.prob_classify)
+_classify_issue_class = lru_cache(maxsize=_classifier_cache_size)(_cl_issue_class.prob_classify)
+
 _sent_analyzer = SentimentIntensityAnalyzer() #VADER library
-_sutime = SUTime(mark_time_ranges=True, include_range=True, jars=os.path.join(os.path.dirname(__file__), 'jars'))
-_debug = get_env("DEBUG") in ["1", "True", "true"]
+_sutime = SUTime(mark_time_ranges=True, include_range=True, jars=os.path.join(os.path.dirname(__file__), 'jars'),
+                 jvm_flags=[f"-Xmx{get_env('ANALYZER_JVM_MAX_HEAP')}"] if get_env('ANALYZER_JVM_MAX_HEAP') else None)
+# Samples reviews for structured traces, see trace.py. DEBUG traces every review.
+trace_sink = trace_sink_from_env()
 _THRESHOLD_OWNERSHIP_REL = float(get_env("ANALYZER_THRESHOLD_OWNERSHIP_REL"))
 _THRESHOLD_ISSUE_REL = float(get_env("ANALYZER_THRESHOLD_ISSUE_REL"))
 _THRESHOLD_ISSUE_CLASS = float(get_env("ANALYZER_THRESHOLD_ISSUE_CLASS"))
 _THRESHOLD_CCOMP_MAX_DIST = 25
 _punct_whitelist = ['(', ')', '“', '”', '"', '\'']
-_debug_clause_tracker = []
-
-@dataclass
-class Keyframe:
-    rel_timestamp: int
-    text: str
-    time_start: int
-    time_end: int
-    sentiment: float
-    interp: Optional[str] = None
-
-@dataclass
-class Issue:
-    text: str
-    classification: Optional[str]
-    criticality: Optional[float]
-    rel_timestamp: Optional[int]
-    frequency: Optional[str]
-    image: Optional[str]
-    resolution: Optional[str]
-
-@dataclass
-class Report:
-    review_id: str
-    report_weight: float
-    reliability_keyframes: list[Keyframe]
-    issues: list[Issue]
-
-    def __str__(self):
-        '''
-        Fancy printing method.
-        '''
-        result = f"REPORT FOR REVIEW #{self.review_id} (weight: {self.report_weight})\n"
-        result += "Keyframes:\n"
-
-        for keyframe in self.reliability_keyframes:
-            result += f"• Keyframe: {keyframe.text} (rel. timestamp: {keyframe.rel_timestamp}, sentiment: {keyframe.sentiment})\n"
-
-        if len(self.issues) > 0:
-            result += "Issues:\n"
-
-            for issue in self.issues:
-                result += f"• Issue: {issue.text} (classification: {issue.classification}, criticality: {issue.criticality}, "
-                result += f"rel. timestamp: {issue.rel_timestamp})\n"
-
-        return result
-
-def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: int) -> list[Keyframe]:
+
+_stage_seconds = registry.histogram("scraper_analyzer_stage_seconds", "Time spent in each stage of analyzing a review", ("stage",))
+_classifier_cache = registry.counter_function("scraper_analyzer_classifier_cache_total",
+    "Classifier cache lookups, by classifier and result (hit or miss)", ("classifier", "result"))
+
+def _track_classifier_cache(name: str, classify: Any) -> None:
+    _classifier_cache.track(lambda: classify.cache_info().hits, (name, "hit"))
+    _classifier_cache.track(lambda: classify.cache_info().misses, (name, "miss"))
+
+_track_classifier_cache("relevance", _classify_relevance)
+_track_classifier_cache("issue_detect", _classify_issue_detect)
+_track_classifier_cache("issue_class", _classify_issue_class)
+
+@contextmanager
+def _stage(name: str, trace: ReviewTrace | None) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stage_seconds.observe(elapsed, (name,))
+        if trace:
+            trace.seconds[name] = elapsed
+
+def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: int, trace: ReviewTrace | None = None,
+        ambiguities: list[str] | None = None) -> list[Keyframe]:
     '''
     Returns a list of ownership-relevant keyframes, sorted by time relative to first keyframe (assumed to be date of sale).
 
@@ -107,6 +104,8 @@ def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: i
             clauses (list[Span]): extracted document clauses
             review_text_doc (Doc): spaCy document object
             review_date (int): the review date as a UTC timestamp
+            trace (ReviewTrace | None): records every time expression and its relevance if the review is traced
+            ambiguities (list[str] | None): collects the reasons the result may differ with the large model, in cascade mode
 
         Returns:
             keyframes (list[Keyframe]): Sorted keyframes
@@ -119,15 +118,9 @@ def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: i
     parse_results = _sutime.parse(review_text_doc.text, str(datetime.utcfromtimestamp(review_date)))
 
     for result in parse_results:
-        if _debug:
-            print(f"DEBUG | Type {result['type']} | Value {result['value']}")
-
         # TODO: Support for other time expression categories, e.g. periodic
         if result['type'] in ['DATE', 'TIME'] and result['value'] not in ['PAST_REF', 'FUTURE_REF']:
             try:
-                if _debug:
-                    print(f"DEBUG | Parsing date '{result['value']}'")
-
                 relative_date = isoparse(str(result['value'])).astimezone(timezone.utc)
             except ValueError:
                 if result['value'] != 'PRESENT_REF':
@@ -138,9 +131,6 @@ def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: i
                 # If this happens, isoparse will yield an "OSError: Invalid argument" on Windows
                 continue # Skip false-positives from SUTime
 
-            if _debug:
-                print(f"DEBUG | Type {result['type']} | Value {result['value']} => Parsed {relative_date}")
-
             #ensuring start and end offset correspond to document token boundaries
             token_start = result['start'] #default if adjustment fails, may lead to None time_expression_span
             prev_whitespace = 0
@@ -155,9 +145,11 @@ def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: i
             # Find relevant clause & filter out time expr
             time_expression_span = review_text_doc.char_span(token_start, token_end)
             relevant_phrase = None
+            in_clause = False
 
             for clause in clauses:
                 if time_expression_span.text in clause.text:
+                    in_clause = True
                     rel_phrase = []
 
                     for t in clause: # Copy clause but exclude the time expression itself
@@ -177,20 +169,22 @@ def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: i
 
             if not relevant_phrase:
                 relevant_phrase = time_expression_span.sent.text
+            if ambiguities is not None and not in_clause:
+                ambiguities.append(TIME_WITHOUT_CLAUSE)
 
             # Filter them based on relevance to product ownership (90% should be a very reasonable threshold with few false negatives)
-            relevance_to_ownership_exp = _cl_relevance.prob_classify(relevant_phrase).prob("relevant")
+            relevance_to_ownership_exp = _classify_relevance(relevant_phrase).prob("relevant")
 
-            if relevance_to_ownership_exp >= _THRESHOLD_OWNERSHIP_REL:
+            kept = relevance_to_ownership_exp >= _THRESHOLD_OWNERSHIP_REL
+            if ambiguities is not None and near_threshold(relevance_to_ownership_exp, _THRESHOLD_OWNERSHIP_REL, cascade.margin):
+                ambiguities.append(NEAR_THRESHOLD)
+            if kept:
                 time_expressions.append((relative_date.date(), relevant_phrase, time_expression_span))
-                if _debug:
-                    print(f"DEBUG | Time expression: {time_expressions[-1]}")
-            else:
-                print(f"WARNING: Filtered expression '{relevant_phrase}' based on relevance to "
-                    f"ownership experience (prob = {relevance_to_ownership_exp:.2f})")
-
-        if _debug:
-            print("DEBUG | ---")
+            if trace:
+                trace.add("time_expressions", type=result['type'], value=str(result['value']), date=relative_date.date().isoformat(),
+                    phrase=relevant_phrase, relevance=relevance_to_ownership_exp, kept=kept)
+        elif trace:
+            trace.add("time_expressions", type=result['type'], value=str(result['value']), kept=False)
 
     # 2. Find the earliest time expression and set that as our reference point (date of sale)
     ref_date = datetime.utcfromtimestamp(review_date).date()
@@ -205,14 +199,18 @@ def _extract_keyframes(clauses: list[Span], review_text_doc: Doc, review_date: i
                                   time_start = time_expression[2].start,
                                   time_end = time_expression[2].end,
                                   sentiment = round((_sent_analyzer.polarity_scores(time_expression[1])['compound']+1)/2, 2),
-                                  interp = None)) # TODO: Keyframe interpolation
+                                  interp = None))
 
     # TODO: Add sentiment from potentially related but independent clauses! (e.g. "(...) on March 12th. Terrible quality!")
 
-    #4. Return keyframes sorted by time
-    return sorted(keyframes, key = lambda k: k.rel_timestamp)
+    #4. Return keyframes sorted by time, sentiment is interpolated linearly from each keyframe to the next one
+    keyframes.sort(key = lambda k: k.rel_timestamp)
+    for keyframe in keyframes[:-1]:
+        keyframe.interp = "linear"
+    return keyframes
 
-def _extract_issues(doc_clauses: list[Span], keyframes: list[Keyframe]) -> list[Issue]:
+def _extract_issues(doc_clauses: list[Span], keyframes: list[Keyframe], trace: ReviewTrace | None = None,
+        ambiguities: list[str] | None = None) -> list[Issue]:
     '''
     Returns a list of issues with the product.
 
@@ -226,6 +224,8 @@ def _extract_issues(doc_clauses: list[Span], keyframes: list[Keyframe]) -> list[
         Parameters:
             doc_clauses (list[Span]): List of independent document clauses
             keyframes (list[Keyframe]): List of keyframes to relate issues to
+            trace (ReviewTrace | None): records the classifier scores of every clause if the review is traced
+            ambiguities (list[str] | None): collects the reasons the result may differ with the large model, in cascade mode
 
         Returns:
             issues (list[Issue]): Product issues
@@ -234,21 +234,33 @@ def _extract_issues(doc_clauses: list[Span], keyframes: list[Keyframe]) -> list[
     # 1. Find clauses that describe issues
     issue_clauses: list[Tuple[Span, str]] = []
     for clause in doc_clauses:
-        prob_dist = _cl_issue_class.prob_classify(clause.text)
+        prob_dist = _classify_issue_class(clause.text)
         class_probabilities = [(sample, prob_dist.prob(sample)) for sample in prob_dist.samples()]
         class_probabilities.sort(key=lambda x: x[1], reverse=True)
-        found_via_class = False
+        classification = None
 
         for class_probability in class_probabilities:
             if class_probability[0] != "UNKNOWN_ISSUE" and class_probability[1] > _THRESHOLD_ISSUE_CLASS:
-                issue_clauses.append((clause, class_probability[0]))
-                found_via_class = True
-                print(f"FOUND ISSUE w/ CLASS: {clause.text} => {class_probability[0]}, p: {class_probability[1]}")
+                classification = class_probability[0]
                 break
 
-        if not found_via_class and _cl_issue_detect.prob_classify(clause.text).prob("is_issue") >= 0.9:
-            issue_clauses.append((clause, "UNKNOWN_ISSUE"))
-            print(f"FOUND ISSUE: {clause.text}")
+        issue_probability = None
+        if classification is None:
+            issue_probability = _classify_issue_detect(clause.text).prob("is_issue")
+            if issue_probability >= 0.9:
+                classification = "UNKNOWN_ISSUE"
+
+        if ambiguities is not None:
+            top_class = next((probability for sample, probability in class_probabilities if sample != "UNKNOWN_ISSUE"), 0.0)
+            if near_threshold(top_class, _THRESHOLD_ISSUE_CLASS, cascade.margin) or \
+                    (issue_probability is not None and near_threshold(issue_probability, 0.9, cascade.margin)):
+                ambiguities.append(NEAR_THRESHOLD)
+
+        if classification is not None:
+            issue_clauses.append((clause, classification))
+        if trace:
+            trace.add("clauses", text=clause.text, top_classes=dict(class_probabilities[:3]), is_issue=issue_probability,
+                classification=classification)
 
     # 2. Iterate through clauses and create/merge issues
     temp_issues: dict[Tuple[str, Optional[int]], Issue] = {}
@@ -387,15 +399,13 @@ def _extract_clauses(doc: Doc) -> list[Span]:
         else:
             final_clauses.append(clause)
 
-    if _debug:
-        print(f"DEBUG | clauses: {final_clauses}")
-
     return final_clauses
 
 def _process_review(review: Review) -> Report:
     '''
     Private method to process a review and generate an actionable report.
     Calls upon private methods to extract clauses, keyframes and issues from the review text.
+    In cascade mode the review is parsed with the small model first, see _process_review_cascaded.
 
         Parameters:
             review (Review): review to process
@@ -403,17 +413,66 @@ def _process_review(review: Review) -> Report:
         Returns:
             report (Report): resulting report
     '''
-    doc = _nlp(review.text)
-    clauses = _extract_clauses(doc)
-    if _debug:
-        global _debug_clause_tracker
-        _debug_clause_tracker.extend([f'{clause.text}' for clause in clauses])
-        with open('clause_tracker.txt', 'w', encoding='utf-8') as file:
-            file.write(str(_debug_clause_tracker))
+    trace = trace_sink.start(review.review_id) if trace_sink else None
+
+    if _nlp_small is None:
+        report = _analyze(_nlp, review, trace)
+    else:
+        report = _process_review_cascaded(_nlp_small, review, trace)
+
+    if trace and trace_sink:
+        trace_sink.write(trace)
+    return report
+
+def _process_review_cascaded(nlp_small: Any, review: Review, trace: ReviewTrace | None) -> Report:
+    '''
+    Parses the review with the small model, and again with the large model if the small model's result is ambiguous
+    (see cascade.py), or if the review is audited. Audited reviews keep the small model's report,
+    they only measure how often it agrees with the large model's.
 
+        Parameters:
+            nlp_small (Language): small spaCy pipeline
+            review (Review): review to process
+            trace (ReviewTrace | None): trace of the review, describes the report that is returned
 
-    keyframes = _extract_keyframes(clauses, doc, review.date)
-    issues = _extract_issues(clauses, keyframes)
+        Returns:
+            report (Report): resulting report
+    '''
+    ambiguities: list[str] = []
+    report = _analyze(nlp_small, review, trace, ambiguities, stage_prefix="small_")
+    route = cascade.route(ambiguities)
+
+    agreed = None
+    if route != Route.SMALL:
+        if trace and route == Route.ESCALATED:
+            trace.events.clear()
+        large_report = _analyze(_nlp, review, trace if route == Route.ESCALATED else None)
+        agreed = reports_agree(report, large_report)
+        if route == Route.ESCALATED:
+            report = large_report
+
+    cascade.record(route, ambiguities, agreed)
+    if trace:
+        trace.add("routing", route=route.value, reasons=sorted(set(ambiguities)), agreed=agreed)
+    return report
+
+def _analyze(nlp: Any, review: Review, trace: ReviewTrace | None, ambiguities: list[str] | None = None,
+        stage_prefix: str = "") -> Report:
+    '''
+    Extracts clauses, keyframes and issues of the review with the given spaCy pipeline.
+    If ambiguities is given, the reasons the result may be different with the large model are added to it.
+    '''
+    with _stage(f"{stage_prefix}nlp", trace):
+        doc = nlp(review.text)
+    with _stage(f"{stage_prefix}clauses", trace):
+        clauses = _extract_clauses(doc)
+        if ambiguities is not None:
+            ambiguities.extend(clause_ambiguities([[t.i for t in sent if not t.is_punct and not t.is_space] for sent in doc.sents],
+                [(clause.start, clause.end) for clause in clauses]))
+    with _stage(f"{stage_prefix}keyframes", trace):
+        keyframes = _extract_keyframes(clauses, doc, review.date, trace, ambiguities)
+    with _stage(f"{stage_prefix}issues", trace):
+        issues = _extract_issues(clauses, keyframes, trace, ambiguities)
 
     return Report(
             review_id = review.review_id,
@@ -421,6 +480,40 @@ def _process_review(review: Review) -> Report:
             reliability_keyframes = keyframes,
             issues = issues)
 
+def vocab_size() -> int:
+    '''
+    Number of strings in the spaCy vocabularies, which grow with every new token in the processed reviews.
+    '''
+    return len(_nlp.vocab.strings) + (len(_nlp_small.vocab.strings) if _nlp_small is not None else 0)
+
+def reset_vocab() -> None:
+    '''
+    Replaces the spaCy pipelines with freshly loaded ones, dropping everything reviews added to their vocabularies.
+    Reviews that are being processed finish with the pipelines they started with.
+    '''
+    global _nlp, _nlp_small
+    _nlp = spacy.load(_nlp_model)
+    if _nlp_small_model:
+        _nlp_small = spacy.load(_nlp_small_model)
+
+def vector_width() -> int:
+    '''
+    Number of dimensions of the word vectors of the spaCy model.
+    '''
+    return int(_nlp.vocab.vectors.shape[1])
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    '''
+    Mean word vector of each text, one row per text. Only tokenizes the texts, so it is much cheaper than running the pipeline.
+    Texts without any known word get a row of zeros.
+    '''
+    vectors = np.zeros((len(texts), vector_width()), dtype=np.float32)
+    for i, text in enumerate(texts):
+        doc = _nlp.make_doc(text)
+        if doc.has_vector:
+            vectors[i] = doc.vector
+    return vectors
+
 def process_reviews(reviews: list[Review]) -> list[Report]:
     '''
     Public method to process a set of reviews.
@@ -0,0 +1,111 @@
+#cascade.py: Routing of reviews between a small and a large spaCy model, see the Model Cascade section of the README.
+#Kept free of model loading like report.py, the analyzer reports why the small model's output was ambiguous.
+from collections import Counter
+from enum import Enum
+import random
+import threading
+
+from analyzer.report import Report
+from utils.metrics import registry
+
+# Why a review parsed with the small model is parsed again with the large one
+CLAUSE_OVERLAP = "clause_overlap" # Two clauses claim the same words
+CLAUSE_MISSING = "clause_missing" # A sentence with words ended up in no clause
+TIME_WITHOUT_CLAUSE = "time_without_clause" # A time expression is not part of any clause
+NEAR_THRESHOLD = "near_threshold" # A classifier probability is within the margin of its threshold
+
+_routes = registry.counter("scraper_analyzer_cascade_routes_total",
+    "Reviews by the model that produced their report: small, escalated to large, or small with a large audit", ("route",))
+_reasons = registry.counter("scraper_analyzer_cascade_reasons_total", "Reasons reviews were escalated to the large model", ("reason",))
+_agreement = registry.counter("scraper_analyzer_cascade_agreement_total",
+    "Escalated and audited reviews by whether both models produced the same report", ("route", "result"))
+
+class Route(str, Enum):
+    SMALL = "small"
+    ESCALATED = "escalated"
+    AUDITED = "audited"
+
+def near_threshold(probability: float, threshold: float, margin: float) -> bool:
+    return abs(probability - threshold) < margin
+
+def clause_ambiguities(sentences: list[list[int]], clauses: list[tuple[int, int]]) -> list[str]:
+    '''
+    Checks extracted clauses against the sentences they came from.
+
+        Parameters:
+            sentences (list[list[int]]): indices of the word tokens (no punctuation or spaces) of each sentence
+            clauses (list[tuple[int, int]]): token start and end of each clause, in text order
+
+        Returns:
+            reasons (list[str]): CLAUSE_OVERLAP and/or CLAUSE_MISSING, empty if the clauses are consistent
+    '''
+    reasons = []
+    if any(clauses[i][1] > clauses[i + 1][0] for i in range(len(clauses) - 1)):
+        reasons.append(CLAUSE_OVERLAP)
+    if any(words and not any(start <= word < end for word in words for start, end in clauses) for words in sentences):
+        reasons.append(CLAUSE_MISSING)
+    return reasons
+
+def reports_agree(a: Report, b: Report) -> bool:
+    '''
+    Whether two reports of the same review found the same keyframe times and the same issues at the same times.
+    Texts are not compared, clause boundaries differ between models even when the findings are the same.
+    '''
+    return sorted(keyframe.rel_timestamp for keyframe in a.reliability_keyframes) == \
+        sorted(keyframe.rel_timestamp for keyframe in b.reliability_keyframes) and \
+        sorted((issue.classification or "", issue.rel_timestamp or -1) for issue in a.issues) == \
+        sorted((issue.classification or "", issue.rel_timestamp or -1) for issue in b.issues)
+
+class CascadeRouter:
+    '''
+    Decides which reviews the large model parses again: those whose small model output was ambiguous,
+    and an audit_rate share of the rest, to measure how often the small model alone agrees with the large one.
+    Keeps the counts of routes, reasons and agreements. Thread safe.
+    '''
+
+    def __init__(self, margin: float, audit_rate: float, rng: random.Random | None = None) -> None:
+        self.margin = margin
+        self.audit_rate = audit_rate
+        self.routes: Counter[Route] = Counter()
+        self.reasons: Counter[str] = Counter()
+        self.agreed: Counter[Route] = Counter()
+        self.compared: Counter[Route] = Counter()
+        self.__rng = rng or random.Random()
+        self.__lock = threading.Lock()
+
+    def route(self, reasons: list[str]) -> Route:
+        if reasons:
+            return Route.ESCALATED
+        if self.audit_rate > 0 and self.__rng.random() < self.audit_rate:
+            return Route.AUDITED
+        return Route.SMALL
+
+    def record(self, route: Route, reasons: list[str], agreed: bool | None = None) -> None:
+        '''
+        Records a routed review, and whether both models agreed if it was parsed by both.
+        '''
+        with self.__lock:
+            self.routes[route] += 1
+            self.reasons.update(set(reasons))
+            if agreed is not None:
+                self.compared[route] += 1
+                self.agreed[route] += agreed
+        _routes.inc(labels=(route.value,))
+        for reason in set(reasons):
+            _reasons.inc(labels=(reason,))
+        if agreed is not None:
+            _agreement.inc(labels=(route.value, "agreed" if agreed else "disagreed"))
+
+    def agreement_rate(self, route: Route) -> float | None:
+        '''
+        Share of the reviews of a route for which both models produced the same report, None before any were compared.
+        '''
+        with self.__lock:
+            return self.agreed[route] / self.compared[route] if self.compared[route] else None
+
+    def describe(self) -> str:
+        with self.__lock:
+            total = sum(self.routes.values())
+            routes = ", ".join(f"{route.value} {count / total:.0%}" for route, count in self.routes.items()) if total else "none"
+            agreement = ", ".join(f"{route.value} {self.agreed[route] / count:.0%}" for route, count in self.compared.items() if count)
+        return f"routes: {routes}; agreement: {agreement or 'not measured yet'}"
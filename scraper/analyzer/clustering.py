@@ -0,0 +1,168 @@
+#clustering.py: Groups similar issues across the reviews of a product, e.g. thousands of UNKNOWN_ISSUE clauses into a few actionable clusters.
+#Kept free of model loading like report.py, the analyzer provides the embedding of issue texts (see analyzer.embed_texts).
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+import threading
+from typing import Callable
+
+import numpy as np
+
+from analyzer.report import Report
+
+@dataclass(slots=True)
+class IssueAssignment:
+    product_id: str
+    review_id: str
+    issue_index: int
+    cluster_id: int # -1 if the issue text has no word vectors
+
+@dataclass(slots=True)
+class IssueCluster:
+    product_id: str
+    cluster_id: int
+    size: int
+    classification: str
+    classifications: dict[str, int]
+    examples: list[str]
+
+class IssueClusterIndex:
+    '''
+    Clusters vectors incrementally: a vector joins the cluster whose centroid is most similar to it if their
+    cosine similarity is at least threshold, and starts a new cluster otherwise.
+
+    Candidate clusters are found with random hyperplane hashing. Each of the tables hashes a vector to the signs of
+    its projections on bits random hyperplanes, and a cluster is listed under the hashes of all its members.
+    A vector is only compared to the clusters that share one of its hashes, never to all of them,
+    so adding a vector stays cheap with hundreds of thousands of issues.
+    '''
+
+    def __init__(self, dimensions: int, threshold: float, bits: int, tables: int, seed: int = 0) -> None:
+        self.dimensions = dimensions
+        self.threshold = threshold
+        self.bits = bits
+        self.tables = tables
+        self.sizes: list[int] = []
+        self.__planes = _hyperplanes(seed, tables * bits, dimensions)
+        self.__bit_values = 1 << np.arange(bits, dtype=np.int64)
+        self.__buckets: list[dict[int, set[int]]] = [{} for _ in range(tables)]
+        self.__sums = np.zeros((8, dimensions), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def add(self, vectors: np.ndarray) -> list[int]:
+        '''
+        Assigns each row to a cluster, in order, and returns their cluster ids. Rows without a direction (all zeros) get -1.
+        '''
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        norms = np.linalg.norm(vectors, axis=1)
+        units = np.divide(vectors, norms[:, None], out=np.zeros_like(vectors), where=norms[:, None] > 0)
+        signatures = self.signatures(units)
+
+        return [self.__add(unit, signature) if norm > 0 else -1 for unit, norm, signature in zip(units, norms, signatures)]
+
+    def signatures(self, vectors: np.ndarray) -> np.ndarray:
+        '''
+        Hash of each row in each table, shape (rows, tables).
+        '''
+        signs = (vectors @ self.__planes.T > 0).reshape(len(vectors), self.tables, self.bits)
+        return signs @ self.__bit_values
+
+    def centroid(self, cluster_id: int) -> np.ndarray:
+        centroid = self.__sums[cluster_id]
+        return centroid / (np.linalg.norm(centroid) or 1)
+
+    def __add(self, unit: np.ndarray, signature: np.ndarray) -> int:
+        candidates: set[int] = set()
+        for buckets, key in zip(self.__buckets, signature.tolist()):
+            candidates.update(buckets.get(key, ()))
+
+        cluster_id = -1
+        if candidates:
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            centroids = self.__sums[ids]
+            similarities = centroids @ unit / np.maximum(np.linalg.norm(centroids, axis=1), 1e-12)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                cluster_id = int(ids[best])
+
+        if cluster_id < 0:
+            cluster_id = len(self.sizes)
+            self.sizes.append(0)
+            if cluster_id == len(self.__sums):
+                self.__sums = np.concatenate([self.__sums, np.zeros_like(self.__sums)])
+
+        self.__sums[cluster_id] += unit
+        self.sizes[cluster_id] += 1
+        for buckets, key in zip(self.__buckets, signature.tolist()):
+            buckets.setdefault(key, set()).add(cluster_id)
+        return cluster_id
+
+@lru_cache(maxsize=4)
+def _hyperplanes(seed: int, count: int, dimensions: int) -> np.ndarray:
+    '''
+    Random hyperplanes of an index, shared by all indexes with the same parameters, e.g. the indexes of every product.
+    '''
+    return np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+
+class IssueClusterer:
+    '''
+    Clusters the issues of reports as they arrive, embedding their texts with embed.
+    The issues of every product are clustered separately, in an index created with new_index,
+    and cluster ids are only unique within a product.
+    Keeps the classifications and a few example texts of every cluster. Thread safe.
+    '''
+
+    def __init__(self, embed: Callable[[list[str]], np.ndarray], new_index: Callable[[], IssueClusterIndex], examples: int = 3) -> None:
+        self.__embed = embed
+        self.__new_index = new_index
+        self.__examples = examples
+        self.__indexes: dict[str, IssueClusterIndex] = {}
+        self.__classifications: dict[str, list[Counter[str]]] = {}
+        self.__example_texts: dict[str, list[list[str]]] = {}
+        self.__lock = threading.Lock()
+
+    def add_reports(self, product_id: str, reports: list[Report]) -> list[IssueAssignment]:
+        issues = [(report.review_id, i, issue) for report in reports for i, issue in enumerate(report.issues)]
+        if not issues:
+            return []
+        vectors = self.__embed([issue.text for _, _, issue in issues])
+
+        with self.__lock:
+            if product_id not in self.__indexes:
+                self.__indexes[product_id] = self.__new_index()
+                self.__classifications[product_id] = []
+                self.__example_texts[product_id] = []
+            classifications = self.__classifications[product_id]
+            example_texts = self.__example_texts[product_id]
+
+            cluster_ids = self.__indexes[product_id].add(vectors)
+            for (_, _, issue), cluster_id in zip(issues, cluster_ids):
+                if cluster_id < 0:
+                    continue
+                if cluster_id == len(classifications):
+                    classifications.append(Counter())
+                    example_texts.append([])
+                classifications[cluster_id][issue.classification or "UNKNOWN_ISSUE"] += 1
+                if len(example_texts[cluster_id]) < self.__examples:
+                    example_texts[cluster_id].append(issue.text)
+
+        return [IssueAssignment(product_id, review_id, i, cluster_id) for (review_id, i, _), cluster_id in zip(issues, cluster_ids)]
+
+    def clusters(self, min_size: int = 1) -> list[IssueCluster]:
+        '''
+        Clusters of every product with at least min_size issues, largest first. A cluster is labelled with its most common
+        classification other than UNKNOWN_ISSUE, if it has one.
+        '''
+        with self.__lock:
+            clusters = []
+            for product_id, index in self.__indexes.items():
+                for cluster_id, size in enumerate(index.sizes):
+                    if size < min_size:
+                        continue
+                    classifications = self.__classifications[product_id][cluster_id]
+                    known = [classification for classification, _ in classifications.most_common() if classification != "UNKNOWN_ISSUE"]
+                    clusters.append(IssueCluster(product_id, cluster_id, size, known[0] if known else "UNKNOWN_ISSUE",
+                        dict(classifications), list(self.__example_texts[product_id][cluster_id])))
+        return sorted(clusters, key=lambda cluster: cluster.size, reverse=True)
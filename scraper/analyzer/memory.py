@@ -0,0 +1,57 @@
+import os
+import resource
+import sys
+import threading
+from typing import Callable
+
+def rss_bytes() -> int:
+    """
+    Resident memory of this process. Falls back to the peak resident memory where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class MemoryGuard:
+    """
+    Keeps a long running analyzer within its memory limits. Checked between messages:
+    once reviews have added more than vocab_growth_limit strings to the vocabulary it is replaced by a fresh one,
+    and if the process still uses more than rss_limit bytes the worker should be recycled. A limit of 0 disables that check.
+    """
+
+    def __init__(self, vocab_growth_limit: int, rss_limit: int, vocab_size: Callable[[], int], reset_vocab: Callable[[], None],
+            rss: Callable[[], int] = rss_bytes) -> None:
+        self.vocab_growth_limit = vocab_growth_limit
+        self.rss_limit = rss_limit
+        self.vocab_resets = 0
+        self.last_vocab_size = vocab_size()
+        self.last_rss = 0
+        self.__vocab_baseline = self.last_vocab_size
+        self.__vocab_size = vocab_size
+        self.__reset_vocab = reset_vocab
+        self.__rss = rss
+        self.__lock = threading.Lock()
+
+    def vocab_growth(self) -> int:
+        return self.last_vocab_size - self.__vocab_baseline
+
+    def check(self) -> bool:
+        """
+        Resets the vocabulary if it grew past its limit. Returns True if the worker is over its memory limit.
+        """
+        with self.__lock:
+            self.last_vocab_size = self.__vocab_size()
+            if self.vocab_growth_limit > 0 and self.vocab_growth() > self.vocab_growth_limit:
+                print(f"Reviews added {self.vocab_growth()} strings to the vocabulary (limit {self.vocab_growth_limit}), loading a fresh one")
+                self.__reset_vocab()
+                self.vocab_resets += 1
+                self.last_vocab_size = self.__vocab_baseline = self.__vocab_size()
+
+            self.last_rss = self.__rss()
+            if self.rss_limit > 0 and self.last_rss > self.rss_limit:
+                print(f"Using {self.last_rss / 2 ** 20:.0f}MiB of memory (limit {self.rss_limit / 2 ** 20:.0f}MiB), recycling the worker")
+                return True
+            return False
@@ -0,0 +1,49 @@
+#report.py: Records produced by the analyzer, kept free of model loading so they can be used without spaCy.
+#Slotted, since the analyzer holds the reports of a whole product at once.
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(slots=True)
+class Keyframe:
+    rel_timestamp: int
+    text: str
+    time_start: int
+    time_end: int
+    sentiment: float
+    interp: Optional[str] = None
+
+@dataclass(slots=True)
+class Issue:
+    text: str
+    classification: Optional[str]
+    criticality: Optional[float]
+    rel_timestamp: Optional[int]
+    frequency: Optional[str]
+    image: Optional[str]
+    resolution: Optional[str]
+
+@dataclass(slots=True)
+class Report:
+    review_id: str
+    report_weight: float
+    reliability_keyframes: list[Keyframe]
+    issues: list[Issue]
+
+    def __str__(self):
+        '''
+        Fancy printing method.
+        '''
+        result = f"REPORT FOR REVIEW #{self.review_id} (weight: {self.report_weight})\n"
+        result += "Keyframes:\n"
+
+        for keyframe in self.reliability_keyframes:
+            result += f"• Keyframe: {keyframe.text} (rel. timestamp: {keyframe.rel_timestamp}, sentiment: {keyframe.sentiment})\n"
+
+        if len(self.issues) > 0:
+            result += "Issues:\n"
+
+            for issue in self.issues:
+                result += f"• Issue: {issue.text} (classification: {issue.classification}, criticality: {issue.criticality}, "
+                result += f"rel. timestamp: {issue.rel_timestamp})\n"
+
+        return result
@@ -0,0 +1,158 @@
+#trace.py: Structured traces of how reviews were analyzed, for diagnostics in production.
+#Kept free of model loading like report.py, the analyzer records its clauses, time expressions and scores into a ReviewTrace.
+from collections import deque
+import atexit
+import gzip
+import itertools
+import os
+import random
+import threading
+import time
+from typing import IO, Any
+
+from utils.env import get_env, get_env_bool, get_env_float, get_env_int
+from utils.metrics import registry
+from utils.serialization import encode_json
+
+_traces = registry.counter_function("scraper_analyzer_traces_total",
+    "Review traces by outcome (written, or dropped because the buffer was full)", ("outcome",))
+
+class ReviewTrace:
+    '''
+    What happened while analyzing one review: the time of each stage and a list of events of each kind
+    (clauses, time expressions, issues, ...). Only sampled reviews get a trace, so recording is guarded by `if trace:`.
+    '''
+
+    def __init__(self, review_id: str) -> None:
+        self.review_id = review_id
+        self.started_at = time.time()
+        self.seconds: dict[str, float] = {}
+        self.events: dict[str, list[dict[str, Any]]] = {}
+
+    def add(self, kind: str, **fields: Any) -> None:
+        self.events.setdefault(kind, []).append(fields)
+
+    def to_primitive(self) -> dict[str, Any]:
+        return {"review_id": self.review_id, "started_at": self.started_at, "seconds": self.seconds, **self.events}
+
+class TraceSink:
+    '''
+    Writes a sample_rate share of review traces as gzip compressed JSON lines to directory, from a background thread.
+    At most buffer_size traces wait to be written, later ones are dropped instead of slowing down the analysis.
+    A new file is started once the current one reaches file_bytes compressed bytes, and only the newest files are kept.
+    Every batch is written as its own gzip member, so files are valid gzip (and readable with zcat) while they are written.
+    '''
+
+    def __init__(self, directory: str, sample_rate: float, buffer_size: int, file_bytes: int, files: int,
+            rng: random.Random | None = None) -> None:
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.file_bytes = file_bytes
+        self.files = files
+        self.written = 0
+        self.dropped = 0
+        self.__rng = rng or random.Random()
+        self.__buffer: deque[ReviewTrace] = deque()
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__writing = False
+        self.__file: IO[bytes] | None = None
+        self.__file_numbers = itertools.count()
+        self.__thread = threading.Thread(target=self.__run, name="trace-sink", daemon=True)
+        self.__thread.start()
+        _traces.track(lambda: self.written, ("written",))
+        _traces.track(lambda: self.dropped, ("dropped",))
+        atexit.register(self.close)
+
+    def start(self, review_id: str) -> ReviewTrace | None:
+        '''
+        A trace for the review if it is sampled, None otherwise.
+        '''
+        if self.sample_rate <= 0 or self.__closed or (self.sample_rate < 1 and self.__rng.random() >= self.sample_rate):
+            return None
+        return ReviewTrace(review_id)
+
+    def write(self, trace: ReviewTrace) -> None:
+        '''
+        Queues the trace for writing without blocking, or drops it if the buffer is full.
+        '''
+        with self.__condition:
+            if self.__closed or len(self.__buffer) >= self.buffer_size:
+                self.dropped += 1
+                return
+            self.__buffer.append(trace)
+            self.__condition.notify()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        '''
+        Waits until the buffered traces are written. Returns False on timeout.
+        '''
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not self.__buffer and not self.__writing, timeout)
+
+    def close(self) -> None:
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__buffer or self.__closed)
+                batch = list(self.__buffer)
+                self.__buffer.clear()
+                self.__writing = bool(batch)
+            try:
+                if batch:
+                    self.__write(batch)
+            except Exception as e:
+                print(f"Failed to write {len(batch)} traces to {self.directory}: {e!r}")
+                self.dropped += len(batch)
+            finally:
+                with self.__condition:
+                    self.__writing = False
+                    self.__condition.notify_all()
+                    done = self.__closed and not self.__buffer
+            if done:
+                self.__close_file()
+                return
+
+    def __write(self, batch: list[ReviewTrace]) -> None:
+        lines = b"".join(encode_json(trace.to_primitive()) + b"\n" for trace in batch)
+        if self.__file is None:
+            self.__file = self.__open_file()
+        self.__file.write(gzip.compress(lines))
+        self.__file.flush()
+        self.written += len(batch)
+        if self.__file.tell() >= self.file_bytes:
+            self.__close_file()
+
+    def __open_file(self) -> IO[bytes]:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"traces-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self.__file_numbers):04d}.jsonl.gz"
+        file = open(os.path.join(self.directory, name), "wb")
+
+        # The oldest files go once there are more than files, including the one just started
+        traces = sorted(name for name in os.listdir(self.directory) if name.startswith("traces-") and name.endswith(".jsonl.gz"))
+        for old in traces[:max(0, len(traces) - self.files)]:
+            os.remove(os.path.join(self.directory, old))
+        return file
+
+    def __close_file(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+        self.__file = None
+
+def trace_sink_from_env() -> TraceSink | None:
+    '''
+    Traces ANALYZER_TRACE_SAMPLE_RATE of reviews, or all of them with DEBUG set, to ANALYZER_TRACE_DIR. None if neither is set.
+    '''
+    sample_rate = 1 if get_env_bool("DEBUG") else get_env_float("ANALYZER_TRACE_SAMPLE_RATE")
+    if sample_rate <= 0:
+        return None
+    return TraceSink(get_env("ANALYZER_TRACE_DIR"), sample_rate, get_env_int("ANALYZER_TRACE_BUFFER"),
+        get_env_int("ANALYZER_TRACE_FILE_MB") * 2 ** 20, get_env_int("ANALYZER_TRACE_FILES"))
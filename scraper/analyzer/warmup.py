@@ -0,0 +1,60 @@
+"""
+Warm-up of a fresh analyzer before it consumes messages. The first reviews a process analyzes are much slower than the rest:
+spaCy, the SUTime JVM and the classifiers all start cold. Running a corpus through the full analysis first keeps that
+out of the first deliveries, which would otherwise be slow enough after a deploy to miss heartbeats.
+Kept free of model loading like memory.py, the listener passes in the analysis.
+"""
+from dataclasses import dataclass, field
+import time
+from typing import Any, Callable
+
+from parsing.amazon import Review, review_schema
+from utils.serialization import decode_json
+
+@dataclass
+class WarmupResult:
+    reviews: int = 0
+    failed: int = 0
+    seconds: float = 0
+    review_seconds: list[float] = field(default_factory=list)
+
+    def describe(self) -> str:
+        if not self.review_seconds:
+            return "no reviews"
+        return f"{self.reviews} reviews in {self.seconds:.1f}s ({self.failed} failed), " \
+            f"first took {self.review_seconds[0]:.2f}s, last {self.review_seconds[-1]:.2f}s"
+
+def warmup_reviews(path: str, count: int) -> list[Review]:
+    """
+    Up to count reviews from path, a JSON list of reviews in the to_analyze format such as a saved message.
+    Without a path there is no warm-up, as only real reviews exercise the models like production traffic does.
+    """
+    if count <= 0 or not path:
+        return []
+    with open(path, "rb") as f:
+        reviews = decode_json(f.read())
+    if not isinstance(reviews, list):
+        raise ValueError(f"Expected a list of reviews in {path}, got {type(reviews).__name__}")
+    return [review_schema.from_primitive(review) for review in reviews[:count]]
+
+def warm_up(process: Callable[[list[Review]], Any], reviews: list[Review], max_seconds: float,
+        clock: Callable[[], float] = time.monotonic) -> WarmupResult:
+    """
+    Analyzes the reviews one at a time with process, and stops early once max_seconds passed (0 for no limit).
+    Failures are counted but do not stop the warm-up, a review that fails here would fail in production just the same.
+    """
+    result = WarmupResult()
+    start = clock()
+    for review in reviews:
+        if max_seconds > 0 and clock() - start >= max_seconds:
+            break
+        review_start = clock()
+        try:
+            process([review])
+        except Exception as e:
+            print(f"Warm-up review {review.review_id} failed: {e!r}")
+            result.failed += 1
+        result.review_seconds.append(clock() - review_start)
+        result.reviews += 1
+    result.seconds = clock() - start
+    return result
@@ -1,37 +1,131 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import functools
 import json
 from typing import Any, Callable
-from requester.request_maker import request_page
+from crawler.seen_products import SeenProductStore
+from requester.amazon import retry_policy
+from requester.request_maker import RequestError, request_page
+from requester.retry_policy import call_with_retry
 import bs4
 import re
 
 max_pages = 1000
+# Publishes a product message, and calls the second argument once the product is durably enqueued, e.g. confirmed by the broker
+PublishCallback = Callable[[str, Callable[[], None]], None]
 
-def crawl_for_reviews(url: str, page_num: int, review_info: Any, products_to_ignore: set[str], publish_callback: Callable[[str], None]) -> set[str]:
+@dataclass
+class SearchPage:
+    page_num: int
+    product_ids: list[str]
+    is_last_page: bool
+
+def fetch_search_page(url: str, page_num: int) -> SearchPage:
     """
-    Crawl for product urls on a given url on the given page.
+    Fetch a single search result page and extract the product ids linked from it, in page order.
     """
-    html = request_page(url=f"{url}&page={page_num + 1}")
+    html = call_with_retry(lambda: request_page(url=f"{url}&page={page_num + 1}"), retry_policy, retry_on=RequestError)
     page = bs4.BeautifulSoup(html, features="html.parser")
 
-    product_ids_so_far: set[str] = products_to_ignore
-
-    links = page.select("a")
-    for link in links:
+    product_ids: list[str] = []
+    for link in page.select("a"):
         if "href" in link.attrs and "/dp/" in link.attrs["href"]:
             match = re.search(r"\/dp\/(.+?)(\/|\?)", link.attrs["href"])
             if match:
-                product_id = match.group(1)
-                if product_id not in product_ids_so_far:
-                    product_ids_so_far.add(product_id)
-
-                    print(f"Found product {product_id}")
-                    reviews_json = json.dumps({
-                        **review_info,
-                        "id": product_id
-                    })
-
-                    publish_callback(reviews_json)
+                if match.group(1) not in product_ids:
+                    product_ids.append(match.group(1))
             else:
                 print(f"Failed to find product id in {link.attrs['href']}")
-    
-    return product_ids_so_far
\ No newline at end of file
+
+    return SearchPage(page_num=page_num, product_ids=product_ids, is_last_page=__is_last_page(page))
+
+def __is_last_page(page: bs4.BeautifulSoup) -> bool:
+    """
+    Check the pagination strip for a disabled or missing "next" button.
+    Pages without a pagination strip are never considered the last page, the empty page check handles those.
+    """
+    pagination = page.select_one(".s-pagination-strip, ul.a-pagination")
+    if not pagination:
+        return False
+
+    disabled_next = pagination.select_one(".s-pagination-next.s-pagination-disabled, li.a-disabled.a-last")
+    next_link = pagination.select_one("a.s-pagination-next, li.a-last a")
+    return disabled_next is not None or next_link is None
+
+def __publish_new(search_page: SearchPage, review_info: Any, product_ids_so_far: set[str],
+        publish_callback: PublishCallback, seen_store: SeenProductStore | None = None) -> int:
+    """
+    Publish the products of the page that are new to this crawl, and returns how many there were.
+    Products enqueued recently by any crawl are counted as new but not published again.
+    A product is only recorded as enqueued once it is confirmed, so one that was never enqueued is published by a later crawl.
+    """
+    new_count = 0
+    for product_id in search_page.product_ids:
+        if product_id not in product_ids_so_far:
+            product_ids_so_far.add(product_id)
+            new_count += 1
+
+            key = SeenProductStore.key(review_info, product_id)
+            if seen_store and seen_store.is_recent(key):
+                continue
+
+            print(f"Found product {product_id}")
+            reviews_json = json.dumps({
+                **review_info,
+                "id": product_id
+            })
+
+            publish_callback(reviews_json, functools.partial(seen_store.mark_enqueued, key) if seen_store else __enqueued)
+
+    return new_count
+
+def __enqueued() -> None:
+    pass
+
+def crawl_for_reviews(url: str, page_num: int, review_info: Any, products_to_ignore: set[str], publish_callback: PublishCallback) -> set[str]:
+    """
+    Crawl for product urls on a given url on the given page.
+    """
+    __publish_new(fetch_search_page(url, page_num), review_info, products_to_ignore, publish_callback)
+    return products_to_ignore
+
+def crawl_pages(url: str, review_info: Any, products_to_ignore: set[str], publish_callback: PublishCallback,
+        concurrency: int, page_limit: int = max_pages, should_stop: Callable[[], bool] = lambda: False,
+        seen_store: SeenProductStore | None = None, on_page: Callable[[SearchPage, int], None] | None = None) -> set[str]:
+    """
+    Crawl search result pages of the given url with up to `concurrency` pages in flight.
+    Pages are handled in page order, and new product ids are published as soon as their page is handled.
+    If a seen_store is given, products enqueued by any crawl within its TTL are skipped.
+    Stops at the last page according to the pagination markup, at the first page without new products,
+    or when should_stop returns True.
+    on_page is called with each handled page and its number of new products.
+    Publishing happens on the calling thread.
+    """
+    product_ids_so_far = products_to_ignore
+    pending: deque[Future[SearchPage]] = deque()
+    next_page = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="crawl") as executor:
+        while next_page < min(concurrency, page_limit):
+            pending.append(executor.submit(fetch_search_page, url, next_page))
+            next_page += 1
+
+        while pending:
+            search_page = pending.popleft().result()
+            new_count = __publish_new(search_page, review_info, product_ids_so_far, publish_callback, seen_store)
+            if on_page:
+                on_page(search_page, new_count)
+
+            if search_page.is_last_page or new_count == 0 or should_stop():
+                reason = "last page" if search_page.is_last_page else "no new products" if new_count == 0 else "stopped"
+                print(f"Stopping crawl of {url} at page {search_page.page_num + 1} ({reason})")
+                for future in pending:
+                    future.cancel()
+                break
+
+            if next_page < page_limit:
+                pending.append(executor.submit(fetch_search_page, url, next_page))
+                next_page += 1
+
+    return product_ids_so_far
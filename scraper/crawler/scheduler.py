@@ -0,0 +1,192 @@
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+import heapq
+import itertools
+import threading
+import traceback
+from typing import Any, Callable
+import uuid
+
+from crawler.amazon import SearchPage, crawl_pages, max_pages
+from crawler.seen_products import SeenProductStore
+
+class CrawlCancelledError(Exception):
+    """
+    Raised by the publish callback when the job was cancelled while the product waited to be published.
+    """
+
+class CrawlJobState(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+@dataclass
+class CrawlProgress:
+    pages: int = 0
+    products_found: int = 0
+    products_enqueued: int = 0
+
+@dataclass
+class CrawlJob:
+    job_id: str
+    url: str
+    review_info: Any
+    priority: int
+    concurrency: int
+    state: CrawlJobState = CrawlJobState.QUEUED
+    progress: CrawlProgress = field(default_factory=CrawlProgress)
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    def __str__(self) -> str:
+        return f"{self.job_id} ({self.url}, priority {self.priority}, {self.state.value}): {self.progress.pages} pages, " \
+            f"{self.progress.products_found} products found, {self.progress.products_enqueued} enqueued"
+
+class CrawlScheduler:
+    """
+    Runs up to max_jobs crawl jobs at the same time, starting queued jobs in priority order (highest first, then FIFO).
+    All public methods are thread safe and return immediately, so commands can be handled on the connection thread
+    while crawls are running. Only the last history jobs that are done (finished, cancelled or failed) are kept.
+    """
+
+    def __init__(self, max_jobs: int, default_concurrency: int, publish: Callable[[CrawlJob, str, Callable[[], None]], None],
+            seen_store: SeenProductStore | None = None, page_limit: int = max_pages, history: int = 100) -> None:
+        self.default_concurrency = default_concurrency
+        self.page_limit = page_limit
+        self.history = history
+        self.__publish = publish
+        self.__seen_store = seen_store
+        self.__jobs: dict[str, CrawlJob] = {}
+        self.__queue: list[tuple[int, int, str]] = []
+        self.__done: deque[CrawlJob] = deque()
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__running = True
+        self.__workers = [threading.Thread(target=self.__work, name=f"crawl-job-{i}", daemon=True) for i in range(max(1, max_jobs))]
+        for worker in self.__workers:
+            worker.start()
+
+    def submit(self, url: str, review_info: Any, priority: int = 0, concurrency: int | None = None,
+            job_id: str | None = None) -> CrawlJob:
+        """
+        Queue a crawl of the url. Returns the already active job if the url is queued or running.
+        """
+        with self.__condition:
+            for job in self.__jobs.values():
+                if job.url == url and job.state in [CrawlJobState.QUEUED, CrawlJobState.RUNNING]:
+                    return job
+
+            job = CrawlJob(job_id=job_id or uuid.uuid4().hex[:8], url=url, review_info=review_info, priority=priority,
+                concurrency=concurrency or self.default_concurrency)
+            self.__jobs[job.job_id] = job
+            self.__push(job)
+            self.__condition.notify()
+            return job
+
+    def cancel(self, job_id: str | None = None, url: str | None = None) -> list[CrawlJob]:
+        """
+        Cancel the matching queued or running jobs, or all of them if neither job_id nor url is given.
+        Running jobs stop after the page they are currently handling.
+        """
+        with self.__condition:
+            cancelled = [job for job in self.__find(job_id, url) if job.state in [CrawlJobState.QUEUED, CrawlJobState.RUNNING]]
+            for job in cancelled:
+                job.cancel_event.set()
+                if job.state == CrawlJobState.QUEUED:
+                    job.state = CrawlJobState.CANCELLED
+                    self.__retire(job)
+            return cancelled
+
+    def reprioritize(self, priority: int, job_id: str | None = None, url: str | None = None) -> list[CrawlJob]:
+        """
+        Change the priority of the matching queued or running jobs. Only affects the start order of jobs that are still queued.
+        """
+        with self.__condition:
+            jobs = [job for job in self.__find(job_id, url) if job.state in [CrawlJobState.QUEUED, CrawlJobState.RUNNING]]
+            for job in jobs:
+                job.priority = priority
+                if job.state == CrawlJobState.QUEUED:
+                    self.__push(job)
+            return jobs
+
+    def jobs(self) -> list[CrawlJob]:
+        with self.__condition:
+            return list(self.__jobs.values())
+
+    def active_jobs(self) -> list[CrawlJob]:
+        return [job for job in self.jobs() if job.state in [CrawlJobState.QUEUED, CrawlJobState.RUNNING]]
+
+    def shutdown(self, cancel_running: bool = True) -> None:
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        if cancel_running:
+            self.cancel()
+        for worker in self.__workers:
+            worker.join()
+
+    def __find(self, job_id: str | None, url: str | None) -> list[CrawlJob]:
+        return [job for job in self.__jobs.values()
+            if (job_id is None or job.job_id == job_id) and (url is None or job.url == url)]
+
+    def __retire(self, job: CrawlJob) -> None:
+        """
+        Keeps the done job for status commands, and forgets the oldest done jobs beyond the history.
+        """
+        self.__done.append(job)
+        while len(self.__done) > self.history:
+            old = self.__done.popleft()
+            # The job id may have been submitted again since
+            if self.__jobs.get(old.job_id) is old:
+                del self.__jobs[old.job_id]
+
+    def __push(self, job: CrawlJob) -> None:
+        # Reprioritized jobs are pushed again, stale heap entries are skipped in __next_job
+        heapq.heappush(self.__queue, (-job.priority, next(self.__counter), job.job_id))
+
+    def __next_job(self) -> CrawlJob | None:
+        with self.__condition:
+            while self.__running:
+                while self.__queue:
+                    negative_priority, _, job_id = heapq.heappop(self.__queue)
+                    job = self.__jobs.get(job_id)
+                    if job and job.state == CrawlJobState.QUEUED and -negative_priority == job.priority:
+                        job.state = CrawlJobState.RUNNING
+                        return job
+                self.__condition.wait()
+            return None
+
+    def __work(self) -> None:
+        while True:
+            job = self.__next_job()
+            if not job:
+                return
+
+            print(f"Starting crawl job {job}")
+            try:
+                self.__run(job)
+                job.state = CrawlJobState.CANCELLED if job.cancel_event.is_set() else CrawlJobState.FINISHED
+            except CrawlCancelledError:
+                job.state = CrawlJobState.CANCELLED
+            except Exception:
+                traceback.print_exc()
+                job.state = CrawlJobState.FAILED
+            with self.__condition:
+                self.__retire(job)
+            print(f"Crawl job done {job}")
+
+    def __run(self, job: CrawlJob) -> None:
+        def publish(message: str, on_enqueued: Callable[[], None]) -> None:
+            self.__publish(job, message, on_enqueued)
+            job.progress.products_enqueued += 1
+
+        def on_page(search_page: SearchPage, new_count: int) -> None:
+            job.progress.pages += 1
+            job.progress.products_found += new_count
+            print(f"Crawl job {job.job_id} page {search_page.page_num + 1}: {new_count} new products, "
+                f"{job.progress.products_enqueued} enqueued so far")
+
+        crawl_pages(job.url, job.review_info, set(), publish, concurrency=job.concurrency, page_limit=self.page_limit,
+            should_stop=job.cancel_event.is_set, seen_store=self.__seen_store, on_page=on_page)
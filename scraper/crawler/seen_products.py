@@ -0,0 +1,49 @@
+import threading
+import time
+from typing import Any, Callable
+import diskcache
+
+class SeenProductStore:
+    """
+    Persistent record of when each product was last enqueued for parsing, shared by all crawls.
+    Backed by an on-disk hash table, so only the keys that are looked up are held in memory.
+    Entries expire after the TTL, which also keeps the store from growing without bound.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float, clock: Callable[[], float] = time.time) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.enqueued = 0
+        self.skipped = 0
+        self.__cache = diskcache.Cache(directory)
+        self.__clock = clock
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(review_info: Any, product_id: str) -> str:
+        return f"{review_info.get('type', '')}:{review_info.get('region', '')}:{product_id}"
+
+    def is_recent(self, key: str) -> bool:
+        """
+        Returns True, and counts the product as skipped, if it was enqueued within the TTL window.
+        """
+        last_enqueued = self.__cache.get(key)
+        if last_enqueued is not None and self.__clock() - last_enqueued < self.ttl_seconds:
+            with self.__lock:
+                self.skipped += 1
+            return True
+        return False
+
+    def mark_enqueued(self, key: str) -> None:
+        """
+        Records the product as enqueued now. Called only once the broker confirmed it,
+        so a product whose publish failed or whose crawl was cancelled is not skipped for the TTL.
+        """
+        self.__cache.set(key, self.__clock(), expire=self.ttl_seconds)
+        with self.__lock:
+            self.enqueued += 1
+
+    def last_enqueued(self, key: str) -> float | None:
+        return self.__cache.get(key)
+
+    def close(self) -> None:
+        self.__cache.close()
@@ -1,19 +1,34 @@
 import functools
+import hashlib
 import dateutil.parser as dp
 from datetime import timedelta
 import traceback
-from typing import Any
+from typing import Any, Callable
 import pika
 import json
-from analyzer.analyzer import Issue, Report, process_reviews
-from parsing.amazon import Review
-from requester.amazon import AmazonRegion
-from utils import class_to_json
-from utils.env import get_env_bool
+from analyzer.aggregate import ReliabilityAggregate, aggregate_reports
+from analyzer.analyzer import Issue, Report, cascade, process_reviews, reset_vocab, vocab_size
+from analyzer.memory import MemoryGuard
+from analyzer.warmup import warm_up, warmup_reviews
+from listener.control import consume_control_messages, profile_on_start
+from listener.dead_letter import dead_letter_items, dead_letter_queue, retry_or_dead_letter
+from listener.envelope import decode, encode_for_queue
+from listener.metrics import message_seconds, messages, reviews as reviews_metric, workers_busy
+from listener.publisher import OutgoingMessage, Publisher, start_publisher
+from listener.report_sink import report_sink_from_env
+from listener.scheduling import WorkerPool, declare_queue, describe_lane, lane_of
+from parsing.amazon import review_schema
+from pipeline.columnar import export_from_env
+from utils.serialization import to_primitive
+from utils.env import get_env, get_env_bool, get_env_float, get_env_int
+from utils.metrics import registry, start_metrics_exporter
+from utils.readiness import ServiceState, readiness
 from llama_cpp import Llama
 from llama_cpp.llama_grammar import LlamaGrammar
 import threading
+import time
 import os
+import signal
 
 initial_prompt = """
 List each functional issue with the following product described in the review below. If a repair was needed, that is a problem. Ignore comparisons to\
@@ -23,101 +38,236 @@ Example: [{"text": "Belt broke last month so I ordered new ones.", "issue_short_
 ---
 """
 
-def __on_parse_message(channel: pika.adapters.blocking_connection.BlockingChannel,
+memory_guard = MemoryGuard(
+    vocab_growth_limit=get_env_int("ANALYZER_MAX_VOCAB_GROWTH"),
+    rss_limit=get_env_int("ANALYZER_MAX_RSS_MB") * 2 ** 20,
+    vocab_size=vocab_size,
+    reset_vocab=reset_vocab
+)
+registry.gauge_function("scraper_analyzer_rss_bytes", "Resident memory of the analyzer at its last check").track(lambda: memory_guard.last_rss)
+registry.gauge_function("scraper_analyzer_vocab_strings", "Strings in the spaCy vocabulary at its last check").track(
+    lambda: memory_guard.last_vocab_size)
+registry.counter_function("scraper_analyzer_vocab_resets_total", "Times the spaCy vocabulary was replaced by a fresh one").track(
+    lambda: memory_guard.vocab_resets)
+export = export_from_env()
+report_sink = report_sink_from_env()
+# One message is analyzed at a time, the lookahead lets the next one be picked by priority and job
+pool = WorkerPool(1, thread_name_prefix="analyze-worker")
+
+def __on_parse_message(publisher: Publisher, channel: pika.adapters.blocking_connection.BlockingChannel,
         method_frame: pika.spec.Basic.Deliver, header_frame: pika.BasicProperties, body: bytes) -> None:
     """
-    Callback for when a message is received on the parse queue.
-    Will get all reviews for the given product id and publish them to the parsed_reviews queue.
+    Callback for when a message is received on the to_analyze queue.
+    Will analyze all reviews in the message and publish the reports to the reports queue.
     """
     if not method_frame.delivery_tag:
         return
-    
-    t = threading.Thread(target=do_work, args=(channel, method_frame, body))
-    t.start()
 
-def do_work(channel: pika.adapters.blocking_connection.BlockingChannel,
-        method_frame: pika.spec.Basic.Deliver, body: bytes) -> None:
+    pool.submit(do_work, publisher, channel, method_frame, header_frame, body, lane=lane_of(header_frame))
+
+def make_analyze_handler(publisher: Publisher) -> Callable[
+        [pika.adapters.blocking_connection.BlockingChannel, pika.spec.Basic.Deliver, pika.BasicProperties, bytes], None]:
+    """
+    Consumer callback for the to_analyze queue, which analyzes messages on the module's worker pool.
+    """
+    return functools.partial(__on_parse_message, publisher)
+
+def do_work(publisher: Publisher, channel: pika.adapters.blocking_connection.BlockingChannel,
+        method_frame: pika.spec.Basic.Deliver, properties: pika.BasicProperties, body: bytes) -> None:
+    """
+    Reviews that fail to decode or analyze are skipped and sent to the dead-letter queue, the rest are still published.
+    If the message as a whole fails, it is published again up to ANALYZER_MAX_RETRIES times and then dead-lettered.
+    The delivery is always acked, so one bad message can not stall the consumer.
+    Afterwards the memory guard is checked, and consuming stops if the worker should be recycled.
+    """
     if not method_frame.delivery_tag:
         return
 
+    # Based on https://github.com/pika/pika/blob/main/examples/basic_consumer_threaded.py
+    # The ack has to happen on the connection thread, and only once the output is confirmed
+    cb = functools.partial(channel.basic_ack, delivery_tag=method_frame.delivery_tag)
+    ack = functools.partial(channel.connection.add_callback_threadsafe, cb)
+
+    start = time.monotonic()
     try:
-        reviews = json.loads(body)
-        print(reviews)
-        print(f"Received {len(reviews)} items for analyzing")
+        reviews = decode(body, properties)
+        if not isinstance(reviews, list):
+            raise ValueError(f"Expected a list of reviews, got {type(reviews).__name__}")
+        print(f"Received {len(reviews)} items for analyzing ({describe_lane('to_analyze', properties)}, {len(pool.scheduler)} waiting)")
 
-        reports = __analyze_reviews(reviews)
-        reports_json = class_to_json(reports)
+        with workers_busy.track_in_progress(("to_analyze",)):
+            reports, failures = __analyze_reviews(reviews)
+        aggregates = __aggregate_reports(reviews, reports, hashlib.sha1(body).hexdigest())
+        __export(reviews, reports)
+        outgoing = __outgoing_messages([('report_aggregates', aggregates)] if report_sink
+            else [('reports', reports), ('report_aggregates', aggregates)])
         
-        print(f"Finished analyzing {len(reviews)} items")
+        print(f"Finished analyzing {len(reviews)} items, {len(failures)} failed")
+        if cascade.routes:
+            print(f"Model cascade {cascade.describe()}")
 
-        # Based on https://github.com/pika/pika/blob/main/examples/basic_consumer_threaded.py
-        cb = functools.partial(ack_channel, channel, method_frame.delivery_tag, reports_json)
-        channel.connection.add_callback_threadsafe(cb)
-        
-    except Exception:
+        dead_letter_items(publisher, 'to_analyze', failures)
+        if report_sink:
+            # Acked once the reports are committed and the aggregates are confirmed
+            done = __after_all(2 if outgoing else 1, ack)
+            if outgoing:
+                publisher.publish_batch(outgoing, on_confirm=done)
+            report_sink.add(reports, on_commit=done,
+                on_failure=lambda: publisher.publish_batch(__outgoing_messages([('reports', reports)]), on_confirm=done))
+        else:
+            publisher.publish_batch(outgoing, on_confirm=ack)
+
+        messages.inc(labels=("to_analyze", "processed"))
+        reviews_metric.inc(len(reviews) - len(failures), labels=("to_analyze", "processed"))
+        reviews_metric.inc(len(failures), labels=("to_analyze", "failed"))
+        message_seconds.observe(time.monotonic() - start, labels=("to_analyze",))
+    except Exception as e:
         traceback.print_exc()
-        return
-    
-def ack_channel(channel: pika.adapters.blocking_connection.BlockingChannel,
-        delivery_tag: int, reports_json: str) -> None:
-    print(channel.is_open)
-
-    channel.basic_publish(
-        exchange='',
-        routing_key='reports',
-        body=reports_json,
-        properties=pika.BasicProperties(
-            content_type='application/json',
-            delivery_mode=2, # persistent
-        )
-    )
-
-    channel.basic_ack(delivery_tag=delivery_tag)
+        messages.inc(labels=("to_analyze", "failed"))
+        retry_or_dead_letter(publisher, 'to_analyze', body, properties, e, get_env_int("ANALYZER_MAX_RETRIES"), on_confirm=ack)
+
+    if memory_guard.check():
+        channel.connection.add_callback_threadsafe(channel.stop_consuming)
     
+def __outgoing_messages(items_by_queue: list[tuple[str, list[Any]]]) -> list[OutgoingMessage]:
+    """
+    Messages for each queue's items. The reports queue always gets a message, even without reports.
+    """
+    return [OutgoingMessage(queue, message_body, message_properties)
+        for queue, items in items_by_queue if items or queue == 'reports'
+        for message_body, message_properties in encode_for_queue(queue, to_primitive(items))]
+
+def __after_all(count: int, callback: Callable[[], None]) -> Callable[[], None]:
+    """
+    Returns a function that calls callback the count-th time it is called, from any thread.
+    """
+    remaining = [count]
+    lock = threading.Lock()
+
+    def done() -> None:
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+    return done
+
+def __warm_up() -> None:
+    """
+    Analyzes ANALYZER_WARMUP_REVIEWS reviews from ANALYZER_WARMUP_CORPUS before consuming, for at most ANALYZER_WARMUP_MAX_SECONDS.
+    Only runs with ANALYZER_WARMUP_CORPUS set.
+    Runs before connecting to RabbitMQ, so no delivery is held and no heartbeat is missed while the models warm up.
+    """
+    if get_env_bool("TRAINING_MODE"):
+        return
+    try:
+        reviews = warmup_reviews(get_env("ANALYZER_WARMUP_CORPUS"), get_env_int("ANALYZER_WARMUP_REVIEWS"))
+    except Exception as e:
+        print(f"Failed to load the warm-up corpus, starting cold: {e!r}")
+        return
+    result = warm_up(process_reviews, reviews, get_env_float("ANALYZER_WARMUP_MAX_SECONDS"))
+    print(f"Warmed up with {result.describe()}")
+
 def start_analyzing_listener(host: str, port: int) -> None:
+    start_metrics_exporter()
+    readiness.set(ServiceState.WARMING_UP)
+    __warm_up()
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port, heartbeat=10))
     channel = connection.channel()
-    channel.queue_declare(queue='to_analyze', durable=True)
+    declare_queue(channel, 'to_analyze')
     channel.queue_declare(queue='reports', durable=True)
+    if get_env_bool("ANALYZER_PUBLISH_AGGREGATES"):
+        channel.queue_declare(queue='report_aggregates', durable=True)
+    channel.queue_declare(queue=dead_letter_queue('to_analyze'), durable=True)
 
     # Otherwise consumers fetch all messages, starving other consumers
-    # Set to 1 because it is running a threaded worker, and we only
-    # want one message at a time
-    channel.basic_qos(prefetch_count=1)
+    # The pool has a single worker, so only the lookahead is prefetched on top of the message being analyzed
+    channel.basic_qos(prefetch_count=1 + get_env_int("QUEUE_LOOKAHEAD_TO_ANALYZE"))
 
-    channel.basic_consume('to_analyze', __on_parse_message)
+    publisher = start_publisher(host, port)
+    if report_sink:
+        report_sink.start()
+    channel.basic_consume('to_analyze', make_analyze_handler(publisher))
+    consume_control_messages(channel, 'analyzer')
+    profile_on_start('analyzer')
+    readiness.set(ServiceState.READY)
+    # docker stop sends SIGTERM, which stops like Ctrl-C so the last reports are committed and the export is written
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
         channel.start_consuming()
     except KeyboardInterrupt:
         channel.stop_consuming()
+    readiness.set(ServiceState.STOPPING)
+
+    # Waits for the last reports to be committed and confirmed, then runs the acks they scheduled on this connection
+    pool.shutdown()
+    if report_sink:
+        report_sink.close()
+    publisher.close()
+    connection.process_data_events(time_limit=1)
     connection.close()
+    if export:
+        export.close()
+    print(f"Stopped analyzing, {memory_guard.last_rss / 2 ** 20:.0f}MiB in use")
 
-def __analyze_reviews(reviews: list[dict[str, Any]]) -> list[Report]:
+def __analyze_reviews(reviews: list[dict[str, Any]]) -> tuple[list[Report], list[tuple[Any, BaseException]]]:
+    """
+    Analyzes each review on its own, so a single bad review only fails itself.
+    Returns the reports and the reviews that failed along with their error.
+    """
     if get_env_bool("TRAINING_MODE"):
-        return __analyze_reviews_using_llm(reviews)
-    else:
-        return process_reviews([Review(
-            author_id=review["author_id"],
-            author_name=review["author_name"],
-            author_image_url=review["author_image_url"],
-            title=review["title"],
-            text=review["text"],
-            date=review["date"] if isinstance(review["date"], int) else int(dp.parse(review["date"]).timestamp()),
-            date_text=review["date_text"],
-            review_id=review["review_id"],
-            attributes=review["attributes"],
-            verified_purchase=review["verified_purchase"],
-            found_helpful_count=review["found_helpful_count"],
-            is_top_positive_review=review["is_top_positive_review"],
-            is_top_critical_review=review["is_top_critical_review"],
-            images=review["images"],
-            country_reviewed_in=review["country_reviewed_in"],
-            region=AmazonRegion(review["region"]),
-            product_name=review["product_name"],
-            product_image_url=None,
-            manufacturer_name=review["manufacturer_name"],
-            manufacturer_id=review["manufacturer_id"]
-        ) for review in reviews])
+        return __analyze_reviews_using_llm(reviews), []
+
+    reports: list[Report] = []
+    failures: list[tuple[Any, BaseException]] = []
+    for review in reviews:
+        try:
+            reports.extend(process_reviews([review_schema.from_primitive(review)]))
+        except Exception as e:
+            print(f"Failed to analyze review {review.get('review_id') if isinstance(review, dict) else review}: {e!r}")
+            failures.append((review, e))
+
+    return reports, failures
+
+def __aggregate_reports(reviews: list[dict[str, Any]], reports: list[Report], delta_id: str) -> list[ReliabilityAggregate]:
+    """
+    Aggregates of the new reports per product, published as deltas to be added to the product's previous aggregate.
+    delta_id identifies the message, so the deltas of a redelivered or retried message are only merged once.
+    Products are identified by the product_id of their reviews. Training mode reports are not aggregated.
+    Only published with ANALYZER_PUBLISH_AGGREGATES set, as nothing consumes the report_aggregates queue yet.
+    """
+    if get_env_bool("TRAINING_MODE") or not get_env_bool("ANALYZER_PUBLISH_AGGREGATES"):
+        return []
+
+    product_of_review = {review.get('review_id'): review.get('product_id') for review in reviews if isinstance(review, dict)}
+    reports_by_product: dict[str, list[Report]] = {}
+    for report in reports:
+        product_id = product_of_review.get(report.review_id)
+        if product_id:
+            reports_by_product.setdefault(product_id, []).append(report)
+
+    return [aggregate_reports(product_id, product_reports, get_env_int("ANALYZER_AGGREGATE_BIN_DAYS"), delta_id)
+        for product_id, product_reports in reports_by_product.items()]
+
+def __export(reviews: list[dict[str, Any]], reports: list[Report]) -> None:
+    """
+    Adds the reviews and their reports to the columnar export if EXPORT_DIR is set. Rows are buffered until a part is full
+    or the export flushes all buffers, see export_from_env, and the rest is written when the analyzer stops.
+    Export failures do not fail the message.
+    """
+    if not export:
+        return
+    try:
+        decoded = []
+        for review in reviews:
+            try:
+                decoded.append(review_schema.from_primitive(review))
+            except Exception:
+                pass # Already dead-lettered by __analyze_reviews
+        export.add_reviews(decoded)
+        export.add_reports(reports, decoded)
+    except Exception as e:
+        print(f"Failed to export {len(reviews)} reviews: {e!r}")
 
 def __analyze_reviews_using_llm(reviews: list[dict[str, Any]]) -> list[Report]:
     """
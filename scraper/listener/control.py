@@ -0,0 +1,52 @@
+import functools
+import json
+import pika
+from pika.exchange_type import ExchangeType
+
+from utils.env import get_env, get_env_float
+from utils.profiler import profile_in_background
+
+def start_profile(service: str, seconds: float) -> bool:
+    """
+    Profiles the listener for the given duration, writing to PROFILE_DIR.
+    """
+    return profile_in_background(seconds, get_env("PROFILE_DIR"), service, get_env_float("PROFILE_INTERVAL"))
+
+def profile_on_start(service: str) -> None:
+    """
+    Profiles the listener right after it starts if PROFILE_ON_START_SECONDS is set.
+    """
+    seconds = get_env_float("PROFILE_ON_START_SECONDS")
+    if seconds > 0:
+        start_profile(service, seconds)
+
+def __on_control_message(service: str, channel: pika.adapters.blocking_connection.BlockingChannel,
+        method_frame: pika.spec.Basic.Deliver, header_frame: pika.BasicProperties, body: bytes) -> None:
+    """
+    Callback for messages on the control exchange, e.g. {"command": "profile", "seconds": 60, "service": "analyzer"}.
+    Messages with a service only apply to listeners of that service, the others apply to every listener.
+    """
+    try:
+        control = json.loads(body)
+        if control.get('service') not in [None, service]:
+            return
+
+        match control['command']:
+            case 'profile':
+                if not start_profile(service, float(control.get('seconds', 30))):
+                    print("Received profile command while a profile is being taken, ignoring it")
+            case _:
+                print(f"Unknown control command {control['command']}")
+    except Exception as e:
+        print(f"Failed to handle control message: {e!r}")
+
+def consume_control_messages(channel: pika.adapters.blocking_connection.BlockingChannel, service: str) -> None:
+    """
+    Listens for messages on the control exchange, which every listener is bound to, on the given channel.
+    """
+    # The pinned types-pika stubs annotate the ExchangeType members as str, while exchange_declare expects the enum
+    channel.exchange_declare(exchange='control', exchange_type=ExchangeType.fanout) # type: ignore[arg-type]
+    control = channel.queue_declare(queue='', exclusive=True)
+    queue_name = str(control.method.queue)
+    channel.queue_bind(exchange='control', queue=queue_name)
+    channel.basic_consume(queue_name, functools.partial(__on_control_message, service), auto_ack=True)
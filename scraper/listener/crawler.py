@@ -1,63 +1,98 @@
+import functools
 import pika
 from pika.exchange_type import ExchangeType
 import json
-from crawler.amazon import crawl_for_reviews
-from utils.env import get_env_int
+from typing import Callable
+from crawler.scheduler import CrawlCancelledError, CrawlJob, CrawlScheduler
+from crawler.seen_products import SeenProductStore
+from listener.control import consume_control_messages, profile_on_start
+from listener.flow_control import FlowController, QueueDepthProbe, queue_flow_controller
+from listener.metrics import messages
+from listener.publisher import Publisher, json_properties, start_publisher
+from listener.scheduling import Lane, declare_queue, with_lane
+from utils.env import get_env, get_env_float, get_env_int
+from utils.metrics import registry, start_metrics_exporter
 
-max_pages = 1000
-current_crawl = None
+seen_store = SeenProductStore(get_env("CRAWLER_SEEN_PRODUCTS_DIR"), get_env_float("CRAWLER_DEDUPE_TTL_HOURS") * 3600) \
+    if get_env_float("CRAWLER_DEDUPE_TTL_HOURS") > 0 else None
+progress_interval = 30
 
-def __on_crawl_message(channel: pika.adapters.blocking_connection.BlockingChannel,
+products_published = registry.counter("scraper_crawler_products_total", "Products found by crawls and published to the parse queue")
+active_jobs = registry.gauge_function("scraper_crawler_active_jobs", "Crawl jobs that are running")
+seen_products = registry.counter_function("scraper_crawler_seen_products_total",
+    "Products checked against the seen product store, by result (enqueued or skipped)", ("result",))
+
+def __on_crawl_message(scheduler: CrawlScheduler, channel: pika.adapters.blocking_connection.BlockingChannel,
         method_frame: pika.spec.Basic.Deliver, header_frame: pika.BasicProperties, body: bytes) -> None:
     """
     Callback for when a message is received on the to_crawl exchange.
+    Commands are handed to the scheduler, which returns immediately, so cancels are handled while crawls are running.
     """
-    global current_crawl
     if not method_frame.delivery_tag:
         return
 
     try:
         crawl_info = json.loads(body)
-        if crawl_info['command'] == 'cancel':
-            current_crawl = None
-            print(f"Received cancel for {crawl_info['url']}")
-            return
-
-        print(f"Received {crawl_info['url']} for crawling")
-        current_crawl = crawl_info['url']
-        
-        product_ids_so_far: set[str] = set()
-        for i in range(max_pages):
-            product_ids_so_far = crawl_for_reviews(crawl_info['url'], i, crawl_info['review_info'], product_ids_so_far, lambda x: channel.basic_publish(
-                exchange='',
-                routing_key='parse',
-                body=x,
-                properties=pika.BasicProperties(
-                    content_type='application/json',
-                    delivery_mode=2, # persistent
-                )
-            ))
-
-            if current_crawl != crawl_info['url']:
-                print(f"Stopping crawling early {crawl_info['url']}")
-                break
-        
-        print(f"Finished crawling {crawl_info['url']}")
-        current_crawl = None
+        match crawl_info['command']:
+            case 'set':
+                job = scheduler.submit(crawl_info['url'], crawl_info['review_info'], priority=crawl_info.get('priority', 0),
+                    concurrency=crawl_info.get('concurrency'), job_id=crawl_info.get('job_id'))
+                print(f"Received {crawl_info['url']} for crawling as job {job}")
+            case 'cancel':
+                cancelled = scheduler.cancel(job_id=crawl_info.get('job_id'), url=crawl_info.get('url'))
+                print(f"Received cancel for {crawl_info.get('job_id') or crawl_info.get('url') or 'all jobs'}, "
+                    f"cancelled {[job.job_id for job in cancelled]}")
+            case 'prioritize':
+                updated = scheduler.reprioritize(crawl_info['priority'], job_id=crawl_info.get('job_id'), url=crawl_info.get('url'))
+                print(f"Changed priority of {[job.job_id for job in updated]} to {crawl_info['priority']}")
+            case 'status':
+                __print_progress(scheduler)
+            case _:
+                print(f"Unknown crawl command {crawl_info['command']}")
+                messages.inc(labels=("to_crawl", "failed"))
+                return
+        messages.inc(labels=("to_crawl", "processed"))
     except Exception as e:
         print(e)
+        messages.inc(labels=("to_crawl", "failed"))
         return
-    
+
+def __publish(publisher: Publisher, flow: FlowController, job: CrawlJob, body: str, on_enqueued: Callable[[], None]) -> None:
+    """
+    Called from crawl job threads, products are batched and confirmed by the publisher.
+    Blocks the crawl while the parse queue is over its high-water mark, unless the job is cancelled meanwhile,
+    in which case the product is not published.
+    Products are published with the priority and id of their crawl, so parsers share their workers fairly between crawls.
+    on_enqueued runs on the publisher thread once the broker confirmed the product.
+    """
+    flow.wait(job.cancel_event.is_set)
+    if job.cancel_event.is_set():
+        raise CrawlCancelledError(f"Crawl job {job.job_id} was cancelled")
+    publisher.publish('parse', body, with_lane(json_properties(), Lane(job.priority, job.job_id)), on_confirm=on_enqueued)
+    products_published.inc()
+
+def __print_progress(scheduler: CrawlScheduler) -> None:
+    for job in scheduler.active_jobs():
+        print(f"Crawl job {job}")
+    if seen_store:
+        print(f"Seen products: {seen_store.enqueued} enqueued, {seen_store.skipped} skipped as recently enqueued")
+
+def __schedule_progress(connection: pika.BlockingConnection, scheduler: CrawlScheduler) -> None:
+    __print_progress(scheduler)
+    connection.call_later(progress_interval, functools.partial(__schedule_progress, connection, scheduler))
+
 def start_crawling_listener(host: str, port: int) -> None:
     """
     Start listening for messages on the to_crawl exchange.
-    Will stop the previous crawl if asked to crawl another url.
-    Will stop crawling if a stop command is recieved.
+    Runs up to CRAWLER_MAX_JOBS crawls at the same time, queued by priority.
+    Commands: set (queue a crawl), cancel (by job_id or url, or everything), prioritize and status.
     """
+    start_metrics_exporter()
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
     channel = connection.channel()
-    channel.exchange_declare(exchange='to_crawl', exchange_type=ExchangeType.fanout)
-    channel.queue_declare(queue='parse', durable=True)
+    # The pinned types-pika stubs annotate the ExchangeType members as str, while exchange_declare expects the enum
+    channel.exchange_declare(exchange='to_crawl', exchange_type=ExchangeType.fanout) # type: ignore[arg-type]
+    declare_queue(channel, 'parse')
 
     to_crawl = channel.queue_declare(queue='', exclusive=True)
     queue_name = to_crawl.method.queue
@@ -66,9 +101,29 @@ def start_crawling_listener(host: str, port: int) -> None:
     # Otherwise consumers fetch all messages, starving other consumers
     channel.basic_qos(prefetch_count=get_env_int("QUEUE_PREFETCH_COUNT"))
 
-    channel.basic_consume(str(queue_name), __on_crawl_message, auto_ack=True)
+    publisher = start_publisher(host, port)
+    probe = QueueDepthProbe(host, port)
+    flow = queue_flow_controller(probe, 'parse', "FLOW_PARSE", local_depth=publisher.pending_count)
+    scheduler = CrawlScheduler(
+        max_jobs=get_env_int("CRAWLER_MAX_JOBS"),
+        default_concurrency=get_env_int("CRAWLER_PAGE_CONCURRENCY"),
+        publish=functools.partial(__publish, publisher, flow),
+        seen_store=seen_store
+    )
+    active_jobs.track(lambda: len(scheduler.active_jobs()))
+    if seen_store:
+        for result in ["enqueued", "skipped"]:
+            seen_products.track(functools.partial(getattr, seen_store, result), (result,))
+    __schedule_progress(connection, scheduler)
+
+    channel.basic_consume(str(queue_name), functools.partial(__on_crawl_message, scheduler), auto_ack=True)
+    consume_control_messages(channel, 'crawler')
+    profile_on_start('crawler')
     try:
         channel.start_consuming()
     except KeyboardInterrupt:
         channel.stop_consuming()
-    connection.close()
\ No newline at end of file
+    scheduler.shutdown()
+    publisher.close()
+    probe.close()
+    connection.close()
@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+import json
+import traceback
+from typing import Any, Callable
+import pika
+
+from listener.publisher import Publisher, json_properties
+
+retry_count_header = "x-retry-count"
+
+def dead_letter_queue(queue: str) -> str:
+    return f"{queue}.dead_letter"
+
+def retry_count(properties: pika.BasicProperties | None) -> int:
+    """
+    Number of times the message was already published again after failing.
+    The broker's redelivered flag is only a boolean, so the count travels in a header.
+    """
+    headers = properties.headers if properties and properties.headers else {}
+    return int(headers.get(retry_count_header, 0))
+
+def error_headers(queue: str, error: BaseException) -> dict[str, Any]:
+    return {
+        "x-source-queue": queue,
+        "x-error": f"{type(error).__name__}: {error}",
+        "x-failed-at": datetime.now(timezone.utc).isoformat()
+    }
+
+def error_details(error: BaseException) -> dict[str, str]:
+    return {
+        "type": type(error).__name__,
+        "message": str(error),
+        "traceback": "".join(traceback.format_exception(error))
+    }
+
+def retry_or_dead_letter(publisher: Publisher, queue: str, body: bytes, properties: pika.BasicProperties | None,
+        error: BaseException, max_retries: int, on_confirm: Callable[[], None]) -> None:
+    """
+    Publishes a failed message to the back of its queue with an increased retry count,
+    or to the queue's dead-letter queue with error metadata once max_retries is reached.
+    on_confirm is called once the broker confirmed it, after which the original delivery can be acked.
+    """
+    count = retry_count(properties)
+    headers = dict(properties.headers) if properties and properties.headers else {}
+    # Keep the encoding, so compressed messages can still be decoded, and the priority, so retries stay in their lane
+    content_encoding = properties.content_encoding if properties else None
+    priority = properties.priority if properties else None
+
+    if count < max_retries:
+        print(f"Retrying message from {queue} ({count + 1}/{max_retries}): {error}")
+        headers[retry_count_header] = count + 1
+        publisher.publish(queue, body, json_properties(headers=headers, content_encoding=content_encoding, priority=priority),
+            on_confirm=on_confirm)
+    else:
+        print(f"Dead-lettering message from {queue} after {count} retries: {error}")
+        headers.update(error_headers(queue, error))
+        publisher.publish(dead_letter_queue(queue), body, json_properties(headers=headers, content_encoding=content_encoding),
+            on_confirm=on_confirm)
+
+def dead_letter_items(publisher: Publisher, queue: str, failures: list[tuple[Any, BaseException]]) -> None:
+    """
+    Publishes single items that failed inside an otherwise successful message to the dead-letter queue,
+    each with the details of its error.
+    """
+    if not failures:
+        return
+
+    body = json.dumps([{"item": item, "error": error_details(error)} for item, error in failures], default=str)
+    publisher.publish(dead_letter_queue(queue), body, json_properties(headers=error_headers(queue, failures[0][1])))
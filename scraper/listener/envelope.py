@@ -0,0 +1,84 @@
+from typing import Any
+import uuid
+import pika
+
+from listener.publisher import json_properties
+from utils.compression import compress, decompress
+from utils.env import get_env, get_env_int, get_env_list
+from utils.serialization import decode_json, encode_json
+
+envelope_version = 1
+version_header = "x-envelope-version"
+
+def hoist_common_fields(items: list[dict[str, Any]]) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """
+    Moves top-level fields that have the same value in every item (e.g. product and manufacturer) into a shared header.
+    """
+    if len(items) < 2 or not all(isinstance(item, dict) for item in items):
+        return {}, items
+
+    header = {key: value for key, value in items[0].items()
+        if all(key in item and item[key] == value for item in items[1:])}
+    return header, [{key: value for key, value in item.items() if key not in header} for item in items]
+
+def chunk_items(items: list[Any], max_bytes: int) -> list[list[Any]]:
+    """
+    Splits items into chunks whose JSON encoding is at most max_bytes, except for single items that are larger on their own.
+    """
+    chunks: list[list[Any]] = [[]]
+    size = 0
+    for item in items:
+        item_size = len(encode_json(item)) + 1
+        if chunks[-1] and size + item_size > max_bytes:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(item)
+        size += item_size
+    return chunks
+
+def encode(items: list[Any], encoding: str | None, max_chunk_bytes: int) -> list[tuple[bytes, pika.BasicProperties]]:
+    """
+    Encodes items into one or more envelope messages. Every chunk is a complete message on its own,
+    so consumers can handle chunks independently without reassembling them.
+    """
+    message_id = uuid.uuid4().hex
+    chunks = chunk_items(items, max_chunk_bytes)
+    messages = []
+
+    for index, chunk in enumerate(chunks):
+        header, hoisted = hoist_common_fields(chunk)
+        envelope = {"v": envelope_version, "header": header, "items": hoisted}
+        body = compress(encode_json(envelope), encoding)
+        messages.append((body, json_properties(content_encoding=encoding or None, message_id=message_id, headers={
+            version_header: envelope_version,
+            "x-chunk-index": index,
+            "x-chunk-count": len(chunks)
+        })))
+
+    return messages
+
+def decode(body: bytes, properties: pika.BasicProperties | None) -> Any:
+    """
+    Decodes a message body in either the envelope format or the legacy plain JSON format.
+    """
+    encoding = properties.content_encoding if properties else None
+    headers = properties.headers if properties and properties.headers else {}
+    data = decode_json(decompress(body, encoding))
+
+    if version_header not in headers:
+        return data
+
+    if data.get("v") != envelope_version:
+        raise ValueError(f"Unsupported envelope version {data.get('v')}")
+    header = data.get("header", {})
+    return [{**header, **item} for item in data["items"]] if header else data["items"]
+
+def encode_for_queue(queue: str, items: list[Any]) -> list[tuple[bytes, pika.BasicProperties]]:
+    """
+    Encodes items for the given queue. Queues listed in QUEUE_ENVELOPE_QUEUES get compressed, chunked envelopes,
+    all others keep the legacy plain JSON format their consumers expect.
+    """
+    if queue not in get_env_list("QUEUE_ENVELOPE_QUEUES"):
+        return [(encode_json(items), json_properties())]
+
+    return encode(items, get_env("QUEUE_COMPRESSION"), get_env_int("QUEUE_CHUNK_BYTES"))
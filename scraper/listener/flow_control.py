@@ -0,0 +1,122 @@
+import threading
+import time
+from typing import Callable
+import pika
+from pika.exceptions import AMQPError
+
+from utils.env import get_env_float, get_env_int
+from utils.metrics import registry
+
+paused_seconds = registry.counter_function("scraper_flow_paused_seconds_total",
+    "Time producers spent paused for a downstream queue, summed over producing threads", ("queue",))
+queue_depth = registry.gauge_function("scraper_flow_queue_depth", "Depth of a downstream queue at its last check", ("queue",))
+
+class QueueDepthProbe:
+    """
+    Reads queue depths with passive queue_declare calls on a dedicated connection.
+    Safe to call from any thread, reconnects after connection errors.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.parameters = pika.ConnectionParameters(host=host, port=port)
+        self.__connection: pika.BlockingConnection | None = None
+        self.__channel: pika.adapters.blocking_connection.BlockingChannel | None = None
+        self.__lock = threading.Lock()
+
+    def depth(self, queue: str) -> int:
+        with self.__lock:
+            try:
+                return self.__declare(queue)
+            except AMQPError:
+                self.close()
+                return self.__declare(queue)
+
+    def close(self) -> None:
+        if self.__connection and self.__connection.is_open:
+            try:
+                self.__connection.close()
+            except AMQPError:
+                pass
+        self.__connection = None
+        self.__channel = None
+
+    def __declare(self, queue: str) -> int:
+        if not self.__connection or not self.__connection.is_open or not self.__channel or not self.__channel.is_open:
+            self.__connection = pika.BlockingConnection(self.parameters)
+            self.__channel = self.__connection.channel()
+        return self.__channel.queue_declare(queue=queue, passive=True).method.message_count or 0
+
+class FlowController:
+    """
+    Pauses producers while a downstream queue is too deep.
+    Pausing starts once the depth reaches high_water and lasts until it drops to low_water or below.
+    The depth is checked at most once per check_interval, shared by all producing threads.
+    paused_seconds is summed over all producing threads that had to wait.
+    """
+
+    def __init__(self, queue: str, depth: Callable[[], int], high_water: int, low_water: int, check_interval: float,
+            clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.queue = queue
+        self.high_water = high_water
+        self.low_water = low_water
+        self.check_interval = check_interval
+        self.paused = False
+        self.paused_seconds = 0.0
+        self.last_depth = 0
+        self.__depth = depth
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__last_check = float("-inf")
+        self.__lock = threading.Lock()
+
+    def wait(self, should_stop: Callable[[], bool] | None = None) -> float:
+        """
+        Blocks while the queue is over its high-water mark, or until should_stop returns True. Returns the time spent paused.
+        """
+        if self.high_water <= 0:
+            return 0
+
+        waited = 0.0
+        while not (should_stop and should_stop()) and self.__check():
+            self.__sleep(self.check_interval)
+            waited += self.check_interval
+            with self.__lock:
+                self.paused_seconds += self.check_interval
+        return waited
+
+    def __check(self) -> bool:
+        with self.__lock:
+            now = self.__clock()
+            if now - self.__last_check < self.check_interval:
+                return self.paused
+            self.__last_check = now
+
+            try:
+                self.last_depth = self.__depth()
+            except Exception as e:
+                print(f"Failed to check depth of {self.queue}, not pausing: {e}")
+                self.paused = False
+                return False
+
+            if not self.paused and self.last_depth >= self.high_water:
+                print(f"Pausing producers for {self.queue}: {self.last_depth} messages waiting (high-water mark {self.high_water})")
+                self.paused = True
+            elif self.paused and self.last_depth <= self.low_water:
+                print(f"Resuming producers for {self.queue}: {self.last_depth} messages waiting, "
+                    f"paused for {self.paused_seconds:.0f}s in total")
+                self.paused = False
+            return self.paused
+
+def queue_flow_controller(probe: QueueDepthProbe, queue: str, env_prefix: str,
+        local_depth: Callable[[], int] = lambda: 0) -> FlowController:
+    """
+    Flow controller for a RabbitMQ queue, configured by the <env_prefix>_HIGH_WATER and <env_prefix>_LOW_WATER
+    environment variables. local_depth adds messages that are buffered locally and not in the queue yet.
+    """
+    flow = FlowController(queue, lambda: probe.depth(queue) + local_depth(),
+        high_water=get_env_int(f"{env_prefix}_HIGH_WATER"),
+        low_water=get_env_int(f"{env_prefix}_LOW_WATER"),
+        check_interval=get_env_float("FLOW_CHECK_INTERVAL"))
+    paused_seconds.track(lambda: flow.paused_seconds, (queue,))
+    queue_depth.track(lambda: flow.last_depth, (queue,))
+    return flow
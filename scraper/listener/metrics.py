@@ -0,0 +1,11 @@
+"""
+Metrics shared by the listeners, labelled by the queue they consume.
+"""
+from utils.metrics import registry
+
+messages = registry.counter("scraper_messages_total", "Messages handled, by outcome (processed, failed, or requeued while blocked)", ("queue", "outcome"))
+message_seconds = registry.histogram("scraper_message_seconds", "Time to handle a message, including publishing its output", ("queue",))
+reviews = registry.counter("scraper_reviews_total", "Reviews parsed or analyzed, by outcome (processed or failed)", ("queue", "outcome"))
+queue_wait_seconds = registry.histogram("scraper_queue_wait_seconds",
+    "Time from publishing a message until a worker starts on it, by priority", ("queue", "priority"))
+workers_busy = registry.gauge("scraper_workers_busy", "Workers handling a message right now", ("queue",))
@@ -1,88 +1,145 @@
-from enum import Enum
-from typing import Any
+import functools
+import threading
+import time
+from typing import Callable
 import pika
 import json
-import parsing.amazon as amazon
-from requester.amazon import AmazonRegion
-from utils import class_to_json
-from utils.env import get_env_int
+from listener.control import consume_control_messages, profile_on_start
+from listener.dead_letter import dead_letter_queue, retry_or_dead_letter
+from listener.flow_control import FlowController, QueueDepthProbe, queue_flow_controller
+from listener.envelope import encode_for_queue
+from listener.metrics import message_seconds, messages, reviews as reviews_metric, workers_busy
+from listener.publisher import OutgoingMessage, Publisher, start_publisher
+from listener.scheduling import WorkerPool, declare_queue, describe_lane, lane_of, with_lane
+from parsing.sources import get_reviews
+from requester.request_maker import warm_up_sessions
+from requester.retry_policy import CircuitOpenError, RetryBudgetExhaustedError
+from utils.serialization import to_primitive
+from utils.env import get_env_float, get_env_int, get_env_list
+from utils.metrics import start_metrics_exporter
+from utils.readiness import ServiceState, readiness
 
-class ReviewSource(str, Enum):
-    AMAZON = "amazon",
-    UNKNOWN = "unknown"
-
-def __on_parse_message(channel: pika.adapters.blocking_connection.BlockingChannel,
+def __on_parse_message(publisher: Publisher, flow: FlowController, pool: WorkerPool, channel: pika.adapters.blocking_connection.BlockingChannel,
         method_frame: pika.spec.Basic.Deliver, header_frame: pika.BasicProperties, body: bytes) -> None:
     """
     Callback for when a message is received on the parse queue.
-    Will get all reviews for the given product id and publish them to the parsed_reviews queue.
+    Hands the delivery to the worker pool, so the connection thread stays free for heartbeats and acks.
+    The pool works on deliveries by priority, and round-robin across the jobs they belong to.
     """
     if not method_frame.delivery_tag:
         return
 
+    pool.submit(__parse_product, publisher, flow, pool, channel, method_frame.delivery_tag, body, header_frame,
+        lane=lane_of(header_frame))
+
+def make_parse_handler(publisher: Publisher, flow: FlowController, pool: WorkerPool) -> Callable[
+        [pika.adapters.blocking_connection.BlockingChannel, pika.spec.Basic.Deliver, pika.BasicProperties, bytes], None]:
+    """
+    Consumer callback for the parse queue, which parses products on the pool's workers.
+    """
+    return functools.partial(__on_parse_message, publisher, flow, pool)
+
+def __parse_product(publisher: Publisher, flow: FlowController, pool: WorkerPool,
+        channel: pika.adapters.blocking_connection.BlockingChannel, delivery_tag: int, body: bytes,
+        properties: pika.BasicProperties | None = None) -> None:
+    """
+    Runs on a worker thread.
+    Waits before parsing while the to_analyze queue is over its high-water mark.
+    Will get all reviews for the given product id and publish them to the parsed_reviews and to_analyze queues,
+    in the same lane as the product.
+    The delivery is acked on the connection thread once the broker has confirmed all published messages.
+    A failed delivery is published again up to PARSER_MAX_RETRIES times and then dead-lettered, so it can be replayed.
+    Products that failed fast because their region is blocked are not at fault: they are requeued without counting
+    as a retry, once the circuit breaker lets requests through again.
+    """
+    worker = threading.current_thread().name
+    ack = functools.partial(channel.basic_ack, delivery_tag=delivery_tag)
+
     try:
+        paused = flow.wait()
+        if paused:
+            print(f"[{worker}] Waited {paused:.0f}s for to_analyze to drain")
+
         parsed = json.loads(body)
-        print(f"Received {parsed['id']} for parsing")
+        print(f"[{worker}] Received {parsed['id']} for parsing ({describe_lane('parse', properties)}, "
+            f"{pool.in_flight}/{pool.size} workers busy, {len(pool.scheduler)} waiting)")
+        start = time.monotonic()
 
-        reviews = __get_reviews(parsed)
-        reviews_json = class_to_json(reviews)
+        with workers_busy.track_in_progress(("parse",)):
+            reviews = get_reviews(parsed)
+            reviews_primitive = to_primitive(reviews)
         
-        print(f"Finished parsing {parsed['id']}")
+        print(f"[{worker}] Finished parsing {parsed['id']}: {len(reviews)} reviews in {time.monotonic() - start:.1f}s")
+
+        # The analyzer aggregates reports by product, the envelope hoists the shared product_id into its header
+        to_analyze = [{**review, 'product_id': parsed['id']} for review in reviews_primitive]
 
-        channel.basic_publish(
-            exchange='',
-            routing_key='parsed_reviews',
-            body=reviews_json,
-            properties=pika.BasicProperties(
-                content_type='application/json',
-                delivery_mode=2, # persistent
-            )
-        )
+        lane = lane_of(properties)
+        publisher.publish_batch([
+            OutgoingMessage(queue, message_body, with_lane(message_properties, lane))
+            for queue, items in [('parsed_reviews', reviews_primitive), ('to_analyze', to_analyze)]
+            for message_body, message_properties in encode_for_queue(queue, items)
+        ], on_confirm=lambda: channel.connection.add_callback_threadsafe(ack))
 
-        channel.basic_publish(
-            exchange='',
-            routing_key='to_analyze',
-            body=reviews_json,
-            properties=pika.BasicProperties(
-                content_type='application/json',
-                delivery_mode=2, # persistent
-            )
-        )
+        messages.inc(labels=("parse", "processed"))
+        reviews_metric.inc(len(reviews), labels=("parse", "processed"))
+        message_seconds.observe(time.monotonic() - start, labels=("parse",))
+    except (CircuitOpenError, RetryBudgetExhaustedError) as e:
+        delay = e.retry_after if isinstance(e, CircuitOpenError) else get_env_float("REQUEST_BREAKER_RESET_SECONDS")
+        print(f"[{worker}] Requeueing delivery {delivery_tag} in {delay:.0f}s: {e}")
+        messages.inc(labels=("parse", "requeued"))
+        nack = functools.partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=True)
 
-        channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+        # call_later has to be called on the connection thread as well
+        def nack_later() -> None:
+            channel.connection.call_later(delay, nack)
+        channel.connection.add_callback_threadsafe(nack_later)
     except Exception as e:
-        print(e)
-        return
-    
+        print(f"[{worker}] Failed to parse delivery {delivery_tag}: {e}")
+        messages.inc(labels=("parse", "failed"))
+        retry_or_dead_letter(publisher, 'parse', body, properties, e, get_env_int("PARSER_MAX_RETRIES"),
+            on_confirm=lambda: channel.connection.add_callback_threadsafe(ack))
+
+def __warm_up() -> None:
+    """
+    Requests each of SCRAPER_WARMUP_URLS with every pooled session, so the first products do not wait for connection setup.
+    Runs before connecting to RabbitMQ, so no delivery is held while it runs.
+    """
+    for url in get_env_list("SCRAPER_WARMUP_URLS"):
+        start = time.monotonic()
+        succeeded = warm_up_sessions(url)
+        print(f"Warmed up {succeeded} sessions on {url} in {time.monotonic() - start:.1f}s")
+
 def start_parsing_listener(host: str, port: int) -> None:
+    start_metrics_exporter()
+    readiness.set(ServiceState.WARMING_UP)
+    __warm_up()
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
     channel = connection.channel()
-    channel.queue_declare(queue='parse', durable=True)
-    channel.queue_declare(queue='parsed_reviews', durable=True)
-    channel.queue_declare(queue='to_analyze', durable=True)
+    declare_queue(channel, 'parse')
+    channel.queue_declare(queue=dead_letter_queue('parse'), durable=True)
+    declare_queue(channel, 'parsed_reviews')
+    declare_queue(channel, 'to_analyze')
 
     # Otherwise consumers fetch all messages, starving other consumers
-    channel.basic_qos(prefetch_count=get_env_int("QUEUE_PREFETCH_COUNT"))
+    # The worker pool has a worker per QUEUE_PREFETCH_COUNT, the lookahead lets it pick the next product across jobs
+    workers = get_env_int("QUEUE_PREFETCH_COUNT")
+    channel.basic_qos(prefetch_count=workers + get_env_int("QUEUE_LOOKAHEAD_PARSE"))
 
-    channel.basic_consume('parse', __on_parse_message)
+    publisher = start_publisher(host, port)
+    probe = QueueDepthProbe(host, port)
+    flow = queue_flow_controller(probe, 'to_analyze', "FLOW_TO_ANALYZE")
+    pool = WorkerPool(workers)
+    channel.basic_consume('parse', make_parse_handler(publisher, flow, pool))
+    consume_control_messages(channel, 'parser')
+    profile_on_start('parser')
+    readiness.set(ServiceState.READY)
     try:
         channel.start_consuming()
     except KeyboardInterrupt:
         channel.stop_consuming()
+    readiness.set(ServiceState.STOPPING)
+    pool.shutdown()
+    publisher.close()
+    probe.close()
     connection.close()
-
-def __get_reviews(parsed: dict[str, Any]) -> list[amazon.Review]:
-    """
-    Get all reviews for the given product id from the scraper.
-    """
-    source = ReviewSource(parsed["type"])
-
-    match source:
-        case ReviewSource.AMAZON:
-            region = AmazonRegion(parsed["region"])
-            if region:
-                return amazon.parse_reviews(region, parsed["id"])
-            else:
-                raise ValueError(f"Unknown region {parsed['region']}")
-        case _:
-            raise ValueError(f"Unknown review source {source}")
\ No newline at end of file
@@ -0,0 +1,257 @@
+from collections import deque
+from dataclasses import dataclass
+import functools
+import threading
+import time
+from typing import Any, Callable
+import pika
+from pika.channel import Channel
+
+from utils.env import get_env_float, get_env_int
+from utils.metrics import registry
+
+published_messages = registry.counter_function("scraper_published_messages_total",
+    "Messages handed to the broker, by state (published, confirmed, republished, or dropped unconfirmed on close)", ("state",))
+pending_messages = registry.gauge_function("scraper_publish_pending", "Messages buffered or waiting for a confirm")
+
+def json_properties(**kwargs: Any) -> pika.BasicProperties:
+    return pika.BasicProperties(
+        content_type='application/json',
+        delivery_mode=2, # persistent
+        **kwargs
+    )
+
+@dataclass
+class OutgoingMessage:
+    routing_key: str
+    body: bytes | str
+    properties: pika.BasicProperties
+    on_confirm: Callable[[], None] | None = None
+    exchange: str = ''
+    attempts: int = 0
+
+class Publisher:
+    """
+    Publishes messages on a dedicated connection with publisher confirms.
+
+    Messages are buffered and written out once batch_size messages are waiting or flush_interval has passed.
+    At most max_in_flight messages are unconfirmed at any time. Nacked messages, and messages that were in flight
+    when the connection dropped, are published again. on_confirm callbacks run on the publisher thread.
+    Messages still unconfirmed when the publisher is closed are dropped with their callbacks, and counted.
+    publish() is thread safe and never blocks on the network.
+    """
+
+    def __init__(self, host: str, port: int, batch_size: int, flush_interval: float, max_in_flight: int,
+            reconnect_delay: float = 5) -> None:
+        self.parameters = pika.ConnectionParameters(host=host, port=port)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_in_flight = max_in_flight
+        self.reconnect_delay = reconnect_delay
+        self.published = 0
+        self.confirmed = 0
+        self.republished = 0
+        self.dropped = 0
+
+        self._pending: deque[OutgoingMessage] = deque()
+        self._in_flight: dict[int, OutgoingMessage] = {}
+        self._delivery_tag = 0
+        self._channel: Channel | None = None
+        self._connection: pika.SelectConnection | None = None
+        self._last_flush = time.monotonic()
+        self.__condition = threading.Condition()
+        self.__running = False
+        self.__disconnected_logged = False
+        self.__thread: threading.Thread | None = None
+
+    def start(self) -> "Publisher":
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="publisher", daemon=True)
+        self.__thread.start()
+        return self
+
+    def publish(self, routing_key: str, body: bytes | str, properties: pika.BasicProperties | None = None,
+            on_confirm: Callable[[], None] | None = None, exchange: str = '') -> None:
+        self.publish_batch([OutgoingMessage(routing_key, body, properties or json_properties(), None, exchange)], on_confirm)
+
+    def publish_batch(self, messages: list[OutgoingMessage], on_confirm: Callable[[], None] | None = None) -> None:
+        """
+        Queue several messages, on_confirm is called once all of them have been confirmed.
+        """
+        if on_confirm:
+            remaining = [len(messages)]
+            lock = threading.Lock()
+
+            def confirm_one() -> None:
+                with lock:
+                    remaining[0] -= 1
+                    done = remaining[0] == 0
+                if done:
+                    on_confirm()
+
+            for message in messages:
+                message.on_confirm = confirm_one
+
+        with self.__condition:
+            self._pending.extend(messages)
+            should_drain = len(self._pending) >= self.batch_size
+
+        if should_drain:
+            self.__call_threadsafe(self._drain)
+
+    def flush(self, timeout: float = 30) -> bool:
+        """
+        Blocks until every queued message has been confirmed, for at most timeout seconds. Returns False on timeout.
+        Bounded, because messages can only be confirmed once the connection is back.
+        """
+        self.__call_threadsafe(lambda: self._drain(force=True))
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not self._pending and not self._in_flight, timeout=timeout)
+
+    def close(self, timeout: float = 30) -> None:
+        if not self.flush(timeout):
+            self.__drop_unconfirmed()
+        self.__running = False
+        self.__call_threadsafe(self.__close_connection)
+        if self.__thread:
+            self.__thread.join(timeout)
+
+    def pending_count(self) -> int:
+        with self.__condition:
+            return len(self._pending) + len(self._in_flight)
+
+    def __drop_unconfirmed(self) -> None:
+        with self.__condition:
+            messages = list(self._in_flight.values()) + list(self._pending)
+            self._in_flight.clear()
+            self._pending.clear()
+            self.dropped += len(messages)
+        callbacks = sum(1 for message in messages if message.on_confirm)
+        print(f"Publisher closed with {len(messages)} unconfirmed messages, dropping them and {callbacks} confirm callbacks")
+
+    def _drain(self, force: bool = False) -> None:
+        """
+        Runs on the publisher thread. Publishes buffered messages while the in-flight window has room.
+        """
+        with self.__condition:
+            if not self._channel or not self._channel.is_open:
+                return
+            if not force and len(self._pending) < self.batch_size and time.monotonic() - self._last_flush < self.flush_interval:
+                return
+
+            self._last_flush = time.monotonic()
+            while self._pending and len(self._in_flight) < self.max_in_flight:
+                message = self._pending.popleft()
+                body = message.body.encode() if isinstance(message.body, str) else message.body
+                self._channel.basic_publish(message.exchange, message.routing_key, body, message.properties)
+                self._delivery_tag += 1
+                message.attempts += 1
+                self._in_flight[self._delivery_tag] = message
+                self.published += 1
+
+    def _on_delivery_confirmation(self, frame: pika.frame.Method) -> None:
+        """
+        Runs on the publisher thread for every Basic.Ack or Basic.Nack from the broker.
+        """
+        method = frame.method
+        confirmed: list[OutgoingMessage] = []
+        with self.__condition:
+            tags = [tag for tag in self._in_flight if tag <= method.delivery_tag] if method.multiple else [method.delivery_tag]
+            for tag in tags:
+                message = self._in_flight.pop(tag, None)
+                if not message:
+                    continue
+                if isinstance(method, pika.spec.Basic.Ack):
+                    confirmed.append(message)
+                else:
+                    print(f"Message to {message.routing_key} was nacked, publishing again (attempt {message.attempts + 1})")
+                    self._pending.appendleft(message)
+                    self.republished += 1
+            self.confirmed += len(confirmed)
+            self.__condition.notify_all()
+
+        for message in confirmed:
+            if message.on_confirm:
+                message.on_confirm()
+
+        self._drain(force=True)
+
+    def _on_channel_open(self, channel: Channel) -> None:
+        with self.__condition:
+            self._channel = channel
+            self._delivery_tag = 0
+            self.__disconnected_logged = False
+        channel.add_on_close_callback(self.__on_channel_closed)
+        channel.confirm_delivery(self._on_delivery_confirmation)
+        self.__schedule_flush()
+        self._drain(force=True)
+
+    def _requeue_in_flight(self) -> None:
+        """
+        Unconfirmed messages are put back in front of the buffer, in their original order.
+        """
+        with self.__condition:
+            if self._in_flight:
+                print(f"Publishing {len(self._in_flight)} unconfirmed messages again after reconnecting")
+            self.republished += len(self._in_flight)
+            self._pending.extendleft(reversed(list(self._in_flight.values())))
+            self._in_flight.clear()
+            self._channel = None
+
+    def __schedule_flush(self) -> None:
+        if self._connection and self._channel:
+            self._drain()
+            self._connection.ioloop.call_later(self.flush_interval, self.__schedule_flush)
+
+    def __call_threadsafe(self, callback: Callable[[], None]) -> None:
+        connection = self._connection
+        if connection and connection.is_open:
+            connection.ioloop.add_callback_threadsafe(callback)
+        elif not self.__disconnected_logged:
+            # Buffered messages are published, and their on_confirm callbacks run, once the channel is open again
+            self.__disconnected_logged = True
+            print(f"Publisher is disconnected, buffering {self.pending_count()} messages until it reconnects")
+
+    def __run(self) -> None:
+        while self.__running:
+            self._connection = pika.SelectConnection(self.parameters,
+                on_open_callback=self.__on_connection_open,
+                on_open_error_callback=self.__on_connection_closed,
+                on_close_callback=self.__on_connection_closed)
+            self._connection.ioloop.start()
+
+            if self.__running:
+                time.sleep(self.reconnect_delay)
+
+    def __on_connection_open(self, connection: pika.connection.Connection) -> None:
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def __on_channel_closed(self, channel: Channel, reason: Exception) -> None:
+        print(f"Publisher channel closed: {reason}")
+        self._requeue_in_flight()
+        self.__close_connection()
+
+    def __on_connection_closed(self, connection: pika.connection.Connection, reason: Exception | str) -> None:
+        if self.__running:
+            print(f"Publisher connection closed, reconnecting: {reason}")
+        self._requeue_in_flight()
+        if self._connection:
+            self._connection.ioloop.stop()
+
+    def __close_connection(self) -> None:
+        if self._connection and not self._connection.is_closing and not self._connection.is_closed:
+            self._connection.close()
+
+def start_publisher(host: str, port: int) -> Publisher:
+    """
+    Starts a publisher configured through the PUBLISH_* environment variables, and exports its counters as metrics.
+    """
+    publisher = Publisher(host, port,
+        batch_size=get_env_int("PUBLISH_BATCH_SIZE"),
+        flush_interval=get_env_float("PUBLISH_FLUSH_INTERVAL"),
+        max_in_flight=get_env_int("PUBLISH_MAX_IN_FLIGHT")
+    )
+    for state in ["published", "confirmed", "republished", "dropped"]:
+        published_messages.track(functools.partial(getattr, publisher, state), (state,))
+    pending_messages.track(publisher.pending_count)
+    return publisher.start()
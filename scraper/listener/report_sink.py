@@ -0,0 +1,314 @@
+"""
+Writes reports straight to the server's database, instead of publishing them to the reports queue where the server
+inserts them one row at a time. Reports of many messages are batched into one transaction, and inserted with COPY on Postgres.
+
+The tables are the ones of the server's Prisma schema. Writes are idempotent by review: a batch first deletes the reports,
+keyframes, issues and issue images of its reviews, so a redelivered message replaces its reports instead of duplicating them.
+"""
+from dataclasses import dataclass, field
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Iterable
+import uuid
+
+from analyzer.report import Report
+from utils.env import get_env, get_env_float, get_env_int
+from utils.metrics import registry
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None # type: ignore
+
+sink_reports = registry.counter("scraper_report_sink_reports_total",
+    "Reports handled by the database sink, by outcome (written, missing_review or failed)", ("outcome",))
+sink_commit_seconds = registry.histogram("scraper_report_sink_commit_seconds", "Time to write and commit one batch of reports")
+
+Row = tuple[Any, ...]
+
+@dataclass
+class ReportRows:
+    reports: list[Row] = field(default_factory=list)
+    keyframes: list[Row] = field(default_factory=list)
+    issues: list[Row] = field(default_factory=list)
+    issue_images: list[Row] = field(default_factory=list)
+
+def new_id() -> str:
+    return uuid.uuid4().hex
+
+def quote_columns(columns: list[str]) -> str:
+    return ", ".join(f'"{column}"' for column in columns)
+
+def report_rows(reports: list[Report], review_ids: dict[str, str]) -> ReportRows:
+    """
+    Rows for the reports whose review is in review_ids, which maps the review_id of reviews to their database id.
+    """
+    rows = ReportRows()
+    for report in reports:
+        report_id = new_id()
+        rows.reports.append((report_id, report.report_weight, review_ids[report.review_id]))
+        for keyframe in report.reliability_keyframes:
+            rows.keyframes.append((new_id(), keyframe.rel_timestamp, keyframe.sentiment, keyframe.interp, report_id))
+        for issue in report.issues:
+            issue_id = new_id()
+            rows.issues.append((issue_id, issue.text, issue.classification or "", issue.criticality, issue.rel_timestamp,
+                issue.frequency, report_id))
+            if issue.image:
+                rows.issue_images.append((new_id(), issue.image, issue_id))
+    return rows
+
+class ReportDatabase:
+    """
+    Database-API connection to the server's database. Subclasses set the parameter placeholder and may insert faster.
+    """
+    placeholder = "?"
+    chunk_size = 500
+
+    def __init__(self, connection: Any) -> None:
+        self.connection = connection
+
+    def review_ids(self, review_ids: Iterable[str]) -> dict[str, str]:
+        """
+        Database id of the reviews with the given review_id, for those that are stored.
+        """
+        cursor = self.connection.cursor()
+        found: dict[str, str] = {}
+        for chunk in self.__chunks(list(set(review_ids))):
+            cursor.execute(f'SELECT "id", "review_id" FROM "Review" WHERE "review_id" IN ({self.__placeholders(chunk)})', chunk)
+            found.update((review_id, database_id) for database_id, review_id in cursor.fetchall())
+        return found
+
+    def replace_reports(self, rows: ReportRows) -> None:
+        """
+        Replaces the reports of the reviews of rows in one transaction.
+        """
+        try:
+            cursor = self.connection.cursor()
+            for chunk in self.__chunks([row[2] for row in rows.reports]):
+                reports = f'SELECT "id" FROM "Report" WHERE "review_id" IN ({self.__placeholders(chunk)})'
+                cursor.execute(f'DELETE FROM "IssueImage" WHERE "issue_id" IN (SELECT "id" FROM "Issue" WHERE "report_id" IN ({reports}))', chunk)
+                cursor.execute(f'DELETE FROM "Issue" WHERE "report_id" IN ({reports})', chunk)
+                cursor.execute(f'DELETE FROM "ReliabilityKeyframe" WHERE "report_id" IN ({reports})', chunk)
+                cursor.execute(f'DELETE FROM "Report" WHERE "review_id" IN ({self.__placeholders(chunk)})', chunk)
+
+            self.insert(cursor, "Report", ["id", "report_weight", "review_id"], rows.reports)
+            self.insert(cursor, "ReliabilityKeyframe", ["id", "rel_timestamp", "sentiment", "interp", "report_id"], rows.keyframes)
+            self.insert(cursor, "Issue", ["id", "text", "classification", "criticality", "rel_timestamp", "frequency", "report_id"],
+                rows.issues)
+            self.insert(cursor, "IssueImage", ["id", "image_url", "issue_id"], rows.issue_images)
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+    def insert(self, cursor: Any, table: str, columns: list[str], rows: list[Row]) -> None:
+        if rows:
+            cursor.executemany(f'INSERT INTO "{table}" ({quote_columns(columns)}) '
+                f'VALUES ({", ".join([self.placeholder] * len(columns))})', rows)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __chunks(self, values: list[str]) -> list[list[str]]:
+        return [values[i:i + self.chunk_size] for i in range(0, len(values), self.chunk_size)]
+
+    def __placeholders(self, values: list[Any]) -> str:
+        return ", ".join([self.placeholder] * len(values))
+
+class PostgresReportDatabase(ReportDatabase):
+    """
+    Inserts rows with COPY, which is much faster than INSERT statements for large batches.
+    """
+    placeholder = "%s"
+
+    def __init__(self, url: str) -> None:
+        if not psycopg:
+            raise ValueError("The Postgres report sink needs the psycopg package")
+        super().__init__(psycopg.connect(url))
+
+    def insert(self, cursor: Any, table: str, columns: list[str], rows: list[Row]) -> None:
+        if not rows:
+            return
+        with cursor.copy(f'COPY "{table}" ({quote_columns(columns)}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+
+class SqliteReportDatabase(ReportDatabase):
+    """
+    Stands in for the server's database in local runs and tests. Creates the tables the sink uses if they do not exist.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__(sqlite3.connect(path))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS "Review" ("id" TEXT PRIMARY KEY, "review_id" TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS "Report" ("id" TEXT PRIMARY KEY, "report_weight" REAL NOT NULL, "review_id" TEXT,
+                "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE IF NOT EXISTS "ReliabilityKeyframe" ("id" TEXT PRIMARY KEY, "rel_timestamp" INTEGER NOT NULL,
+                "sentiment" REAL NOT NULL, "interp" TEXT, "report_id" TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS "Issue" ("id" TEXT PRIMARY KEY, "text" TEXT NOT NULL, "classification" TEXT NOT NULL DEFAULT '',
+                "criticality" REAL, "rel_timestamp" INTEGER, "frequency" TEXT, "report_id" TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS "IssueImage" ("id" TEXT PRIMARY KEY, "image_url" TEXT NOT NULL,
+                "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "issue_id" TEXT NOT NULL);
+        """)
+
+def open_report_database(url: str) -> ReportDatabase:
+    """
+    Opens postgres:// and postgresql:// urls with psycopg, and sqlite:///<path> urls with sqlite3.
+    """
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresReportDatabase(url)
+    if url.startswith("sqlite:///"):
+        return SqliteReportDatabase(url.removeprefix("sqlite:///"))
+    raise ValueError(f"Unsupported report sink url {url.split(':', 1)[0]}")
+
+@dataclass
+class PendingReports:
+    reports: list[Report]
+    on_commit: Callable[[], None]
+    on_failure: Callable[[], None]
+
+class ReportSink:
+    """
+    Writes reports on a background thread, once batch_size reports are waiting or the oldest has waited flush_interval seconds.
+    on_commit is called once the reports of an add() are committed, so the message they came from can be acked.
+    If a batch still fails after max_attempts, on_failure is called instead for each of its adds.
+    So is it for adds with reports of reviews that are not in the database yet, which the server may still be inserting.
+    None of their reports are written, the reports queue gets all of them.
+    """
+
+    def __init__(self, open_database: Callable[[], ReportDatabase], batch_size: int, flush_interval: float, max_attempts: int,
+            retry_delay: float = 1) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.__open_database = open_database
+        self.__database: ReportDatabase | None = None
+        self.__pending: list[PendingReports] = []
+        self.__pending_since = 0.0
+        self.__flush_requested = False
+        self.__writing = False
+        self.__running = False
+        self.__condition = threading.Condition()
+        self.__thread: threading.Thread | None = None
+
+    def start(self) -> "ReportSink":
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="report-sink", daemon=True)
+        self.__thread.start()
+        return self
+
+    def add(self, reports: list[Report], on_commit: Callable[[], None], on_failure: Callable[[], None]) -> None:
+        with self.__condition:
+            if not self.__pending:
+                self.__pending_since = time.monotonic()
+            self.__pending.append(PendingReports(reports, on_commit, on_failure))
+            self.__condition.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Blocks until everything added so far is written. Returns False on timeout.
+        """
+        with self.__condition:
+            self.__flush_requested = True
+            self.__condition.notify_all()
+            flushed = self.__condition.wait_for(lambda: not self.__pending and not self.__writing, timeout=timeout)
+            self.__flush_requested = False
+            return flushed
+
+    def close(self, timeout: float | None = 30) -> None:
+        self.flush(timeout)
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        if self.__thread:
+            self.__thread.join(timeout)
+
+    def __pending_reports(self) -> int:
+        return sum(len(pending.reports) for pending in self.__pending)
+
+    def __due(self) -> bool:
+        return bool(self.__pending) and (self.__flush_requested or self.__pending_reports() >= self.batch_size
+            or time.monotonic() - self.__pending_since >= self.flush_interval)
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while self.__running and not self.__due():
+                    self.__condition.wait(self.__pending_since + self.flush_interval - time.monotonic() if self.__pending else None)
+                if not self.__running and not self.__pending:
+                    break
+                batch, self.__pending = self.__pending, []
+                self.__writing = True
+
+            try:
+                self.__write(batch)
+            finally:
+                with self.__condition:
+                    self.__writing = False
+                    self.__condition.notify_all()
+
+        # Connections are closed on the thread that opened them, which SQLite requires
+        self.__disconnect()
+
+    def __write(self, batch: list[PendingReports]) -> None:
+        reports = [report for pending in batch for report in pending.reports]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                start = time.monotonic()
+                if not self.__database:
+                    self.__database = self.__open_database()
+                review_ids = self.__database.review_ids(report.review_id for report in reports)
+                complete: list[PendingReports] = []
+                incomplete: list[PendingReports] = []
+                for pending in batch:
+                    (complete if all(report.review_id in review_ids for report in pending.reports) else incomplete).append(pending)
+                # A review analyzed again within the batch keeps its latest report
+                stored = list({report.review_id: report for pending in complete for report in pending.reports}.values())
+                self.__database.replace_reports(report_rows(stored, review_ids))
+                sink_commit_seconds.observe(time.monotonic() - start)
+                break
+            except Exception as e:
+                print(f"Failed to write {len(reports)} reports (attempt {attempt} of {self.max_attempts}): {e!r}")
+                self.__disconnect()
+                if attempt == self.max_attempts:
+                    sink_reports.inc(len(reports), labels=("failed",))
+                    self.__call_all([pending.on_failure for pending in batch])
+                    return
+                time.sleep(self.retry_delay * attempt)
+
+        missing = sum(len(pending.reports) for pending in incomplete)
+        if missing:
+            print(f"Handing back {missing} reports of {len(incomplete)} messages with reviews that are not in the database yet")
+        sink_reports.inc(len(stored), labels=("written",))
+        sink_reports.inc(missing, labels=("missing_review",))
+        self.__call_all([pending.on_commit for pending in complete] + [pending.on_failure for pending in incomplete])
+
+    @staticmethod
+    def __call_all(callbacks: list[Callable[[], None]]) -> None:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Report sink callback failed: {e!r}")
+
+    def __disconnect(self) -> None:
+        if self.__database:
+            try:
+                self.__database.close()
+            except Exception:
+                pass
+            self.__database = None
+
+def report_sink_from_env() -> ReportSink | None:
+    """
+    Sink writing to REPORT_SINK_URL in batches of REPORT_SINK_BATCH_SIZE reports, or None if REPORT_SINK_URL is not set.
+    Not started yet.
+    """
+    url = get_env("REPORT_SINK_URL")
+    if not url:
+        return None
+    return ReportSink(lambda: open_report_database(url), get_env_int("REPORT_SINK_BATCH_SIZE"),
+        get_env_float("REPORT_SINK_FLUSH_INTERVAL"), get_env_int("REPORT_SINK_MAX_ATTEMPTS"))
@@ -0,0 +1,148 @@
+"""
+Priority lanes for the parse and to_analyze queues.
+
+Messages carry an AMQP priority and the id of the job they belong to (e.g. a crawl, or a single product requested by a user)
+in the x-job-id header. With QUEUE_MAX_PRIORITY set, the queues are priority queues up to it, so the broker delivers higher
+priorities first, and a product requested by hand does not wait behind a crawl. It is 0 by default, which keeps existing
+queues declarable. Consumers prefetch a few more deliveries than they
+have workers, and the workers take them from a FairScheduler: highest priority first, then round-robin across jobs.
+The round-robin only sees the prefetched deliveries, which the broker fills in FIFO order within a priority,
+so jobs of the same priority are only interleaved within that lookahead window and a large crawl still delays later ones.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any, Callable, Generic, TypeVar
+import pika
+
+from listener.metrics import queue_wait_seconds
+from utils.env import get_env_int
+
+T = TypeVar("T")
+
+job_id_header = "x-job-id"
+enqueued_at_header = "x-enqueued-at"
+# Queues shared with the server, which has to declare them with the same arguments
+priority_queues = ["parse", "to_analyze"]
+
+@dataclass(frozen=True)
+class Lane:
+    priority: int = 0
+    job_id: str = ""
+
+def queue_arguments(queue: str) -> dict[str, Any] | None:
+    """
+    Arguments to declare a queue with. RabbitMQ rejects declaring an existing queue with different arguments,
+    so changing QUEUE_MAX_PRIORITY means deleting parse and to_analyze first.
+    """
+    max_priority = get_env_int("QUEUE_MAX_PRIORITY")
+    if max_priority > 0 and queue in priority_queues:
+        return {"x-max-priority": max_priority}
+    return None
+
+def declare_queue(channel: pika.adapters.blocking_connection.BlockingChannel, queue: str) -> None:
+    channel.queue_declare(queue=queue, durable=True, arguments=queue_arguments(queue))
+
+def lane_of(properties: pika.BasicProperties | None) -> Lane:
+    headers = properties.headers if properties and properties.headers else {}
+    return Lane((properties.priority or 0) if properties else 0, str(headers.get(job_id_header) or ""))
+
+def with_lane(properties: pika.BasicProperties, lane: Lane) -> pika.BasicProperties:
+    """
+    Sets the priority and job id of a message about to be published, and stamps the time it is enqueued.
+    """
+    properties.priority = max(0, min(lane.priority, 255))
+    properties.headers = {**(properties.headers or {}), enqueued_at_header: time.time()}
+    if lane.job_id:
+        properties.headers[job_id_header] = lane.job_id
+    return properties
+
+def queue_wait(properties: pika.BasicProperties | None, now: Callable[[], float] = time.time) -> float | None:
+    """
+    Seconds since the message was published, or None for messages without an enqueue time.
+    """
+    headers = properties.headers if properties and properties.headers else {}
+    enqueued_at = headers.get(enqueued_at_header)
+    return max(0.0, now() - float(enqueued_at)) if isinstance(enqueued_at, int | float) else None
+
+def describe_lane(queue: str, properties: pika.BasicProperties | None) -> str:
+    """
+    Priority, job and queue wait of a delivery for the logs. Also records the wait per queue and priority.
+    """
+    lane = lane_of(properties)
+    wait = queue_wait(properties)
+    if wait is not None:
+        queue_wait_seconds.observe(wait, (queue, str(lane.priority)))
+    return f"priority {lane.priority}, job {lane.job_id or 'none'}" + (f", waited {wait:.1f}s" if wait is not None else "")
+
+class FairScheduler(Generic[T]):
+    """
+    Orders items by lane: the highest priority first, then round-robin across the jobs of that priority, FIFO within a job.
+    Thread safe.
+    """
+
+    def __init__(self) -> None:
+        self.__lanes: dict[int, OrderedDict[str, deque[T]]] = {}
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def put(self, item: T, lane: Lane) -> None:
+        with self.__lock:
+            self.__lanes.setdefault(lane.priority, OrderedDict()).setdefault(lane.job_id, deque()).append(item)
+            self.__size += 1
+
+    def pop(self) -> T:
+        """
+        Raises IndexError if there are no items.
+        """
+        with self.__lock:
+            if not self.__lanes:
+                raise IndexError("pop from an empty scheduler")
+            priority = max(self.__lanes)
+            jobs = self.__lanes[priority]
+            job_id, items = next(iter(jobs.items()))
+            item = items.popleft()
+            # The job goes to the back of the round, or leaves it once it has nothing left
+            if items:
+                jobs.move_to_end(job_id)
+            else:
+                del jobs[job_id]
+                if not jobs:
+                    del self.__lanes[priority]
+            self.__size -= 1
+            return item
+
+class WorkerPool:
+    """
+    Bounded pool of workers that take their next delivery from a FairScheduler. Every submit queues one task
+    that runs whichever delivery is first in line by then, so deliveries that arrive later can overtake earlier ones.
+    """
+
+    def __init__(self, size: int, thread_name_prefix: str = "parse-worker") -> None:
+        self.size = size
+        self.in_flight = 0
+        self.scheduler: FairScheduler[tuple[Callable[..., Any], tuple[Any, ...]]] = FairScheduler()
+        self.__executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=thread_name_prefix)
+        self.__lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, lane: Lane = Lane()) -> None:
+        self.scheduler.put((fn, args), lane)
+        self.__executor.submit(self.__run_next)
+
+    def shutdown(self) -> None:
+        self.__executor.shutdown(wait=True)
+
+    def __run_next(self) -> None:
+        fn, args = self.scheduler.pop()
+        with self.__lock:
+            self.in_flight += 1
+        try:
+            fn(*args)
+        finally:
+            with self.__lock:
+                self.in_flight -= 1
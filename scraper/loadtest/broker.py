@@ -0,0 +1,168 @@
+from collections import deque
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Callable
+import pika
+
+from listener.publisher import OutgoingMessage, json_properties
+
+@dataclass
+class Delivery:
+    queue: str
+    body: bytes
+    properties: pika.BasicProperties
+    published_at: float
+    redelivered: bool = False
+    dispatched_at: float = 0
+
+@dataclass
+class ConsumerStats:
+    delivered: int = 0
+    acked: int = 0
+    nacked: int = 0
+    first_dispatch: float | None = None
+    last_ack: float | None = None
+    lag: list[float] = field(default_factory=list) # Time from publishing to dispatching to the consumer
+    processing: list[float] = field(default_factory=list) # Time from dispatching to the ack
+
+class InMemoryBroker:
+    """
+    Stand-in for RabbitMQ for load tests, with the publish interface of listener.publisher.Publisher and
+    consumers that call listener callbacks like a BlockingChannel would. Publishes are confirmed immediately.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.on_publish: list[Callable[[Delivery], None]] = []
+        self.on_ack: list[Callable[[Delivery], None]] = []
+        self.consumers: dict[str, "Consumer"] = {}
+        self.condition = threading.Condition()
+        self.__queues: dict[str, deque[Delivery]] = {}
+
+    def publish(self, routing_key: str, body: bytes | str, properties: pika.BasicProperties | None = None,
+            on_confirm: Callable[[], None] | None = None, exchange: str = '') -> None:
+        self.publish_batch([OutgoingMessage(routing_key, body, properties or json_properties(), None, exchange)], on_confirm)
+
+    def publish_batch(self, messages: list[OutgoingMessage], on_confirm: Callable[[], None] | None = None) -> None:
+        deliveries = [Delivery(message.routing_key, message.body.encode() if isinstance(message.body, str) else message.body,
+            message.properties, self.clock()) for message in messages]
+        with self.condition:
+            for delivery in deliveries:
+                self.__queues.setdefault(delivery.queue, deque()).append(delivery)
+            self.condition.notify_all()
+
+        for delivery in deliveries:
+            for hook in self.on_publish:
+                hook(delivery)
+        if on_confirm:
+            on_confirm()
+
+    def pending_count(self) -> int:
+        return 0
+
+    def depth(self, queue: str) -> int:
+        with self.condition:
+            return len(self.__queues.get(queue, ()))
+
+    def consume(self, queue: str, callback: Callable[..., None], prefetch: int) -> "Consumer":
+        consumer = Consumer(self, queue, callback, prefetch)
+        self.consumers[queue] = consumer
+        consumer.start()
+        return consumer
+
+    def idle(self) -> bool:
+        """
+        True if no consumed queue has messages waiting or unacked.
+        """
+        with self.condition:
+            return all(not self.__queues.get(queue) and not consumer.unacked for queue, consumer in self.consumers.items())
+
+    def close(self) -> None:
+        for consumer in self.consumers.values():
+            consumer.stop()
+
+    def _next(self, queue: str) -> Delivery | None:
+        queued = self.__queues.get(queue)
+        return queued.popleft() if queued else None
+
+    def _requeue(self, delivery: Delivery) -> None:
+        delivery.redelivered = True
+        self.__queues.setdefault(delivery.queue, deque()).appendleft(delivery)
+
+class Consumer:
+    """
+    Dispatches deliveries of one queue to a callback on its own thread, with at most prefetch deliveries unacked.
+    """
+
+    def __init__(self, broker: InMemoryBroker, queue: str, callback: Callable[..., None], prefetch: int) -> None:
+        self.broker = broker
+        self.queue = queue
+        self.prefetch = prefetch
+        self.stats = ConsumerStats()
+        self.unacked: dict[int, Delivery] = {}
+        self.connection = self
+        self.__callback = callback
+        self.__delivery_tag = 0
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name=f"consume-{queue}", daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        with self.broker.condition:
+            self.__running = False
+            self.broker.condition.notify_all()
+        self.__thread.join()
+
+    # The consumer is its own channel and connection for the listener callbacks
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        callback()
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> None:
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def basic_ack(self, delivery_tag: int) -> None:
+        with self.broker.condition:
+            delivery = self.unacked.pop(delivery_tag)
+            now = self.broker.clock()
+            self.stats.acked += 1
+            self.stats.last_ack = now
+            self.stats.processing.append(now - delivery.dispatched_at)
+            self.broker.condition.notify_all()
+        for hook in self.broker.on_ack:
+            hook(delivery)
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True) -> None:
+        with self.broker.condition:
+            delivery = self.unacked.pop(delivery_tag)
+            self.stats.nacked += 1
+            if requeue:
+                self.broker._requeue(delivery)
+            self.broker.condition.notify_all()
+
+    def __run(self) -> None:
+        while True:
+            with self.broker.condition:
+                delivery = None
+                while self.__running and (len(self.unacked) >= self.prefetch or not (delivery := self.broker._next(self.queue))):
+                    self.broker.condition.wait()
+                if not self.__running or not delivery:
+                    return
+
+                self.__delivery_tag += 1
+                delivery.dispatched_at = self.broker.clock()
+                self.unacked[self.__delivery_tag] = delivery
+                self.stats.delivered += 1
+                self.stats.lag.append(delivery.dispatched_at - delivery.published_at)
+                if self.stats.first_dispatch is None:
+                    self.stats.first_dispatch = delivery.dispatched_at
+
+            method_frame = pika.spec.Basic.Deliver(delivery_tag=self.__delivery_tag, redelivered=delivery.redelivered, routing_key=self.queue)
+            try:
+                self.__callback(self, method_frame, delivery.properties, delivery.body)
+            except Exception as e:
+                print(f"Consumer of {self.queue} failed: {e!r}")
@@ -0,0 +1,154 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import html
+import math
+import random
+
+from parsing.amazon import Review
+from requester.amazon import AmazonRegion, url_for_reviews
+
+reviews_per_page = 10
+
+@dataclass
+class LogNormal:
+    """
+    Log-normal distribution of counts, e.g. reviews per product or words per review, clamped to [minimum, maximum].
+    """
+    median: float
+    sigma: float
+    minimum: int = 1
+    maximum: int = 10000
+
+    def sample(self, rng: random.Random) -> int:
+        value = int(rng.lognormvariate(math.log(self.median), self.sigma)) if self.sigma > 0 else int(self.median)
+        return max(self.minimum, min(self.maximum, value))
+
+@dataclass
+class SyntheticProduct:
+    product_id: str
+    region: AmazonRegion
+    name: str
+    manufacturer: str
+    reviews: list[Review]
+
+    def message(self) -> dict[str, str]:
+        """
+        The parse queue message for this product.
+        """
+        return {"type": "amazon", "region": self.region.value, "id": self.product_id}
+
+# Sentences that look like real reviews, with ownership periods and issues for the analyzer to find
+sentences = [
+    "I bought this {months} months ago for my home office.",
+    "The {part} stopped working after {months} months of light use.",
+    "After about {weeks} weeks the {part} started making a grinding noise.",
+    "Support replaced the {part} once, but the replacement broke within a month.",
+    "Setup was easy and it worked great out of the box.",
+    "It still works fine after {years} years of daily use.",
+    "The battery only lasts a few hours now, it used to last all day.",
+    "Build quality feels cheap and the {part} is already loose.",
+    "For the price it is fine, but I would not buy it again.",
+    "My previous one lasted {years} years, this one did not make it to {months} months.",
+]
+parts = ["button", "hinge", "cable", "fan", "switch", "charging port", "screen", "wheel", "motor", "lid"]
+countries = {AmazonRegion.COM: "the United States", AmazonRegion.CA: "Canada"}
+
+def synthetic_text(words: int, rng: random.Random) -> str:
+    text: list[str] = []
+    count = 0
+    while count < words:
+        sentence = rng.choice(sentences).format(months=rng.randint(1, 18), weeks=rng.randint(1, 10), years=rng.randint(1, 5),
+            part=rng.choice(parts))
+        text.append(sentence)
+        count += len(sentence.split())
+    return " ".join(text)
+
+def synthetic_corpus(products: int, reviews: LogNormal, words: LogNormal, seed: int = 0,
+        region: AmazonRegion = AmazonRegion.CA) -> list[SyntheticProduct]:
+    """
+    Generates products with a review count drawn from reviews and review lengths drawn from words.
+    The same seed always gives the same corpus.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for p in range(products):
+        product_id = __product_id(seed, p)
+        name = f"Synthetic Product {p} ({rng.choice(parts)} edition)"
+        manufacturer = f"Maker{p % 20}"
+        corpus.append(SyntheticProduct(product_id, region, name, manufacturer, [__review(seed, p, i, name, manufacturer, region, words, rng)
+            for i in range(reviews.sample(rng))]))
+    return corpus
+
+def __review(seed: int, p: int, i: int, name: str, manufacturer: str, region: AmazonRegion, words: LogNormal, rng: random.Random) -> Review:
+    date = datetime(2022, 1, 1) + timedelta(days=rng.randint(0, 365))
+    return Review(
+        author_id=f"amzn1.account.LOAD{p}X{i}",
+        author_name=f"Reviewer {i}",
+        author_image_url="https://images-na.ssl-images-amazon.com/images/S/amazon-avatars-global/default.png",
+        title=rng.choice(["Broke quickly", "Great value", "Not as expected", "Works well", "Disappointed"]),
+        text=synthetic_text(words.sample(rng), rng),
+        date=int(date.timestamp()),
+        date_text=f"{date:%B} {date.day}, {date.year}",
+        review_id=f"RLOAD{seed}P{p}R{i}",
+        attributes={"Colour": rng.choice(["Black", "White"])},
+        verified_purchase=rng.random() < 0.8,
+        found_helpful_count=rng.randint(0, 9),
+        is_top_positive_review=False,
+        is_top_critical_review=False,
+        images=[],
+        country_reviewed_in=countries[region],
+        region=region,
+        product_name=name,
+        product_image_url=f"https://m.media-amazon.com/images/I/{__product_id(seed, p)}.jpg",
+        manufacturer_name=manufacturer,
+        manufacturer_id=manufacturer.lower()
+    )
+
+def __product_id(seed: int, p: int) -> str:
+    return f"B0LOAD{seed:02d}{p:04d}"
+
+def render_review(review: Review) -> str:
+    attributes = '<i class="a-icon-text-separator"></i>'.join(f"{html.escape(key)}: {html.escape(value)}"
+        for key, value in review.attributes.items())
+    return f"""
+<div id="{review.review_id}" data-hook="review" class="a-section review aok-relative">
+  <a href="/gp/profile/{review.author_id}/ref=cm_cr_arp_d_gw_btm" class="a-profile">
+    <div class="a-profile-avatar"><img src="{review.author_image_url}"></div>
+    <div class="a-profile-content"><span class="a-profile-name">{html.escape(review.author_name)}</span></div>
+  </a>
+  <a data-hook="review-title" class="a-link-normal review-title" href="/gp/customer-reviews/{review.review_id}/ref=cm_cr_arp_d_rvw_ttl?ie=UTF8">
+    <span>{html.escape(review.title)}</span>
+  </a>
+  <span data-hook="review-date" class="a-size-base a-color-secondary review-date">Reviewed in {review.country_reviewed_in} on {review.date_text}</span>
+  <div class="a-row a-spacing-mini review-data review-format-strip"><a class="a-size-mini a-link-normal a-color-secondary">{attributes}</a>
+    {'<span data-hook="avp-badge" class="a-size-mini a-color-state a-text-bold">Verified Purchase</span>' if review.verified_purchase else ''}
+  </div>
+  <span data-hook="review-body" class="a-size-base review-text review-text-content"><span>{html.escape(review.text)}</span></span>
+  {f'<span data-hook="helpful-vote-statement" class="a-size-base a-color-tertiary cr-vote-text">{review.found_helpful_count} people found this helpful</span>'
+    if review.found_helpful_count else ''}
+</div>"""
+
+def render_reviews_page(product: SyntheticProduct, reviews: list[Review]) -> str:
+    """
+    A product reviews page with the markup parsing.amazon reads.
+    """
+    return f"""<html><body>
+<div class="product-title"><a data-hook="product-link" class="a-link-normal" href="/dp/{product.product_id}">{html.escape(product.name)}</a></div>
+<img data-hook="cr-product-image" src="https://m.media-amazon.com/images/I/{product.product_id}.jpg"
+  data-a-hires="https://m.media-amazon.com/images/I/{product.product_id}.jpg">
+<div class="product-by-line"><a class="a-link-normal" href="/stores/{product.manufacturer}/page/{product.manufacturer.lower()}?ref_=ast_bln">
+  {html.escape(product.manufacturer)}</a></div>
+<div id="cm_cr-review_list">{"".join(render_review(review) for review in reviews)}</div>
+</body></html>"""
+
+def recorded_pages(corpus: list[SyntheticProduct]) -> dict[str, str]:
+    """
+    Review pages of every product by url, as request_reviews would request them.
+    Urls past the last page are not included, they are answered with an empty page.
+    """
+    pages = {}
+    for product in corpus:
+        for page in range(math.ceil(len(product.reviews) / reviews_per_page)):
+            pages[url_for_reviews(product.region, product.product_id, page)] = render_reviews_page(product,
+                product.reviews[page * reviews_per_page:(page + 1) * reviews_per_page])
+    return pages
@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field
+import json
+import math
+import threading
+import time
+from typing import cast
+
+from listener.envelope import decode
+from listener.flow_control import FlowController
+from listener.parser import make_parse_handler
+from listener.publisher import Publisher
+from listener.scheduling import WorkerPool
+from loadtest.broker import ConsumerStats, Delivery, InMemoryBroker
+from loadtest.corpus import SyntheticProduct, recorded_pages
+from loadtest.recorded import recorded_pages_served
+
+@dataclass
+class StageResult:
+    name: str
+    stats: ConsumerStats
+    reviews: int
+
+    def duration(self) -> float:
+        if self.stats.first_dispatch is None or self.stats.last_ack is None:
+            return 0
+        return self.stats.last_ack - self.stats.first_dispatch
+
+@dataclass
+class LoadTestResult:
+    products: int
+    reviews: int
+    duration: float
+    requests: int
+    stages: list[StageResult]
+    latencies: list[float] = field(default_factory=list) # End-to-end per product, from the parse message to its last output
+    unfinished: list[str] = field(default_factory=list)
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile, p between 0 and 100.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def run_load_test(corpus: list[SyntheticProduct], rate: float, analyze: bool = False, prefetch: int = 10, latency: float = 0.05,
+        sessions: int = 4, request_rate: float = 0, flow_high_water: int = 0, flow_low_water: int = 0,
+        timeout: float = 600) -> LoadTestResult:
+    """
+    Sends the corpus to the parse listener through an in-memory broker at rate products per second, with review pages
+    served from recordings after latency seconds. With analyze, to_analyze is consumed by the analyzer listener,
+    which needs the analyzer models. Otherwise a product is finished once its reviews are published to to_analyze.
+    """
+    broker = InMemoryBroker()
+    product_of_review = {review.review_id: product.product_id for product in corpus for review in product.reviews}
+    enqueued_at: dict[str, float] = {}
+    finished_at: dict[str, float] = {}
+    reviews_out = {"parse": 0, "analyze": 0}
+    lock = threading.Lock()
+
+    def finish(delivery: Delivery, stage: str) -> None:
+        reviews = decode(delivery.body, delivery.properties)
+        now = broker.clock()
+        with lock:
+            reviews_out[stage] += len(reviews)
+            for review in reviews:
+                product_id = product_of_review.get(review.get("review_id"))
+                if product_id:
+                    finished_at[product_id] = max(finished_at.get(product_id, 0), now)
+
+    broker.on_publish.append(lambda delivery: finish(delivery, "parse") if delivery.queue == "to_analyze" and not analyze else None)
+    broker.on_ack.append(lambda delivery: finish(delivery, "analyze") if delivery.queue == "to_analyze" else None)
+    if analyze:
+        broker.on_publish.append(lambda delivery: __count_parsed(delivery, reviews_out, lock) if delivery.queue == "to_analyze" else None)
+
+    with recorded_pages_served(recorded_pages(corpus), latency, sessions, request_rate) as session_pool:
+        flow = FlowController("to_analyze", lambda: broker.depth("to_analyze"), flow_high_water, flow_low_water, check_interval=0.5)
+        # The broker has the publish interface of a Publisher
+        publisher = cast(Publisher, broker)
+        pool = WorkerPool(prefetch)
+        broker.consume("parse", make_parse_handler(publisher, flow, pool), prefetch)
+        if analyze:
+            from listener.analyzer import make_analyze_handler
+            broker.consume("to_analyze", make_analyze_handler(publisher), prefetch=1)
+
+        start = broker.clock()
+        for i, product in enumerate(corpus):
+            delay = start + i / rate - broker.clock() if rate > 0 else 0
+            if delay > 0:
+                time.sleep(delay)
+            enqueued_at[product.product_id] = broker.clock()
+            broker.publish("parse", json.dumps(product.message()))
+
+        deadline = start + timeout
+        while not (broker.idle() and pool.in_flight == 0) and broker.clock() < deadline:
+            time.sleep(0.05)
+        duration = broker.clock() - start
+
+        broker.close()
+        pool.shutdown()
+        requests = sum(pooled.session.requests for pooled in session_pool.sessions)
+
+    stages = [StageResult("parse", broker.consumers["parse"].stats, reviews_out["parse"])]
+    if analyze:
+        stages.append(StageResult("analyze", broker.consumers["to_analyze"].stats, reviews_out["analyze"]))
+    return LoadTestResult(
+        products=len(corpus),
+        reviews=sum(len(product.reviews) for product in corpus),
+        duration=duration,
+        requests=requests,
+        stages=stages,
+        latencies=[finished_at[product_id] - enqueued_at[product_id] for product_id in finished_at],
+        unfinished=[product.product_id for product in corpus if product.product_id not in finished_at]
+    )
+
+def __count_parsed(delivery: Delivery, reviews_out: dict[str, int], lock: threading.Lock) -> None:
+    reviews = decode(delivery.body, delivery.properties)
+    with lock:
+        reviews_out["parse"] += len(reviews)
+
+def format_result(result: LoadTestResult) -> str:
+    lines = [f"{result.products} products, {result.reviews} reviews, {result.requests} page requests in {result.duration:.1f}s",
+        f"{'stage':<10}{'messages':>10}{'reviews':>10}{'reviews/s':>11}{'lag p50':>10}{'lag p95':>10}{'lag max':>10}"
+        f"{'busy p50':>10}{'busy p95':>10}"]
+    for stage in result.stages:
+        duration = stage.duration()
+        lines.append(f"{stage.name:<10}{stage.stats.acked:>10}{stage.reviews:>10}{stage.reviews / duration if duration else 0:>11.1f}"
+            f"{percentile(stage.stats.lag, 50):>10.2f}{percentile(stage.stats.lag, 95):>10.2f}{max(stage.stats.lag, default=0):>10.2f}"
+            f"{percentile(stage.stats.processing, 50):>10.2f}{percentile(stage.stats.processing, 95):>10.2f}")
+    lines.append("end-to-end latency per product: " + ", ".join(f"p{p} {percentile(result.latencies, p):.2f}s" for p in [50, 90, 99])
+        + f", max {max(result.latencies, default=0):.2f}s")
+    if result.unfinished:
+        lines.append(f"{len(result.unfinished)} products did not finish: {', '.join(result.unfinished[:10])}")
+    return "\n".join(lines)
@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+import requester.request_maker as request_maker
+from requester.rate_limit import DomainRateLimiter
+from requester.session_pool import SessionPool
+
+empty_page = "<html><body><div id=\"cm_cr-review_list\"></div></body></html>"
+
+@dataclass
+class RecordedResponse:
+    status_code: int
+    text: str
+
+class RecordedSession:
+    """
+    Stands in for a curl_cffi session, answering from recorded pages after a simulated network latency.
+    Unknown urls get an empty page, like a page past the last page of reviews.
+    """
+
+    def __init__(self, pages: dict[str, str], latency: float = 0, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+        self.cookies: dict[str, str] = {}
+        self.__sleep = sleep
+        self.__lock = threading.Lock()
+
+    def get(self, url: str, **kwargs: Any) -> RecordedResponse:
+        with self.__lock:
+            self.requests += 1
+        if self.latency > 0:
+            self.__sleep(self.latency)
+        return RecordedResponse(200, self.pages.get(url, empty_page))
+
+@contextmanager
+def recorded_pages_served(pages: dict[str, str], latency: float = 0, sessions: int = 4,
+        rate_per_second: float = 0) -> Iterator[SessionPool]:
+    """
+    Serves request_page from recorded pages while inside the context, through a session pool of the given size.
+    rate_per_second paces requests like the production rate limiter, 0 does not limit them.
+    """
+    previous = request_maker.session_pool, request_maker.rate_limiter
+    unlimited = 10 ** 9
+    rate = rate_per_second or unlimited
+    request_maker.session_pool = SessionPool(sessions, lambda: RecordedSession(pages, latency))
+    request_maker.rate_limiter = DomainRateLimiter(rate=rate, burst=max(1, rate), min_rate=rate, max_rate=rate)
+    try:
+        yield request_maker.session_pool
+    finally:
+        request_maker.session_pool, request_maker.rate_limiter = previous
@@ -1,8 +1,11 @@
-from attr import dataclass
+from typing import Any
+from attr import dataclass, field
 import bs4
-from requester.amazon import AmazonRegion, request_reviews
+from requester.amazon import AmazonRegion, new_retry_budget, request_reviews
 import re
 from dateutil import parser
+from utils import intern_dict, intern_str
+from utils.serialization import schema_for
 
 max_pages = 1000
 
@@ -12,37 +15,57 @@ class ParsingError(Exception):
         super().__init__(message)
 
 
-@dataclass
+@dataclass(slots=True)
 class Review:
+    """
+    Slotted, since up to 10,000 reviews of a product are held in memory at once.
+    Fields that repeat across reviews are interned, so every review of a product shares one copy.
+    """
     author_id: str | None
     author_name: str
     author_image_url: str
     title: str
     text: str
     date: int
-    date_text: str
+    date_text: str = field(converter=intern_str)
     review_id: str
-    attributes: dict[str, str]
+    attributes: dict[str, str] = field(converter=intern_dict)
     verified_purchase: bool
     found_helpful_count: int
     is_top_positive_review: bool
     is_top_critical_review: bool
     images: list[str]
-    country_reviewed_in: str
+    country_reviewed_in: str = field(converter=intern_str)
     region: AmazonRegion
-    product_name: str | None
-    product_image_url: str | None
-    manufacturer_name: str | None
-    manufacturer_id: str | None
+    product_name: str | None = field(converter=intern_str)
+    product_image_url: str | None = field(converter=intern_str)
+    manufacturer_name: str | None = field(converter=intern_str)
+    manufacturer_id: str | None = field(converter=intern_str)
+
+def __timestamp(value: Any) -> Any:
+    return int(parser.parse(value).timestamp()) if isinstance(value, str) else value
+
+def __image_urls(value: Any) -> Any:
+    return [image["image_url"] if isinstance(image, dict) else image for image in value] if isinstance(value, list) else value
+
+# Reviews sent back by the web server come from its database: dates are ISO strings,
+# images are ReviewImage rows and the author image is nullable.
+review_schema = schema_for(Review, coerce={
+    "date": __timestamp,
+    "images": __image_urls,
+    "author_image_url": lambda value: value or ""
+})
 
 def parse_reviews(region: AmazonRegion, product_id: str, page_limit: int = max_pages) -> list[Review]:
     """
     Continue requesting the next page of reviews until the page_limit is reached or no more reviews are found.
+    Requests share one retry budget, so a blocked product can not keep a worker retrying for 1000 pages.
     """
     result: list[Review] = []
+    budget = new_retry_budget()
 
     for i in range(page_limit):
-        html = request_reviews(region, product_id, i)
+        html = request_reviews(region, product_id, i, budget)
         page = bs4.BeautifulSoup(html, features="html.parser")
 
         reviewElems = page.select(".review")
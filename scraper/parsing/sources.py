@@ -0,0 +1,25 @@
+from enum import Enum
+from typing import Any
+
+import parsing.amazon as amazon
+from requester.amazon import AmazonRegion
+
+class ReviewSource(str, Enum):
+    AMAZON = "amazon",
+    UNKNOWN = "unknown"
+
+def get_reviews(parsed: dict[str, Any]) -> list[amazon.Review]:
+    """
+    Get all reviews for the product described by a parse message ({"type", "region", "id"}) from the scraper.
+    """
+    source = ReviewSource(parsed["type"])
+
+    match source:
+        case ReviewSource.AMAZON:
+            region = AmazonRegion(parsed["region"])
+            if region:
+                return amazon.parse_reviews(region, parsed["id"])
+            else:
+                raise ValueError(f"Unknown region {parsed['region']}")
+        case _:
+            raise ValueError(f"Unknown review source {source}")
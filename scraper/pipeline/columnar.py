@@ -0,0 +1,338 @@
+"""
+Columnar export of reviews and reports for offline analytics and training, without replaying queues or recrawling.
+
+Records are written to <directory>/<kind>/<key>=<value>/.../part-*/ directories, one NumPy file per column.
+Numbers and booleans are plain arrays, strings are UTF-8 bytes with offsets like Arrow, and nested values are JSON strings.
+Columns with missing values get a <column>.nulls.npy mask. Uncompressed parts are memory-mapped when loaded,
+compressed parts only decompress the columns that are read.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+import numpy as np
+
+from analyzer.report import Report
+from parsing.amazon import Review
+from utils.compression import compress, decompress
+from utils.env import get_env, get_env_float, get_env_int
+from utils.serialization import decode_json, encode_json, to_primitive
+
+part_metadata = "_part.json"
+extensions = {"identity": "", "gzip": ".gz", "zstd": ".zst"}
+
+def column_type(values: list[Any]) -> str:
+    """
+    Narrowest type that holds all values that are not None: bool, int64, float64, str or json, or null if all are None.
+    """
+    present = [value for value in values if value is not None]
+    if not present:
+        return "null"
+    if all(type(value) is bool for value in present):
+        return "bool"
+    if all(type(value) is int for value in present):
+        return "int64" if all(-2 ** 63 <= value < 2 ** 63 for value in present) else "float64"
+    if all(type(value) in (int, float) for value in present):
+        return "float64"
+    if all(type(value) is str for value in present):
+        return "str"
+    return "json"
+
+def object_array(values: list[Any]) -> np.ndarray:
+    """
+    One dimensional object array, even if the values are lists themselves.
+    """
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+class StringColumn:
+    """
+    Strings stored as the concatenated UTF-8 bytes in data, string i being data[offsets[i]:offsets[i + 1]].
+    Decodes only the strings that are accessed, so a memory-mapped column is not read as a whole.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray) -> None:
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data.tobytes()
+        return (data[start:end].decode() for start, end in itertools.pairwise(self.offsets.tolist()))
+
+    def to_numpy(self) -> np.ndarray:
+        return object_array(list(self))
+
+@dataclass(slots=True)
+class Part:
+    path: str
+    partition: dict[str, str]
+    rows: int
+    compression: str
+    types: dict[str, str]
+    nulls: list[str]
+
+    def column(self, name: str) -> np.ndarray | StringColumn:
+        """
+        Values of a column without its nulls, which are 0, False or empty strings. Use null_mask to tell them apart.
+        """
+        match self.types[name]:
+            case "null":
+                return np.full(self.rows, None, dtype=object)
+            case "str" | "json":
+                return StringColumn(self.__array(f"{name}.offsets"), self.__array(f"{name}.data"))
+            case _:
+                return self.__array(name)
+
+    def null_mask(self, name: str) -> np.ndarray:
+        return self.__array(f"{name}.nulls") if name in self.nulls else np.zeros(self.rows, dtype=bool)
+
+    def values(self, name: str) -> np.ndarray:
+        """
+        Column as a regular array: an object array of strings or decoded JSON with None for nulls,
+        or a masked array for numbers and booleans with nulls.
+        """
+        if self.types[name] == "null":
+            return np.full(self.rows, None, dtype=object)
+        column = self.column(name)
+        if isinstance(column, StringColumn):
+            values = column.to_numpy()
+            if self.types[name] == "json":
+                values = object_array([decode_json(value) if value else None for value in values])
+            if name in self.nulls:
+                values[self.null_mask(name)] = None
+            return values
+        if name in self.nulls:
+            return np.ma.MaskedArray(column, mask=self.null_mask(name))
+        return column
+
+    def __array(self, name: str) -> np.ndarray:
+        path = os.path.join(self.path, f"{name}.npy{extensions[self.compression]}")
+        if self.compression == "identity":
+            return np.load(path, mmap_mode="r")
+        with open(path, "rb") as f:
+            return np.load(io.BytesIO(decompress(f.read(), self.compression)))
+
+class ColumnarWriter:
+    """
+    Buffers rows per kind and partition, and writes every part_rows of them as a new part. Parts are never modified,
+    so appending only writes the new rows. Parts are written to a hidden directory and renamed once complete,
+    so readers never see half written parts. Thread safe.
+    A long-running writer sees many partitions that never fill a part, so all buffers are also written once they hold
+    max_buffered_rows rows together, or once their oldest row waited flush_interval seconds (0 disables either).
+    The age of the oldest row is also checked every flush_interval / 2 seconds on a background thread,
+    so rows are written even if nothing is appended anymore.
+    """
+
+    def __init__(self, directory: str, part_rows: int, compression: str, max_buffered_rows: int = 0, flush_interval: float = 0,
+            clock: Callable[[], float] = time.monotonic) -> None:
+        if compression not in extensions:
+            raise ValueError(f"Unknown compression {compression}")
+        self.directory = directory
+        self.part_rows = part_rows
+        self.compression = compression
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_interval = flush_interval
+        self.written: dict[str, int] = {}
+        self.buffered = 0
+        self.__buffers: dict[tuple[str, tuple[tuple[str, str], ...]], list[dict[str, Any]]] = {}
+        self.__oldest: float | None = None
+        self.__clock = clock
+        self.__parts = itertools.count()
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__thread: threading.Thread | None = None
+        if flush_interval > 0:
+            self.__thread = threading.Thread(target=self.__flush_periodically, name="columnar-flush", daemon=True)
+            self.__thread.start()
+
+    def append(self, kind: str, partition: dict[str, str], rows: list[dict[str, Any]]) -> None:
+        key = (kind, tuple(partition.items()))
+        with self.__lock:
+            now = self.__clock()
+            if self.__oldest is None:
+                self.__oldest = now
+            buffer = self.__buffers.setdefault(key, [])
+            buffer.extend(rows)
+            self.buffered += len(rows)
+            full = buffer if len(buffer) >= self.part_rows else None
+            if full:
+                del self.__buffers[key]
+                self.buffered -= len(full)
+            flush_all = (self.max_buffered_rows > 0 and self.buffered >= self.max_buffered_rows) or self.__overdue(now)
+        if full:
+            self.__write(kind, partition, full)
+        if flush_all:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.__lock:
+            buffers = self.__buffers
+            self.__buffers = {}
+            self.buffered = 0
+            self.__oldest = None
+        for (kind, partition), rows in buffers.items():
+            self.__write(kind, dict(partition), rows)
+
+    def close(self) -> None:
+        self.__closed.set()
+        if self.__thread:
+            self.__thread.join()
+        self.flush()
+
+    def __overdue(self, now: float) -> bool:
+        return self.flush_interval > 0 and self.__oldest is not None and now - self.__oldest >= self.flush_interval
+
+    def __flush_periodically(self) -> None:
+        while not self.__closed.wait(self.flush_interval / 2):
+            with self.__lock:
+                overdue = self.__overdue(self.__clock())
+            if overdue:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Failed to write buffered export rows: {e!r}")
+
+    def __write(self, kind: str, partition: dict[str, str], rows: list[dict[str, Any]]) -> None:
+        directory = os.path.join(self.directory, kind, *(f"{key}={value}" for key, value in partition.items()))
+        name = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self.__parts):06d}"
+        temporary = os.path.join(directory, f".{name}")
+        os.makedirs(temporary)
+
+        types: dict[str, str] = {}
+        nulls: list[str] = []
+        for column in dict.fromkeys(key for row in rows for key in row):
+            values = [row.get(column) for row in rows]
+            types[column] = column_type(values)
+            if any(value is None for value in values):
+                nulls.append(column)
+                self.__save(temporary, f"{column}.nulls", np.array([value is None for value in values]))
+            self.__save_column(temporary, column, types[column], values)
+
+        with open(os.path.join(temporary, part_metadata), "w") as f:
+            json.dump({"rows": len(rows), "compression": self.compression, "types": types, "nulls": nulls}, f)
+        os.rename(temporary, os.path.join(directory, name))
+        with self.__lock:
+            self.written[kind] = self.written.get(kind, 0) + len(rows)
+
+    def __save_column(self, directory: str, name: str, dtype: str, values: list[Any]) -> None:
+        match dtype:
+            case "null":
+                pass # Only the nulls mask is written
+            case "bool":
+                self.__save(directory, name, np.array([bool(value) for value in values]))
+            case "int64" | "float64":
+                self.__save(directory, name, np.array([value or 0 for value in values], dtype=dtype))
+            case _:
+                encoded = [b"" if value is None else value.encode() if dtype == "str" else encode_json(value) for value in values]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                self.__save(directory, f"{name}.offsets", offsets)
+                self.__save(directory, f"{name}.data", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __save(self, directory: str, name: str, array: np.ndarray) -> None:
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        with open(os.path.join(directory, f"{name}.npy{extensions[self.compression]}"), "wb") as f:
+            f.write(compress(buffer.getvalue(), self.compression))
+
+def scan(directory: str, kind: str, **partition: str) -> Iterator[Part]:
+    """
+    Parts of a kind, optionally only those of a partition, e.g. scan("results/export", "issues", region="ca").
+    """
+    root = os.path.join(directory, kind)
+    for path, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(subdirectory for subdirectory in subdirectories if not subdirectory.startswith("."))
+        if part_metadata not in files:
+            continue
+        keys = dict(segment.split("=", 1) for segment in os.path.relpath(path, root).split(os.sep) if "=" in segment)
+        if any(keys.get(key) != value for key, value in partition.items()):
+            continue
+        with open(os.path.join(path, part_metadata)) as f:
+            metadata = json.load(f)
+        yield Part(path, keys, metadata["rows"], metadata["compression"], metadata["types"], metadata["nulls"])
+
+def load_columns(directory: str, kind: str, columns: list[str], **partition: str) -> dict[str, np.ndarray]:
+    """
+    Reads only the given columns of all parts of a kind into arrays, see Part.values.
+    """
+    parts = list(scan(directory, kind, **partition))
+    result = {}
+    for column in columns:
+        values = [part.values(column) if column in part.types else np.ma.masked_all(part.rows, dtype=object) for part in parts]
+        if not values:
+            result[column] = np.array([], dtype=object)
+        elif any(isinstance(value, np.ma.MaskedArray) for value in values):
+            result[column] = np.ma.concatenate(values)
+        else:
+            result[column] = np.concatenate(values)
+    return result
+
+class ReviewExport:
+    """
+    Exports reviews and the reports, keyframes and issues of their analysis as separate kinds, partitioned by
+    the region and month of the review. Keyframes and issues are flattened to one row each, with the review_id of their report.
+    """
+
+    def __init__(self, writer: ColumnarWriter) -> None:
+        self.writer = writer
+
+    def add_reviews(self, reviews: list[Review]) -> None:
+        for partition, rows in self.__by_partition([(review, to_primitive(review)) for review in reviews]):
+            self.writer.append("reviews", partition, rows)
+
+    def add_reports(self, reports: list[Report], reviews: list[Review]) -> None:
+        """
+        Reports are partitioned like the review they are about, and in an unknown partition if it is not among reviews.
+        """
+        review_by_id = {review.review_id: review for review in reviews}
+        by_review = [(review_by_id.get(report.review_id), report) for report in reports]
+
+        for kind, rows in [
+            ("reports", [(review, {"review_id": report.review_id, "report_weight": report.report_weight}) for review, report in by_review]),
+            ("keyframes", [(review, {"review_id": report.review_id, **to_primitive(keyframe)})
+                for review, report in by_review for keyframe in report.reliability_keyframes]),
+            ("issues", [(review, {"review_id": report.review_id, **to_primitive(issue)})
+                for review, report in by_review for issue in report.issues]),
+        ]:
+            for partition, partition_rows in self.__by_partition(rows):
+                self.writer.append(kind, partition, partition_rows)
+
+    def close(self) -> None:
+        self.writer.close()
+
+    @staticmethod
+    def partition(review: Review | None) -> dict[str, str]:
+        if review is None:
+            return {"region": "unknown", "month": "unknown"}
+        return {"region": review.region.value, "month": datetime.fromtimestamp(review.date, timezone.utc).strftime("%Y-%m")}
+
+    def __by_partition(self, rows: list[tuple[Review | None, dict[str, Any]]]) -> list[tuple[dict[str, str], list[dict[str, Any]]]]:
+        grouped: dict[tuple[tuple[str, str], ...], list[dict[str, Any]]] = {}
+        for review, row in rows:
+            grouped.setdefault(tuple(self.partition(review).items()), []).append(row)
+        return [(dict(partition), partition_rows) for partition, partition_rows in grouped.items()]
+
+def export_from_env() -> ReviewExport | None:
+    """
+    Export to EXPORT_DIR in parts of EXPORT_PART_ROWS rows compressed with EXPORT_COMPRESSION, or None if EXPORT_DIR is not set.
+    Partial parts are written once EXPORT_MAX_BUFFERED_ROWS rows are buffered or the oldest waited EXPORT_FLUSH_INTERVAL seconds.
+    """
+    if not get_env("EXPORT_DIR"):
+        return None
+    return ReviewExport(ColumnarWriter(get_env("EXPORT_DIR"), get_env_int("EXPORT_PART_ROWS"), get_env("EXPORT_COMPRESSION"),
+        max_buffered_rows=get_env_int("EXPORT_MAX_BUFFERED_ROWS"), flush_interval=get_env_float("EXPORT_FLUSH_INTERVAL")))
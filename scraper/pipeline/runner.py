@@ -0,0 +1,165 @@
+import json
+import time
+from typing import Any, Callable
+
+from analyzer.clustering import IssueClusterer, IssueClusterIndex
+from analyzer.report import Report
+from crawler.amazon import crawl_pages
+from crawler.seen_products import SeenProductStore
+from listener.dead_letter import error_details
+from parsing.amazon import Review
+from parsing.sources import get_reviews
+from pipeline.columnar import ReviewExport, export_from_env
+from pipeline.sink import JsonlSink
+from pipeline.stage import Emit, Stage
+from utils.env import get_env_bool, get_env_float, get_env_int
+
+AnalyzeResult = tuple[list[Report], list[tuple[Review, BaseException]]]
+
+def analyze_each(process_reviews: Callable[[list[Review]], list[Report]], reviews: list[Review]) -> AnalyzeResult:
+    """
+    Analyzes each review on its own like the analyzer listener, so a single bad review only fails itself.
+    """
+    reports: list[Report] = []
+    failures: list[tuple[Review, BaseException]] = []
+    for review in reviews:
+        try:
+            reports.extend(process_reviews([review]))
+        except Exception as e:
+            print(f"Failed to analyze review {review.review_id}: {e!r}")
+            failures.append((review, e))
+    return reports, failures
+
+class Pipeline:
+    """
+    Runs crawl -> parse -> analyze -> sink in one process, connected by bounded in-memory queues instead of RabbitMQ.
+    Every stage runs the same code as its queue based service. Parsed reviews, reports and reviews that failed
+    to analyze are written to the sink, like they would be published to parsed_reviews, reports and the dead-letter queue.
+    With a clusterer, the issues of each product are clustered as they are analyzed: the cluster of each issue is written
+    to issue_assignments, and the clusters of at least cluster_min_size issues to issue_clusters once the pipeline finishes.
+    With an export, reviews and reports are also written as columnar files.
+    """
+
+    def __init__(self, sink: JsonlSink, analyze: Callable[[list[Review]], AnalyzeResult], crawl_jobs: int, crawl_concurrency: int,
+            parse_workers: int, analyze_workers: int, queue_size: int, seen_store: SeenProductStore | None = None,
+            parse: Callable[[dict[str, Any]], list[Review]] = get_reviews, clusterer: IssueClusterer | None = None,
+            cluster_min_size: int = 2, export: ReviewExport | None = None) -> None:
+        self.sink = sink
+        self.export = export
+        self.clusterer = clusterer
+        self.cluster_min_size = cluster_min_size
+        self.crawl_concurrency = crawl_concurrency
+        self.seen_store = seen_store
+        self.__parse_reviews = parse
+        self.__analyze_reviews = analyze
+
+        self.sink_stage = Stage("sink", self.__write, 1, queue_size)
+        self.analyze_stage = Stage("analyze", self.__analyze, analyze_workers, queue_size, self.sink_stage)
+        self.parse_stage = Stage("parse", self.__parse, parse_workers, queue_size, self.analyze_stage)
+        self.crawl_stage = Stage("crawl", self.__crawl, crawl_jobs, queue_size, self.parse_stage)
+        self.stages = [self.crawl_stage, self.parse_stage, self.analyze_stage, self.sink_stage]
+
+    def start(self) -> "Pipeline":
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def crawl(self, url: str, review_info: dict[str, Any]) -> None:
+        """
+        Crawls the search results at url, every product found is parsed and analyzed. Blocks while the crawl queue is full.
+        """
+        self.crawl_stage.put((url, review_info))
+
+    def add_product(self, product: dict[str, Any]) -> None:
+        """
+        Parses and analyzes a single product, given like a parse queue message. Blocks while the parse queue is full.
+        """
+        self.parse_stage.put(product)
+
+    def finish(self, progress_interval: float = 30) -> None:
+        """
+        Waits until everything added so far went through all stages, printing progress every progress_interval seconds.
+        No more crawls or products can be added afterwards.
+        """
+        self.crawl_stage.close()
+        start = time.monotonic()
+        for stage in self.stages:
+            while not stage.join(progress_interval):
+                self.print_progress()
+        if self.clusterer:
+            self.sink.write("issue_clusters", self.clusterer.clusters(self.cluster_min_size))
+        self.sink.close()
+        if self.export:
+            self.export.close()
+
+        print(f"Pipeline finished in {time.monotonic() - start:.0f}s")
+        self.print_progress()
+
+    def print_progress(self) -> None:
+        for stage in self.stages:
+            print(f"Pipeline stage {stage}")
+        print(f"Pipeline output: {self.sink.written}")
+
+    def __crawl(self, item: tuple[str, dict[str, Any]], emit: Emit) -> None:
+        url, review_info = item
+        def publish(body: str, on_enqueued: Callable[[], None]) -> None:
+            emit(json.loads(body))
+            on_enqueued()
+
+        crawl_pages(url, review_info, set(), publish, self.crawl_concurrency, seen_store=self.seen_store)
+
+    def __parse(self, product: dict[str, Any], emit: Emit) -> None:
+        start = time.monotonic()
+        reviews = self.__parse_reviews(product)
+        print(f"Finished parsing {product['id']}: {len(reviews)} reviews in {time.monotonic() - start:.1f}s")
+
+        # The sink is only closed after this stage, so it can be written to directly
+        self.sink_stage.put(("reviews", reviews))
+        if self.export:
+            self.export.add_reviews(reviews)
+        if reviews:
+            emit((product["id"], reviews))
+
+    def __analyze(self, item: tuple[str, list[Review]], emit: Emit) -> None:
+        product_id, reviews = item
+        reports, failures = self.__analyze_reviews(reviews)
+        print(f"Finished analyzing {len(reviews)} reviews, {len(failures)} failed")
+
+        emit(("reports", reports))
+        if self.export:
+            self.export.add_reports(reports, reviews)
+        if self.clusterer:
+            emit(("issue_assignments", self.clusterer.add_reports(product_id, reports)))
+        if failures:
+            emit(("failed_reviews", [{"item": review, "error": error_details(error)} for review, error in failures]))
+
+    def __write(self, item: tuple[str, list[Any]], emit: Emit) -> None:
+        kind, records = item
+        self.sink.write(kind, records)
+
+def pipeline_from_env(sink: JsonlSink, seen_store: SeenProductStore | None = None) -> Pipeline:
+    """
+    Pipeline configured like the queue based services: crawls through CRAWLER_MAX_JOBS and CRAWLER_PAGE_CONCURRENCY,
+    QUEUE_PREFETCH_COUNT parse workers, and PIPELINE_ANALYZE_WORKERS analyzer threads.
+    Issues are clustered per product with the word vectors of the analyzer if PIPELINE_CLUSTER_ISSUES is set,
+    and everything is exported to EXPORT_DIR if it is set.
+    Loads the analyzer models, which takes a while.
+    """
+    from analyzer.analyzer import embed_texts, process_reviews, vector_width
+
+    def new_index() -> IssueClusterIndex:
+        return IssueClusterIndex(vector_width(), get_env_float("ANALYZER_CLUSTER_SIMILARITY"),
+            get_env_int("ANALYZER_CLUSTER_HASH_BITS"), get_env_int("ANALYZER_CLUSTER_HASH_TABLES"))
+
+    clusterer = IssueClusterer(embed_texts, new_index) if get_env_bool("PIPELINE_CLUSTER_ISSUES") else None
+
+    return Pipeline(sink, lambda reviews: analyze_each(process_reviews, reviews),
+        crawl_jobs=get_env_int("CRAWLER_MAX_JOBS"),
+        crawl_concurrency=get_env_int("CRAWLER_PAGE_CONCURRENCY"),
+        parse_workers=get_env_int("QUEUE_PREFETCH_COUNT"),
+        analyze_workers=get_env_int("PIPELINE_ANALYZE_WORKERS"),
+        queue_size=get_env_int("PIPELINE_QUEUE_SIZE"),
+        seen_store=seen_store,
+        clusterer=clusterer,
+        cluster_min_size=get_env_int("ANALYZER_CLUSTER_MIN_SIZE"),
+        export=export_from_env())
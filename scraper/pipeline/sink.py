@@ -0,0 +1,32 @@
+import os
+import threading
+from typing import IO, Any
+
+from utils.serialization import encode_json, to_primitive
+
+class JsonlSink:
+    """
+    Appends records as JSON lines to <directory>/<kind>.jsonl, e.g. reviews.jsonl and reports.jsonl.
+    Records are written in the same format as the parsed_reviews and reports queue messages.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.written: dict[str, int] = {}
+        self.__files: dict[str, IO[bytes]] = {}
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, kind: str, records: list[Any]) -> None:
+        lines = b"".join(encode_json(to_primitive(record)) + b"\n" for record in records)
+        with self.__lock:
+            if kind not in self.__files:
+                self.__files[kind] = open(os.path.join(self.directory, f"{kind}.jsonl"), "ab")
+            self.__files[kind].write(lines)
+            self.written[kind] = self.written.get(kind, 0) + len(records)
+
+    def close(self) -> None:
+        with self.__lock:
+            for file in self.__files.values():
+                file.close()
+            self.__files.clear()
@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+Emit = Callable[[Any], None]
+
+class Stage:
+    """
+    Worker threads taking items from a bounded queue. handle(item, emit) passes results on to the downstream stage.
+
+    Putting into a full queue blocks, so a slow stage holds back the stages before it. backpressure_seconds is
+    how long producers waited for room in this stage's queue. Once close() was called and all queued items are
+    handled, the downstream stage is closed as well.
+    """
+
+    __end = object()
+
+    def __init__(self, name: str, handle: Callable[[Any, Emit], None], workers: int, queue_size: int,
+            downstream: "Stage | None" = None) -> None:
+        self.name = name
+        self.workers = max(1, workers)
+        self.downstream = downstream
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.backpressure_seconds = 0.0
+        self.__handle = handle
+        self.__queue: queue.Queue[Any] = queue.Queue(maxsize=queue_size)
+        self.__lock = threading.Lock()
+        self.__running = self.workers
+        self.__threads = [threading.Thread(target=self.__work, name=f"{name}-{i}", daemon=True) for i in range(self.workers)]
+
+    def start(self) -> "Stage":
+        for thread in self.__threads:
+            thread.start()
+        return self
+
+    def put(self, item: Any) -> None:
+        start = time.monotonic()
+        self.__queue.put(item)
+        waited = time.monotonic() - start
+        with self.__lock:
+            self.backpressure_seconds += waited
+
+    def close(self) -> None:
+        """
+        No more items will be put. Workers finish the queued items and then stop.
+        """
+        for _ in range(self.workers):
+            self.__queue.put(self.__end)
+
+    def join(self, timeout: float | None = None) -> bool:
+        """
+        Waits for the workers to stop. Returns False on timeout.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self.__threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self.__threads)
+
+    def depth(self) -> int:
+        return self.__queue.qsize()
+
+    def __str__(self) -> str:
+        return (f"{self.name}: {self.processed} done, {self.failed} failed, {self.depth()} queued, "
+            f"{self.busy_seconds:.0f}s busy, {self.backpressure_seconds:.0f}s backpressure")
+
+    def __emit(self, item: Any) -> None:
+        if self.downstream:
+            self.downstream.put(item)
+
+    def __work(self) -> None:
+        while True:
+            item = self.__queue.get()
+            if item is self.__end:
+                break
+
+            start = time.monotonic()
+            try:
+                self.__handle(item, self.__emit)
+                failed = False
+            except Exception as e:
+                print(f"[{self.name}] Failed to handle item: {e!r}")
+                failed = True
+
+            with self.__lock:
+                self.busy_seconds += time.monotonic() - start
+                self.processed += not failed
+                self.failed += failed
+
+        with self.__lock:
+            self.__running -= 1
+            last = self.__running == 0
+        if last and self.downstream:
+            self.downstream.close()
@@ -1,24 +1,45 @@
 from enum import Enum
-from requester.request_maker import request_page, RequestError, reset_cookies
-from retry import retry
+from requester.request_maker import request_page, RequestError
+from requester.retry_policy import CircuitBreaker, CircuitState, RetryBudget, RetryPolicy, call_with_retry
+from utils.env import get_env_float, get_env_int
+from utils.metrics import registry
 
 class AmazonRegion(str, Enum):
     COM = "com"
     CA = "ca"
 
-@retry(RequestError, tries=10, delay=2)
-def request_reviews(region: AmazonRegion, product_id: str, page: int = 0) -> str:
+retry_policy = RetryPolicy(
+    tries=get_env_int("REQUEST_RETRY_TRIES"),
+    base_delay=get_env_float("REQUEST_RETRY_BASE_DELAY"),
+    max_delay=get_env_float("REQUEST_RETRY_MAX_DELAY")
+)
+circuit_breakers = {region: CircuitBreaker(
+    name=region.value,
+    failure_threshold=get_env_int("REQUEST_BREAKER_FAILURE_THRESHOLD"),
+    reset_timeout=get_env_float("REQUEST_BREAKER_RESET_SECONDS")
+) for region in AmazonRegion}
+circuit_open = registry.gauge_function("scraper_request_circuit_open", "1 while the circuit breaker of a region is not closed", ("region",))
+
+def __track_circuit(region: AmazonRegion, breaker: CircuitBreaker) -> None:
+    circuit_open.track(lambda: float(breaker.state != CircuitState.CLOSED), (region.value,))
+
+for region, breaker in circuit_breakers.items():
+    __track_circuit(region, breaker)
+
+def new_retry_budget() -> RetryBudget:
+    """
+    Retry budget shared by all requests of one job.
+    """
+    return RetryBudget(get_env_int("REQUEST_RETRY_BUDGET"))
+
+def request_reviews(region: AmazonRegion, product_id: str, page: int = 0, budget: RetryBudget | None = None) -> str:
     """
-    Requests the reviews page for a product. 
-    Resets cookies on error.
-    Auto retries on RequestError.
+    Requests the reviews page for a product.
+    Cookies of the failing session are reset by the request maker.
+    Retries on RequestError with exponential backoff, and fails fast while the region's circuit is open.
     """
-    try:
-        return request_page(url_for_reviews(region, product_id, page))
-    except RequestError:
-        reset_cookies()
-        raise
-        
+    return call_with_retry(lambda: request_page(url_for_reviews(region, product_id, page)), retry_policy,
+        retry_on=RequestError, breaker=circuit_breakers[region], budget=budget)
 
 def url_for_reviews(region: AmazonRegion, product_id: str, page: int = 0) -> str:
     """
@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Callable
+
+class TokenBucket:
+    """
+    Token bucket for a single domain.
+    The refill rate adapts to captchas: it is halved every time a captcha is hit
+    and grows back slowly with every successful request (AIMD).
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float, max_rate: float,
+            clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = burst
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__last_refill = clock()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until a token is available and takes it.
+        Returns the time spent waiting in seconds.
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                self.__refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait_time = (1 - self.tokens) / self.rate
+
+            self.__sleep(wait_time)
+            waited += wait_time
+
+    def record_success(self) -> None:
+        """
+        Additive increase: speed up a little after every request that went through.
+        """
+        with self.__lock:
+            self.rate = min(self.max_rate, self.rate + self.min_rate)
+
+    def record_captcha(self) -> None:
+        """
+        Multiplicative decrease: halve the rate and drop any saved up burst.
+        """
+        with self.__lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def __refill(self) -> None:
+        now = self.__clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.__last_refill) * self.rate)
+        self.__last_refill = now
+
+class DomainRateLimiter:
+    """
+    Keeps one adaptive token bucket per domain, created on first use.
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float, max_rate: float,
+            clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.__bucket_factory = lambda: TokenBucket(rate, burst, min_rate, max_rate, clock, sleep)
+        self.__buckets: dict[str, TokenBucket] = {}
+        self.__lock = threading.Lock()
+
+    def bucket(self, domain: str) -> TokenBucket:
+        with self.__lock:
+            if domain not in self.__buckets:
+                self.__buckets[domain] = self.__bucket_factory()
+            return self.__buckets[domain]
+
+    def acquire(self, domain: str) -> float:
+        return self.bucket(domain).acquire()
+
+    def record_success(self, domain: str) -> None:
+        self.bucket(domain).record_success()
+
+    def record_captcha(self, domain: str) -> None:
+        self.bucket(domain).record_captcha()
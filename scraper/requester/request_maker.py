@@ -1,42 +1,105 @@
+import time
+from urllib.parse import urlparse
 from curl_cffi import requests
-from retry import retry
 
-from utils.env import get_env
+from requester.rate_limit import DomainRateLimiter
+from requester.session_pool import PooledSession, SessionPool
+from utils.env import get_env, get_env_float, get_env_int, get_env_list
+from utils.metrics import registry
 
 cookie_file = "cookies.txt"
 
 class RequestError(Exception):
     pass
 
-session = requests.Session()
+class CaptchaError(RequestError):
+    pass
+
+session_pool = SessionPool(
+    size=get_env_int("REQUEST_SESSION_POOL_SIZE"),
+    session_factory=requests.Session,
+    proxies=get_env_list("PROXY_URL"),
+    impersonations=get_env_list("REQUEST_IMPERSONATE"),
+    cooldown=get_env_float("REQUEST_SESSION_COOLDOWN_SECONDS")
+)
+rate_limiter = DomainRateLimiter(
+    rate=get_env_float("REQUEST_RATE_PER_SECOND"),
+    burst=get_env_float("REQUEST_BURST"),
+    min_rate=get_env_float("REQUEST_MIN_RATE_PER_SECOND"),
+    max_rate=get_env_float("REQUEST_MAX_RATE_PER_SECOND")
+)
 cookie = get_env("AMAZON_COOKIE")
 
-@retry(RequestError, tries=2, delay=2)
+request_seconds = registry.histogram("scraper_request_seconds", "Page request latency, by domain and outcome (ok, error or captcha)",
+    ("domain", "outcome"))
+sessions_available = registry.gauge_function("scraper_request_sessions_available", "Pooled sessions that are idle and not cooling down")
+sessions_available.track(lambda: session_pool.available_count())
+
 def request_page(url: str) -> str:
     """
     Requests a page from the given URL and returns the response body using pycurl
-    and preset headers.
+    and preset headers. Makes a single attempt, retrying is left to the caller.
+    Each request uses a session from the pool and is paced by the rate limiter of its domain.
+    The session is only checked out once the rate limiter let the request through, so waiting callers do not hold sessions.
+    A session that hits a captcha is retired for a while, other failures only clear its cookies.
     """
+    rate_limiter.acquire(urlparse(url).netloc)
+    with session_pool.session() as pooled:
+        return __request_with(pooled, url)
 
-    proxy_url = get_env("PROXY_URL")
+def warm_up_sessions(url: str) -> int:
+    """
+    Requests url once with every session of the pool, so their connections, TLS sessions and cookies are set up
+    before the first product is requested. Returns the number of sessions that succeeded.
+    """
+    sessions = [session_pool.acquire() for _ in session_pool.sessions]
+    succeeded = 0
+    try:
+        for pooled in sessions:
+            try:
+                rate_limiter.acquire(urlparse(url).netloc)
+                __request_with(pooled, url)
+                succeeded += 1
+            except Exception as e:
+                print(f"Warm-up request to {url} failed: {e!r}")
+    finally:
+        for pooled in sessions:
+            session_pool.release(pooled)
+    return succeeded
 
-    r = session.get(url, impersonate="chrome107", headers={
+def __request_with(pooled: PooledSession, url: str) -> str:
+    """
+    Requests url with the given session. The caller acquires the rate limiter first.
+    """
+    domain = urlparse(url).netloc
+
+    start = time.perf_counter()
+    r = pooled.session.get(url, impersonate=pooled.impersonate, headers={
         'cookie': cookie
     } if cookie else None, proxies={
-        "https": proxy_url,
-        "http": proxy_url
-    })
+        "https": pooled.proxy,
+        "http": pooled.proxy
+    } if pooled.proxy else None)
+
+    elapsed = time.perf_counter() - start
 
     if r.status_code != 200 or not isinstance(r.text, str):
+        request_seconds.observe(elapsed, (domain, "error"))
+        pooled.reset()
         raise RequestError(f"Failed to fetch {url} with status code: {r.status_code}")
 
     if "Type the characters you see in this image" in r.text:
-        raise RequestError(f"Failed to fetch {url} due to captcha")
+        request_seconds.observe(elapsed, (domain, "captcha"))
+        rate_limiter.record_captcha(domain)
+        session_pool.retire(pooled)
+        raise CaptchaError(f"Failed to fetch {url} due to captcha")
 
+    request_seconds.observe(elapsed, (domain, "ok"))
+    rate_limiter.record_success(domain)
     return r.text
 
 def reset_cookies() -> None:
     """
-    Resets the cookies in the current session.
+    Resets the cookies in every session of the pool.
     """
-    session.cookies.clear()
\ No newline at end of file
+    session_pool.reset_all()
@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from enum import Enum
+import functools
+import random
+import threading
+import time
+from typing import Callable, TypeVar
+
+from utils.metrics import registry
+
+T = TypeVar("T")
+_rng = random.Random()
+
+class CircuitOpenError(Exception):
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        # Seconds until the circuit lets a trial call through
+        self.retry_after = retry_after
+
+class RetryBudgetExhaustedError(Exception):
+    pass
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the n-th retry sleeps a random time
+    between 0 and min(max_delay, base_delay * multiplier ** n).
+    """
+    tries: int
+    base_delay: float
+    max_delay: float
+    multiplier: float = 2
+
+    def backoff(self, retry_num: int, rng: random.Random | None = None) -> float:
+        return (rng or _rng).uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** retry_num))
+
+class RetryBudget:
+    """
+    Caps the number of retries a single job (e.g. parsing one product) may spend across all its requests.
+    """
+
+    def __init__(self, max_retries: int) -> None:
+        self.max_retries = max_retries
+        self.retries_used = 0
+        self.__lock = threading.Lock()
+
+    def consume(self) -> bool:
+        with self.__lock:
+            if self.retries_used >= self.max_retries:
+                return False
+            self.retries_used += 1
+            return True
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and then fails fast until reset_timeout has passed.
+    After that a single trial call is let through, which either closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float,
+            clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.__opened_at = 0.0
+        self.__trial_running = False
+        self.__clock = clock
+        self.__lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """
+        Raises CircuitOpenError if calls should not be made right now.
+        """
+        with self.__lock:
+            if self.state == CircuitState.OPEN:
+                open_for = self.__clock() - self.__opened_at
+                if open_for < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit for {self.name} is open", self.reset_timeout - open_for)
+                self.state = CircuitState.HALF_OPEN
+                self.__trial_running = False
+
+            if self.state == CircuitState.HALF_OPEN:
+                if self.__trial_running:
+                    raise CircuitOpenError(f"Circuit for {self.name} is half open, trial call in progress", self.reset_timeout)
+                self.__trial_running = True
+
+    def record_success(self) -> None:
+        with self.__lock:
+            self.failures = 0
+            self.state = CircuitState.CLOSED
+            self.__trial_running = False
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.failures += 1
+            if self.state == CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CircuitState.OPEN:
+                    print(f"Opening circuit for {self.name} after {self.failures} failures")
+                self.state = CircuitState.OPEN
+                self.__opened_at = self.__clock()
+                self.__trial_running = False
+
+class RetryStats:
+    """
+    Process wide counters of attempts, retries and fail-fast rejections.
+    """
+
+    def __init__(self) -> None:
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.budget_exhausted = 0
+        self.__lock = threading.Lock()
+
+    def increment(self, name: str) -> None:
+        with self.__lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+retry_stats = RetryStats()
+retry_events = registry.counter_function("scraper_request_retry_events_total",
+    "Request attempts, retries, failures, fail-fast rejections of open circuits and exhausted retry budgets", ("event",))
+for event in ["attempts", "retries", "failures", "short_circuited", "budget_exhausted"]:
+    retry_events.track(functools.partial(getattr, retry_stats, event), (event,))
+
+def call_with_retry(fn: Callable[[], T], policy: RetryPolicy, retry_on: type[Exception],
+        breaker: CircuitBreaker | None = None, budget: RetryBudget | None = None,
+        sleep: Callable[[float], None] = time.sleep) -> T:
+    """
+    Calls fn, retrying on retry_on exceptions according to the policy. Other exceptions are raised right away,
+    and count as failures of the breaker like retry_on exceptions.
+    Fails fast with CircuitOpenError while the breaker is open, and stops retrying
+    with RetryBudgetExhaustedError once the job's budget is spent.
+    """
+    for attempt in range(policy.tries):
+        if breaker:
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                retry_stats.increment("short_circuited")
+                raise
+
+        retry_stats.increment("attempts")
+        try:
+            result = fn()
+        except retry_on as e:
+            retry_stats.increment("failures")
+            if breaker:
+                breaker.record_failure()
+
+            if attempt + 1 >= policy.tries:
+                raise
+
+            if budget and not budget.consume():
+                retry_stats.increment("budget_exhausted")
+                raise RetryBudgetExhaustedError(f"Retry budget of {budget.max_retries} exhausted: {e}") from e
+
+            retry_stats.increment("retries")
+            sleep(policy.backoff(attempt))
+        except BaseException:
+            # Not retried, but still a failed call. Otherwise a half open circuit would wait for its trial forever
+            retry_stats.increment("failures")
+            if breaker:
+                breaker.record_failure()
+            raise
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+    raise ValueError("RetryPolicy.tries must be at least 1")
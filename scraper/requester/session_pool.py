@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Any, Callable, Iterator, Sequence
+
+@dataclass
+class PooledSession:
+    session: Any
+    proxy: str | None
+    impersonate: str
+    retired_until: float = 0
+    in_use: bool = False
+    captcha_count: int = field(default=0)
+
+    def reset(self) -> None:
+        """
+        Clears the cookies of this session only.
+        """
+        self.session.cookies.clear()
+
+class SessionPool:
+    """
+    Pool of independent HTTP sessions, each with its own cookie jar, proxy and impersonation profile.
+    A session that hits a captcha is taken out of rotation for a cooldown period without affecting the others.
+    """
+
+    def __init__(self, size: int, session_factory: Callable[[], Any], proxies: Sequence[str] = (),
+            impersonations: Sequence[str] = ("chrome107",), cooldown: float = 300,
+            clock: Callable[[], float] = time.monotonic) -> None:
+        self.sessions = [PooledSession(
+            session=session_factory(),
+            proxy=proxies[i % len(proxies)] if proxies else None,
+            impersonate=impersonations[i % len(impersonations)]
+        ) for i in range(max(1, size))]
+        self.cooldown = cooldown
+        self.__clock = clock
+        self.__next = 0
+        self.__condition = threading.Condition()
+
+    def acquire(self) -> PooledSession:
+        """
+        Checks out the next available session in round-robin order.
+        Blocks while all sessions are busy or cooling down.
+        """
+        with self.__condition:
+            while True:
+                now = self.__clock()
+                for offset in range(len(self.sessions)):
+                    index = (self.__next + offset) % len(self.sessions)
+                    pooled = self.sessions[index]
+                    if not pooled.in_use and pooled.retired_until <= now:
+                        pooled.in_use = True
+                        self.__next = index + 1
+                        return pooled
+
+                retired = [s.retired_until - now for s in self.sessions if not s.in_use and s.retired_until > now]
+                self.__condition.wait(timeout=min(retired) if retired else None)
+
+    def release(self, pooled: PooledSession) -> None:
+        with self.__condition:
+            pooled.in_use = False
+            self.__condition.notify()
+
+    def retire(self, pooled: PooledSession) -> None:
+        """
+        Takes a session out of rotation for the cooldown period and clears its cookies,
+        so it comes back with a fresh identity.
+        """
+        with self.__condition:
+            pooled.captcha_count += 1
+            pooled.retired_until = self.__clock() + self.cooldown
+            pooled.reset()
+
+    def reset_all(self) -> None:
+        with self.__condition:
+            for pooled in self.sessions:
+                pooled.reset()
+
+    def available_count(self) -> int:
+        now = self.__clock()
+        return sum(1 for s in self.sessions if s.retired_until <= now)
+
+    @contextmanager
+    def session(self) -> Iterator[PooledSession]:
+        pooled = self.acquire()
+        try:
+            yield pooled
+        finally:
+            self.release(pooled)
@@ -0,0 +1,35 @@
+import argparse
+import json
+from crawler.seen_products import SeenProductStore
+from pipeline.runner import pipeline_from_env
+from pipeline.sink import JsonlSink
+from utils.env import get_env, get_env_float
+
+# Runs crawl -> parse -> analyze in this process without RabbitMQ, for backfills and local runs.
+# Reviews and reports are written as JSON lines to PIPELINE_OUTPUT_DIR.
+#   python run_pipeline.py --crawl "https://www.amazon.ca/s?k=gaming+mouse" --region ca
+#   python run_pipeline.py --products products.jsonl (one {"type": "amazon", "region": "ca", "id": "B08B3K9K6P"} per line)
+
+arguments = argparse.ArgumentParser(description="Crawl, parse and analyze without RabbitMQ")
+arguments.add_argument("--crawl", action="append", default=[], help="search result url to crawl for products")
+arguments.add_argument("--region", default="com", help="region of the crawled urls")
+arguments.add_argument("--type", default="amazon", help="review source of the crawled urls")
+arguments.add_argument("--products", help="JSON lines file of products to parse, in the parse queue message format")
+arguments.add_argument("--output", default=get_env("PIPELINE_OUTPUT_DIR"))
+args = arguments.parse_args()
+
+seen_store = SeenProductStore(get_env("CRAWLER_SEEN_PRODUCTS_DIR"), get_env_float("CRAWLER_DEDUPE_TTL_HOURS") * 3600) \
+    if get_env_float("CRAWLER_DEDUPE_TTL_HOURS") > 0 else None
+pipeline = pipeline_from_env(JsonlSink(args.output), seen_store).start()
+
+for url in args.crawl:
+    pipeline.crawl(url, {"type": args.type, "region": args.region})
+if args.products:
+    with open(args.products) as products:
+        for line in products:
+            if line.strip():
+                pipeline.add_product(json.loads(line))
+
+pipeline.finish()
+if seen_store:
+    seen_store.close()
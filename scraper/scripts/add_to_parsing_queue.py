@@ -1,6 +1,11 @@
 import json
+import sys
 import pika
 
+sys.path.append(".")
+
+from listener.scheduling import declare_queue # noqa: E402
+
 # This is a testing script for testing out the parsing queue
 
 host = "localhost"
@@ -20,7 +25,7 @@ def add_amazon_item() -> None:
 
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
     channel = connection.channel()
-    channel.queue_declare(queue='parse', durable=True)
+    declare_queue(channel, 'parse')
 
     channel.basic_publish(
         exchange='',
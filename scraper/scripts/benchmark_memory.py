@@ -0,0 +1,85 @@
+import dataclasses
+import sys
+import tracemalloc
+from typing import Any, Callable
+
+import attr
+
+sys.path.append(".")
+
+from analyzer.report import Issue, Keyframe, Report # noqa: E402
+from parsing.amazon import Review # noqa: E402
+from requester.amazon import AmazonRegion # noqa: E402
+
+# Measures the memory held per review and per report, with the slotted, interned records
+# and with plain per-instance-dict versions of the same classes as they were before.
+# Run from the scraper directory: python scripts/benchmark_memory.py [reviews]
+
+LegacyReview: Any = attr.dataclass(type("LegacyReview", (), {"__annotations__": dict(Review.__annotations__)}))
+LegacyKeyframe: Any = dataclasses.dataclass(type("LegacyKeyframe", (), {"__annotations__": dict(Keyframe.__annotations__), "interp": None}))
+LegacyIssue: Any = dataclasses.dataclass(type("LegacyIssue", (), {"__annotations__": dict(Issue.__annotations__)}))
+LegacyReport: Any = dataclasses.dataclass(type("LegacyReport", (), {"__annotations__": dict(Report.__annotations__)}))
+
+def fresh(text: str) -> str:
+    """
+    A new copy of text, like every string parsed out of a page is.
+    """
+    return "".join(list(text))
+
+def make_review(cls: Any, i: int) -> Any:
+    return cls(
+        author_id=f"AE{i}",
+        author_name=fresh("Jane"),
+        author_image_url=fresh("https://images-na.ssl-images-amazon.com/images/S/amazon-avatars-global/default.png"),
+        title=fresh("Broke after a month"),
+        text=fresh("The left click stopped working after a month, support replaced it. " * 5),
+        date=1672531200 + i,
+        date_text=fresh("Reviewed in Canada on January 1, 2023"),
+        review_id=f"R{i}",
+        attributes={fresh("Colour"): fresh("Black"), fresh("Style"): fresh("Wired")},
+        verified_purchase=True,
+        found_helpful_count=i % 20,
+        is_top_positive_review=False,
+        is_top_critical_review=i == 0,
+        images=[f"https://images.example/{i}.png"],
+        country_reviewed_in=fresh("Canada"),
+        region=AmazonRegion.CA,
+        product_name=fresh("Razer Viper Mini Ultralight Gaming Mouse: Fastest Mouse Switches in Gaming"),
+        product_image_url=fresh("https://m.media-amazon.com/images/I/61Lg3Fw3pXL._AC_SL1500_.jpg"),
+        manufacturer_name=fresh("Razer"),
+        manufacturer_id=fresh("razer")
+    )
+
+def make_report(report_cls: Any, keyframe_cls: Any, issue_cls: Any, i: int) -> Any:
+    return report_cls(
+        review_id=f"R{i}",
+        report_weight=0.5,
+        reliability_keyframes=[keyframe_cls(rel_timestamp=1675209600, text=fresh("after a month"), time_start=4, time_end=17, sentiment=-0.4)
+            for _ in range(3)],
+        issues=[issue_cls(text=fresh("The left click stopped working"), classification="Hardware", criticality=0.8,
+            rel_timestamp=1675209600, frequency=None, image=None, resolution=None) for _ in range(2)]
+    )
+
+def bytes_per_item(count: int, make: Callable[[int], Any]) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return (after - before) / count
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"Bytes per record, {count} records")
+
+    before = bytes_per_item(count, lambda i: make_review(LegacyReview, i))
+    after = bytes_per_item(count, lambda i: make_review(Review, i))
+    print(f"{'review':<10} before {before:8.0f}  after {after:8.0f}  ({1 - after / before:.0%} smaller)")
+
+    before = bytes_per_item(count, lambda i: make_report(LegacyReport, LegacyKeyframe, LegacyIssue, i))
+    after = bytes_per_item(count, lambda i: make_report(Report, Keyframe, Issue, i))
+    print(f"{'report':<10} before {before:8.0f}  after {after:8.0f}  ({1 - after / before:.0%} smaller)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import json
+import sys
+import time
+from enum import Enum
+from typing import Any, Callable
+
+sys.path.append(".")
+
+from analyzer.report import Issue, Keyframe, Report # noqa: E402
+from parsing.amazon import Review, review_schema # noqa: E402
+from requester.amazon import AmazonRegion # noqa: E402
+from utils import serialization # noqa: E402
+
+# Compares the schema based serializer with the reflection based class_to_json it replaced.
+# Run from the scraper directory: python scripts/benchmark_serialization.py [reviews]
+
+def legacy_class_to_json(obj: Any) -> str:
+    def process_obj(obj: Any) -> Any:
+        if isinstance(obj, Enum):
+            return obj.value
+        # The records are slotted since class_to_json was replaced, read their slots instead of __dict__
+        return {name: getattr(obj, name) for name in obj.__slots__ if name != "__weakref__"}
+    return json.dumps(obj, default=process_obj)
+
+def legacy_review_from_dict(review: dict[str, Any]) -> Review:
+    return Review(**{**review, "region": AmazonRegion(review["region"])})
+
+def make_reviews(count: int) -> list[Review]:
+    return [Review(
+        author_id=f"AE{i}",
+        author_name="Jane",
+        author_image_url="https://images.example/jane.png",
+        title="Broke after a month",
+        text="The left click stopped working after a month, support replaced it. " * 5,
+        date=1672531200 + i,
+        date_text="Reviewed in Canada on January 1, 2023",
+        review_id=f"R{i}",
+        attributes={"Colour": "Black", "Style": "Wired"},
+        verified_purchase=True,
+        found_helpful_count=i % 20,
+        is_top_positive_review=False,
+        is_top_critical_review=i == 0,
+        images=[f"https://images.example/{i}.png"],
+        country_reviewed_in="Canada",
+        region=AmazonRegion.CA,
+        product_name="Razer Viper Mini",
+        product_image_url=None,
+        manufacturer_name="Razer",
+        manufacturer_id="razer"
+    ) for i in range(count)]
+
+def make_reports(count: int) -> list[Report]:
+    return [Report(
+        review_id=f"R{i}",
+        report_weight=0.5,
+        reliability_keyframes=[Keyframe(rel_timestamp=1675209600, text="after a month", time_start=4, time_end=17, sentiment=-0.4)] * 3,
+        issues=[Issue(text="The left click stopped working", classification="Hardware", criticality=0.8,
+            rel_timestamp=1675209600, frequency=None, image=None, resolution=None)] * 2
+    ) for i in range(count)]
+
+def measure(name: str, fn: Callable[[], Any], repeat: int = 5) -> float:
+    best = min(__timed(fn) for _ in range(repeat))
+    print(f"{name:<40} {best * 1000:8.1f} ms")
+    return best
+
+def __timed(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    reviews = make_reviews(count)
+    reports = make_reports(count)
+    print(f"{count} reviews and reports, JSON backend: {'orjson' if serialization.orjson else 'json'}")
+
+    review_json = legacy_class_to_json(reviews)
+    old = measure("encode reviews, class_to_json", lambda: legacy_class_to_json(reviews))
+    new = measure("encode reviews, schema", lambda: serialization.dumps(reviews))
+    print(f"{'':<40} {old / new:8.1f}x")
+
+    old = measure("encode reports, class_to_json", lambda: legacy_class_to_json(reports))
+    new = measure("encode reports, schema", lambda: serialization.dumps(reports))
+    print(f"{'':<40} {old / new:8.1f}x")
+
+    old = measure("decode reviews, json + Review(**fields)", lambda: [legacy_review_from_dict(review) for review in json.loads(review_json)])
+    new = measure("decode reviews, validating schema", lambda: [review_schema.from_primitive(review)
+        for review in serialization.decode_json(review_json)])
+    print(f"{'':<40} {old / new:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import argparse
+import json
+import pika
+from pika.exchange_type import ExchangeType
+
+# Asks running listeners to profile themselves, the results are written to PROFILE_DIR on their machines
+
+host = "localhost"
+port = 5673
+
+def request_profile(seconds: float, service: str | None) -> None:
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port))
+    channel = connection.channel()
+    # The pinned types-pika stubs annotate the ExchangeType members as str, while exchange_declare expects the enum
+    channel.exchange_declare(exchange='control', exchange_type=ExchangeType.fanout) # type: ignore[arg-type]
+    channel.basic_publish(exchange='control', routing_key='', body=json.dumps({
+        "command": "profile",
+        "seconds": seconds,
+        "service": service
+    }))
+    connection.close()
+
+parser = argparse.ArgumentParser(description="Profile running listeners")
+parser.add_argument("--seconds", type=float, default=30)
+parser.add_argument("--service", choices=["crawler", "parser", "analyzer"], help="Only profile listeners of this service")
+args = parser.parse_args()
+request_profile(args.seconds, args.service)
@@ -0,0 +1,37 @@
+import argparse
+import sys
+
+sys.path.append(".")
+
+from loadtest.corpus import LogNormal, synthetic_corpus # noqa: E402
+from loadtest.driver import format_result, run_load_test # noqa: E402
+
+# Drives the parse listener, and optionally the analyzer listener, with a synthetic corpus through an in-memory broker.
+# Review pages are served from rendered recordings, so no requests leave the machine.
+# Run from the scraper directory, e.g.: python scripts/run_load_test.py --products 200 --rate 5 --latency 0.2
+
+def main() -> None:
+    arguments = argparse.ArgumentParser(description="Load test the parse and analyze listeners")
+    arguments.add_argument("--products", type=int, default=50)
+    arguments.add_argument("--rate", type=float, default=5, help="products sent per second, 0 sends all at once")
+    arguments.add_argument("--reviews-median", type=float, default=40, help="median reviews per product")
+    arguments.add_argument("--reviews-sigma", type=float, default=1, help="log-normal sigma of reviews per product")
+    arguments.add_argument("--reviews-max", type=int, default=5000)
+    arguments.add_argument("--words-median", type=float, default=60, help="median words per review")
+    arguments.add_argument("--words-sigma", type=float, default=0.8, help="log-normal sigma of words per review")
+    arguments.add_argument("--latency", type=float, default=0.05, help="seconds per page request")
+    arguments.add_argument("--sessions", type=int, default=4, help="request session pool size")
+    arguments.add_argument("--request-rate", type=float, default=0, help="page requests per second, 0 does not limit")
+    arguments.add_argument("--prefetch", type=int, default=10, help="parse listener prefetch and worker count")
+    arguments.add_argument("--analyze", action="store_true", help="also run the analyzer listener, which loads the analyzer models")
+    arguments.add_argument("--seed", type=int, default=0)
+    args = arguments.parse_args()
+
+    corpus = synthetic_corpus(args.products, LogNormal(args.reviews_median, args.reviews_sigma, maximum=args.reviews_max),
+        LogNormal(args.words_median, args.words_sigma), seed=args.seed)
+    result = run_load_test(corpus, args.rate, analyze=args.analyze, prefetch=args.prefetch, latency=args.latency,
+        sessions=args.sessions, request_rate=args.request_rate)
+    print(format_result(result))
+
+if __name__ == "__main__":
+    main()
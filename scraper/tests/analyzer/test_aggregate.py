@@ -0,0 +1,83 @@
+import pytest
+
+from analyzer.aggregate import IssueBin, ReliabilityAggregator, SentimentBin, aggregate_reports, merge_aggregates, sentiment_curve
+from analyzer.report import Issue, Keyframe, Report
+
+def keyframe(day: int, sentiment: float, interp: str | None = "linear") -> Keyframe:
+    return Keyframe(rel_timestamp=day, text="", time_start=0, time_end=0, sentiment=sentiment, interp=interp)
+
+def issue(classification: str | None, day: int | None, criticality: float | None = None) -> Issue:
+    return Issue(text="", classification=classification, criticality=criticality, rel_timestamp=day, frequency=None, image=None, resolution=None)
+
+def test_sentiment_is_interpolated_between_keyframes() -> None:
+    report = Report("R1", 1, [keyframe(100, 0.2, None), keyframe(5, 1.0)], [])
+    aggregate = aggregate_reports("B01", [report], bin_days=30)
+
+    assert [sentiment.start_day for sentiment in aggregate.sentiment] == [0, 30, 60, 90]
+    curve = dict(sentiment_curve(aggregate))
+    assert curve[0] == 1.0 and curve[90] == 0.2
+    # Middle of the bin starting at day 30 is day 45, 40 of the 95 days from the first keyframe to the second
+    assert curve[30] == pytest.approx(1.0 - 0.8 * 40 / 95)
+    assert curve[60] < curve[30]
+
+def test_keyframes_without_interpolation_only_fill_their_bin() -> None:
+    report = Report("R1", 1, [keyframe(0, 1.0, None), keyframe(100, 0.0, None)], [])
+    assert [sentiment.start_day for sentiment in aggregate_reports("B01", [report], bin_days=30).sentiment] == [0, 90]
+
+def test_issues_are_counted_by_class_and_weighted_by_criticality() -> None:
+    reports = [
+        Report("R1", 1, [], [issue("Overheating", 40), issue(None, None)]),
+        Report("R2", 2, [], [issue("Overheating", 50, criticality=0.5)]),
+    ]
+    aggregate = aggregate_reports("B01", reports, bin_days=30)
+
+    assert aggregate.reports == 2
+    assert aggregate.issues == [
+        IssueBin("Overheating", 30, 3, 0.7 + 2 * 0.5),
+        IssueBin("UNKNOWN_ISSUE", None, 1, 0.5),
+    ]
+
+def test_merged_deltas_equal_aggregating_everything() -> None:
+    reports = [Report(f"R{i}", 1 + i % 2, [keyframe(0, 0.9), keyframe(30 * i, 0.1 * i)], [issue("Faulty Charging", 10 * i)]) for i in range(6)]
+
+    merged = merge_aggregates([aggregate_reports("B01", reports[:2], 30), aggregate_reports("B01", reports[2:], 30)])
+    everything = aggregate_reports("B01", reports, 30)
+
+    assert merged.reports == everything.reports
+    assert merged.issues == everything.issues
+    assert [(sentiment.start_day, sentiment.weight) for sentiment in merged.sentiment] == \
+        [(sentiment.start_day, sentiment.weight) for sentiment in everything.sentiment]
+    assert [sentiment.sentiment_sum for sentiment in merged.sentiment] == pytest.approx([sentiment.sentiment_sum for sentiment in everything.sentiment])
+
+def test_only_matching_aggregates_merge() -> None:
+    aggregator = ReliabilityAggregator("B01", 30)
+    with pytest.raises(ValueError):
+        aggregator.merge(aggregate_reports("B02", [], 30))
+    with pytest.raises(ValueError):
+        aggregator.merge(aggregate_reports("B01", [], 7))
+
+    aggregator.merge(aggregate_reports("B01", [Report("R1", 1, [keyframe(3, 0.5)], [])], 30))
+    assert aggregator.aggregate().sentiment == [SentimentBin(0, 1, 0.5)]
+
+def test_deltas_are_merged_once() -> None:
+    delta = aggregate_reports("B01", [Report("R1", 1, [keyframe(3, 0.5)], [issue("Overheating", 3)]), Report("R2", 1, [], [])], 30, "message-1")
+    assert delta.delta_ids == ["message-1"]
+
+    other = aggregate_reports("B01", [Report("R3", 1, [], [])], 30)
+    merged = merge_aggregates([delta, delta, other])
+    assert merged.reports == 3
+    assert merged.issues == [IssueBin("Overheating", 0, 1, 0.7)]
+    assert merged.delta_ids == ["message-1", other.delta_ids[0]]
+    assert merge_aggregates([merged, other]).reports == 3
+
+    with pytest.raises(ValueError):
+        merge_aggregates([other, merged])
+
+def test_aggregates_remember_a_bounded_number_of_deltas() -> None:
+    aggregator = ReliabilityAggregator("B01", 30, history=3)
+    for i in range(5):
+        aggregator.merge(aggregate_reports("B01", [Report(f"R{i}", 1, [], [])], 30, f"message-{i}"))
+
+    aggregate = aggregator.aggregate()
+    assert aggregate.reports == 5
+    assert aggregate.delta_ids == ["message-2", "message-3", "message-4"]
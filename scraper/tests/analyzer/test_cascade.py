@@ -0,0 +1,41 @@
+import random
+
+from analyzer.cascade import CLAUSE_MISSING, CLAUSE_OVERLAP, CascadeRouter, Route, clause_ambiguities, near_threshold, reports_agree
+from analyzer.report import Issue, Keyframe, Report
+
+def make_report(keyframe_days: list[int], issues: list[tuple[str, int | None]]) -> Report:
+    return Report("R1", 1, [Keyframe(rel_timestamp=days, text="", time_start=0, time_end=0, sentiment=0.5, interp=None)
+        for days in keyframe_days],
+        [Issue(text=f"Clause {i}", classification=classification, criticality=0.5, rel_timestamp=days, frequency=None, image=None,
+            resolution=None) for i, (classification, days) in enumerate(issues)])
+
+def test_clauses_are_checked_against_their_sentences() -> None:
+    sentences = [[0, 1, 2], [4, 5]]
+    assert clause_ambiguities(sentences, [(0, 3), (4, 6)]) == []
+    assert clause_ambiguities(sentences, [(0, 3), (2, 6)]) == [CLAUSE_OVERLAP]
+    assert clause_ambiguities(sentences, [(0, 3)]) == [CLAUSE_MISSING]
+    assert clause_ambiguities([[0, 1], []], [(0, 2)]) == []
+
+def test_near_threshold() -> None:
+    assert near_threshold(0.87, 0.9, 0.05) and near_threshold(0.93, 0.9, 0.05)
+    assert not near_threshold(0.5, 0.9, 0.05)
+
+def test_reports_agree_on_findings_not_texts() -> None:
+    report = make_report([0, 30], [("BROKEN", 30), ("NOISE", None)])
+    assert reports_agree(report, make_report([30, 0], [("NOISE", None), ("BROKEN", 30)]))
+    assert not reports_agree(report, make_report([0, 30], [("BROKEN", 30)]))
+    assert not reports_agree(report, make_report([0], [("BROKEN", 30), ("NOISE", None)]))
+
+def test_ambiguous_reviews_are_escalated_and_others_audited() -> None:
+    router = CascadeRouter(margin=0.05, audit_rate=0.1, rng=random.Random(0))
+    assert router.route([CLAUSE_MISSING]) == Route.ESCALATED
+    routes = [router.route([]) for _ in range(1000)]
+    assert 50 < routes.count(Route.AUDITED) < 150 and Route.ESCALATED not in routes
+
+    router.record(Route.ESCALATED, [CLAUSE_MISSING, CLAUSE_MISSING], agreed=False)
+    router.record(Route.AUDITED, [], agreed=True)
+    router.record(Route.AUDITED, [], agreed=False)
+    router.record(Route.SMALL, [])
+    assert router.reasons == {CLAUSE_MISSING: 1}
+    assert router.agreement_rate(Route.AUDITED) == 0.5 and router.agreement_rate(Route.SMALL) is None
+    assert router.describe() == "routes: escalated 25%, audited 50%, small 25%; agreement: escalated 0%, audited 50%"
@@ -0,0 +1,78 @@
+import numpy as np
+
+from analyzer.clustering import IssueClusterer, IssueClusterIndex
+from analyzer.report import Issue, Report
+
+def issue(text: str, classification: str | None = None) -> Issue:
+    return Issue(text=text, classification=classification, criticality=None, rel_timestamp=None, frequency=None, image=None, resolution=None)
+
+def noisy(centers: np.ndarray, labels: np.ndarray, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return centers[labels] + rng.standard_normal((len(labels), centers.shape[1])) * noise
+
+def test_similar_vectors_share_a_cluster() -> None:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((50, 64))
+    labels = rng.integers(0, 50, 2000)
+    index = IssueClusterIndex(64, threshold=0.8, bits=8, tables=10)
+
+    cluster_ids = index.add(noisy(centers, labels, noise=0.1))
+
+    assert len(index) == 50
+    for label in range(50):
+        assert len({cluster_id for cluster_id, other in zip(cluster_ids, labels) if other == label}) == 1
+    assert sum(index.sizes) == 2000
+
+def test_vectors_are_added_incrementally() -> None:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((3, 32))
+    index = IssueClusterIndex(32, threshold=0.8, bits=6, tables=8)
+
+    first = index.add(noisy(centers, np.array([0, 1]), noise=0.05))
+    second = index.add(noisy(centers, np.array([1, 2, 0]), noise=0.05, seed=2))
+
+    assert second[0] == first[1] and second[2] == first[0]
+    assert second[1] not in first
+    assert index.sizes == [2, 2, 1]
+    assert np.dot(index.centroid(first[0]), centers[0] / np.linalg.norm(centers[0])) > 0.99
+
+def test_vectors_without_direction_are_not_clustered() -> None:
+    index = IssueClusterIndex(4, threshold=0.8, bits=4, tables=2)
+    assert index.add(np.array([[0, 0, 0, 0], [1, 0, 0, 0]])) == [-1, 0]
+    assert len(index) == 1
+
+def test_capacity_grows_with_clusters() -> None:
+    vectors = np.eye(100)
+    index = IssueClusterIndex(100, threshold=0.9, bits=4, tables=4)
+    assert index.add(vectors) == list(range(100))
+    assert index.add(vectors[99]) == [99]
+
+def test_unknown_issues_are_labelled_by_their_cluster() -> None:
+    words = {"battery": [1.0, 0.0, 0.0], "screen": [0.0, 1.0, 0.0], "xyz": [0.0, 0.0, 0.0]}
+
+    def embed(texts: list[str]) -> np.ndarray:
+        return np.array([words[text] for text in texts])
+
+    clusterer = IssueClusterer(embed, lambda: IssueClusterIndex(3, threshold=0.9, bits=4, tables=4))
+    assignments = clusterer.add_reports("B01", [
+        Report("R1", 1, [], [issue("battery", "Battery"), issue("screen")]),
+        Report("R2", 1, [], [issue("battery"), issue("battery"), issue("xyz")]),
+    ])
+
+    assert [(a.review_id, a.issue_index) for a in assignments] == [("R1", 0), ("R1", 1), ("R2", 0), ("R2", 1), ("R2", 2)]
+    assert assignments[2].cluster_id == assignments[0].cluster_id and assignments[4].cluster_id == -1
+
+    clusters = clusterer.clusters()
+    assert [(cluster.size, cluster.classification) for cluster in clusters] == [(3, "Battery"), (1, "UNKNOWN_ISSUE")]
+    assert clusters[0].classifications == {"Battery": 1, "UNKNOWN_ISSUE": 2}
+    assert clusters[0].examples == ["battery"] * 3
+    assert [cluster.size for cluster in clusterer.clusters(min_size=2)] == [3]
+    assert clusterer.add_reports("B01", [Report("R3", 1, [], [])]) == []
+
+def test_products_are_clustered_separately() -> None:
+    clusterer = IssueClusterer(lambda texts: np.ones((len(texts), 3)), lambda: IssueClusterIndex(3, threshold=0.9, bits=4, tables=4))
+    first = clusterer.add_reports("B01", [Report("R1", 1, [], [issue("battery"), issue("battery")])])
+    second = clusterer.add_reports("B02", [Report("R2", 1, [], [issue("battery")])])
+
+    assert [(a.product_id, a.cluster_id) for a in first + second] == [("B01", 0), ("B01", 0), ("B02", 0)]
+    assert [(cluster.product_id, cluster.size) for cluster in clusterer.clusters()] == [("B01", 2), ("B02", 1)]
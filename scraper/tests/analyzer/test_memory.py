@@ -0,0 +1,34 @@
+from analyzer.memory import MemoryGuard, rss_bytes
+
+def test_vocab_is_reset_after_growing_past_its_limit() -> None:
+    vocab = {"size": 1000}
+    rss = {"bytes": 100}
+
+    def reset_vocab() -> None:
+        vocab["size"] = 1010
+
+    guard = MemoryGuard(vocab_growth_limit=50, rss_limit=200, vocab_size=lambda: vocab["size"], reset_vocab=reset_vocab, rss=lambda: rss["bytes"])
+
+    vocab["size"] = 1050
+    assert not guard.check()
+    assert guard.vocab_resets == 0 and guard.vocab_growth() == 50
+
+    vocab["size"] = 1051
+    assert not guard.check()
+    assert guard.vocab_resets == 1
+    assert guard.last_vocab_size == 1010 and guard.vocab_growth() == 0
+
+    rss["bytes"] = 201
+    assert guard.check()
+    assert guard.last_rss == 201
+
+def test_limits_of_zero_are_disabled() -> None:
+    guard = MemoryGuard(vocab_growth_limit=0, rss_limit=0, vocab_size=lambda: 10 ** 9, reset_vocab=lambda: None, rss=lambda: 10 ** 12)
+    assert not guard.check()
+    assert guard.vocab_resets == 0
+
+def test_rss_bytes() -> None:
+    before = rss_bytes()
+    data = bytes(range(256)) * (50 * 2 ** 12)
+    assert rss_bytes() >= before + 40 * 2 ** 20
+    del data
@@ -0,0 +1,55 @@
+import gzip
+import json
+import os
+import random
+from pathlib import Path
+from typing import Any
+
+from analyzer.trace import ReviewTrace, TraceSink
+
+def read_traces(directory: Path) -> list[dict[str, Any]]:
+    traces: list[dict[str, Any]] = []
+    for name in sorted(os.listdir(directory)):
+        with gzip.open(directory / name, "rt") as f:
+            traces.extend(json.loads(line) for line in f)
+    return traces
+
+def make_trace(review_id: str) -> ReviewTrace:
+    trace = ReviewTrace(review_id)
+    trace.seconds["nlp"] = 0.01
+    trace.add("clauses", text="The hinge broke", classification="BROKEN")
+    return trace
+
+def test_traces_are_written_as_compressed_json_lines(tmp_path: Path) -> None:
+    sink = TraceSink(str(tmp_path), sample_rate=1, buffer_size=100, file_bytes=2 ** 20, files=3)
+    for i in range(3):
+        trace = sink.start(f"R{i}")
+        assert trace is not None
+        sink.write(trace)
+    assert sink.flush(5)
+    # Readable before the sink is closed
+    assert [trace["review_id"] for trace in read_traces(tmp_path)] == ["R0", "R1", "R2"]
+    sink.close()
+
+    assert read_traces(tmp_path)[0]["seconds"] == {}
+
+def test_sampling_and_dropping_when_the_buffer_is_full(tmp_path: Path) -> None:
+    sink = TraceSink(str(tmp_path), sample_rate=0.25, buffer_size=2, file_bytes=2 ** 20, files=3, rng=random.Random(1))
+    sampled = sum(sink.start(f"R{i}") is not None for i in range(1000))
+    assert 200 < sampled < 300
+
+    sink.close()
+    sink.write(make_trace("late"))
+    assert sink.dropped == 1 and sink.start("R") is None
+
+def test_files_are_rotated_and_only_the_newest_kept(tmp_path: Path) -> None:
+    sink = TraceSink(str(tmp_path), sample_rate=1, buffer_size=100, file_bytes=1, files=2)
+    for i in range(4):
+        sink.write(make_trace(f"R{i}"))
+        sink.flush(5)
+    sink.close()
+
+    assert len(os.listdir(tmp_path)) == 2
+    assert [trace["review_id"] for trace in read_traces(tmp_path)] == ["R2", "R3"]
+    assert read_traces(tmp_path)[0]["clauses"] == [{"text": "The hinge broke", "classification": "BROKEN"}]
+    assert sink.written == 4
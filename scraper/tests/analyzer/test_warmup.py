@@ -0,0 +1,41 @@
+import json
+from pathlib import Path
+
+from analyzer.warmup import warm_up, warmup_reviews
+from loadtest.corpus import LogNormal, synthetic_corpus
+from parsing.amazon import Review
+from utils.serialization import to_primitive
+
+def corpus(count: int) -> list[Review]:
+    return [review for product in synthetic_corpus(1, LogNormal(count, 0), LogNormal(80, 0.5), seed=0) for review in product.reviews]
+
+def test_no_warm_up_without_a_corpus(tmp_path: Path) -> None:
+    path = tmp_path / "corpus.json"
+    path.write_text(json.dumps(to_primitive(corpus(3))))
+
+    assert warmup_reviews("", 5) == []
+    assert warmup_reviews(str(path), 0) == []
+
+def test_corpus_is_read_in_the_to_analyze_format(tmp_path: Path) -> None:
+    path = tmp_path / "corpus.json"
+    path.write_text(json.dumps(to_primitive(corpus(3))))
+
+    reviews = warmup_reviews(str(path), 2)
+    assert [review.review_id for review in reviews] == [review.review_id for review in corpus(3)[:2]]
+
+def test_warm_up_counts_failures_and_stops_after_its_time_limit() -> None:
+    now = [0.0]
+    processed: list[str] = []
+
+    def process(reviews: list[Review]) -> None:
+        now[0] += 1
+        processed.extend(review.review_id for review in reviews)
+        if len(processed) == 2:
+            raise ValueError("bad review")
+
+    reviews = corpus(10)
+    result = warm_up(process, reviews, max_seconds=3, clock=lambda: now[0])
+
+    assert processed == [review.review_id for review in reviews[:3]]
+    assert result.reviews == 3 and result.failed == 1 and result.seconds == 3
+    assert result.review_seconds == [1, 1, 1]
@@ -0,0 +1,80 @@
+import json
+from pathlib import Path
+from typing import Callable
+import pytest
+
+from crawler import amazon
+from crawler.amazon import SearchPage
+from crawler.seen_products import SeenProductStore
+from listener.publisher import Publisher
+
+def search_html(product_ids: list[str], has_next: bool) -> str:
+    links = "".join(f'<a href="/Product-Name/dp/{product_id}/ref=sr_1_1">Product</a>' for product_id in product_ids)
+    next_button = '<a class="s-pagination-next" href="#">Next</a>' if has_next \
+        else '<span class="s-pagination-next s-pagination-disabled">Next</span>'
+    return f'<html><body>{links}<span class="s-pagination-strip">{next_button}</span></body></html>'
+
+def test_fetch_search_page_detects_last_page(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(amazon, "request_page", lambda url: search_html(["A1", "A1", "B2"], has_next=False))
+
+    page = amazon.fetch_search_page("https://www.amazon.ca/s?k=mouse", 0)
+    assert page.product_ids == ["A1", "B2"]
+    assert page.is_last_page
+
+def test_crawl_pages_stops_at_first_page_without_new_products(monkeypatch: pytest.MonkeyPatch) -> None:
+    pages = {0: ["A1", "B2"], 1: ["B2", "C3"], 2: ["C3"], 3: ["D4"]}
+    requested: list[int] = []
+
+    def fetch(url: str, page_num: int) -> SearchPage:
+        requested.append(page_num)
+        return SearchPage(page_num, pages.get(page_num, []), False)
+
+    monkeypatch.setattr(amazon, "fetch_search_page", fetch)
+
+    published: list[str] = []
+
+    def publish(message: str, on_enqueued: Callable[[], None]) -> None:
+        published.append(message)
+
+    seen = amazon.crawl_pages("https://www.amazon.ca/s?k=mouse", {"type": "amazon", "region": "ca"}, set(),
+        publish, concurrency=2)
+
+    assert seen == {"A1", "B2", "C3"}
+    assert [json.loads(message)["id"] for message in published] == ["A1", "B2", "C3"]
+    assert json.loads(published[0])["region"] == "ca"
+    assert max(requested) <= 3
+
+def test_products_that_failed_to_publish_are_not_recorded_as_enqueued(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(amazon, "fetch_search_page", lambda url, page_num: SearchPage(page_num, ["A1", "B2"], True))
+    store = SeenProductStore(str(tmp_path), ttl_seconds=3600)
+    review_info = {"type": "amazon", "region": "ca"}
+
+    def publish(message: str, on_enqueued: Callable[[], None]) -> None:
+        if json.loads(message)["id"] == "B2":
+            raise ConnectionError("publisher closed")
+        on_enqueued()
+
+    with pytest.raises(ConnectionError):
+        amazon.crawl_pages("https://www.amazon.ca/s?k=mouse", review_info, set(), publish, concurrency=1, seen_store=store)
+
+    assert store.is_recent(SeenProductStore.key(review_info, "A1"))
+    assert not store.is_recent(SeenProductStore.key(review_info, "B2"))
+    store.close()
+
+def test_products_dropped_unconfirmed_by_the_publisher_are_not_recorded_as_enqueued(monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path) -> None:
+    monkeypatch.setattr(amazon, "fetch_search_page", lambda url, page_num: SearchPage(page_num, ["A1"], True))
+    store = SeenProductStore(str(tmp_path), ttl_seconds=3600)
+    review_info = {"type": "amazon", "region": "ca"}
+    # Never connected, so nothing is confirmed
+    publisher = Publisher("localhost", 5672, batch_size=1, flush_interval=3600, max_in_flight=10)
+
+    def publish(message: str, on_enqueued: Callable[[], None]) -> None:
+        publisher.publish("parse", message, on_confirm=on_enqueued)
+
+    amazon.crawl_pages("https://www.amazon.ca/s?k=mouse", review_info, set(), publish, concurrency=1, page_limit=1, seen_store=store)
+    publisher.close(timeout=0.1)
+
+    assert publisher.dropped == 1
+    assert not store.is_recent(SeenProductStore.key(review_info, "A1"))
+    store.close()
@@ -0,0 +1,100 @@
+import threading
+from typing import Any, Callable
+import pytest
+
+from crawler import scheduler as scheduler_module
+from crawler.amazon import SearchPage
+from crawler.scheduler import CrawlCancelledError, CrawlJob, CrawlJobState, CrawlScheduler
+
+class FakeCrawl:
+    """
+    Publishes one product per page until should_stop returns True, pages are released one at a time.
+    """
+
+    def __init__(self) -> None:
+        self.started: list[str] = []
+        self.page_released = threading.Semaphore(0)
+
+    def __call__(self, url: str, review_info: Any, products_to_ignore: set[str], publish_callback: Callable[[str, Callable[[], None]], None],
+            concurrency: int, page_limit: int, should_stop: Callable[[], bool], seen_store: Any,
+            on_page: Callable[[SearchPage, int], None]) -> set[str]:
+        self.started.append(url)
+        for page_num in range(page_limit):
+            self.page_released.acquire()
+            publish_callback(f"{url}#{page_num}", lambda: None)
+            on_page(SearchPage(page_num, [str(page_num)], False), 1)
+            if should_stop():
+                break
+        return products_to_ignore
+
+def wait_for(condition: Callable[[], bool]) -> None:
+    for _ in range(200):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Timed out")
+
+def test_priority_order_and_cancel(monkeypatch: pytest.MonkeyPatch) -> None:
+    fake_crawl = FakeCrawl()
+    monkeypatch.setattr(scheduler_module, "crawl_pages", fake_crawl)
+    published: list[str] = []
+
+    def publish(job: CrawlJob, message: str, on_enqueued: Callable[[], None]) -> None:
+        published.append(message)
+
+    scheduler = CrawlScheduler(max_jobs=1, default_concurrency=1, publish=publish, page_limit=3)
+    first = scheduler.submit("first", {})
+    wait_for(lambda: first.state == CrawlJobState.RUNNING)
+
+    low = scheduler.submit("low", {}, priority=0)
+    high = scheduler.submit("high", {}, priority=5)
+    assert scheduler.submit("low", {}) is low
+    scheduler.reprioritize(10, url="low")
+
+    # Cancel is handled while the crawl is running
+    scheduler.cancel(job_id=first.job_id)
+    fake_crawl.page_released.release()
+    wait_for(lambda: first.state == CrawlJobState.CANCELLED)
+    assert first.progress.pages == 1 and first.progress.products_enqueued == 1
+
+    for _ in range(6):
+        fake_crawl.page_released.release()
+    wait_for(lambda: high.state == CrawlJobState.FINISHED)
+
+    assert fake_crawl.started == ["first", "low", "high"]
+    assert low.progress.products_found == 3
+    assert len(published) == 7
+    scheduler.shutdown()
+
+def test_job_cancelled_while_publishing_is_cancelled(monkeypatch: pytest.MonkeyPatch) -> None:
+    fake_crawl = FakeCrawl()
+    monkeypatch.setattr(scheduler_module, "crawl_pages", fake_crawl)
+
+    def publish(job: CrawlJob, message: str, on_enqueued: Callable[[], None]) -> None:
+        job.cancel_event.set()
+        raise CrawlCancelledError(job.job_id)
+
+    scheduler = CrawlScheduler(max_jobs=1, default_concurrency=1, publish=publish, page_limit=3)
+    job = scheduler.submit("first", {})
+    fake_crawl.page_released.release()
+    wait_for(lambda: job.state == CrawlJobState.CANCELLED)
+
+    assert job.progress.products_enqueued == 0
+    scheduler.shutdown()
+
+def test_only_the_latest_done_jobs_are_kept(monkeypatch: pytest.MonkeyPatch) -> None:
+    fake_crawl = FakeCrawl()
+    monkeypatch.setattr(scheduler_module, "crawl_pages", fake_crawl)
+
+    def publish(job: CrawlJob, message: str, on_enqueued: Callable[[], None]) -> None:
+        pass
+
+    scheduler = CrawlScheduler(max_jobs=1, default_concurrency=1, publish=publish, page_limit=1, history=2)
+    jobs = [scheduler.submit(f"url-{i}", {}) for i in range(4)]
+    for _ in jobs:
+        fake_crawl.page_released.release()
+    # Done jobs are forgotten right after they finish
+    wait_for(lambda: scheduler.jobs() == jobs[2:])
+    assert all(job.state == CrawlJobState.FINISHED for job in jobs)
+    assert scheduler.reprioritize(5, job_id=jobs[3].job_id) == []
+    scheduler.shutdown()
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from crawler.seen_products import SeenProductStore
+
+def test_skips_products_within_ttl(tmp_path: Path) -> None:
+    now = [1000.0]
+    store = SeenProductStore(str(tmp_path), ttl_seconds=3600, clock=lambda: now[0])
+    key = SeenProductStore.key({"type": "amazon", "region": "ca"}, "B08B3K9K6P")
+
+    assert not store.is_recent(key)
+    store.mark_enqueued(key)
+    assert store.is_recent(key)
+    assert store.last_enqueued(key) == 1000.0
+
+    now[0] += 3601
+    assert not store.is_recent(key)
+    store.mark_enqueued(key)
+    assert (store.enqueued, store.skipped) == (2, 1)
+    store.close()
+
+def test_persists_across_instances(tmp_path: Path) -> None:
+    key = SeenProductStore.key({"type": "amazon", "region": "com"}, "B00DBL0NLQ")
+
+    store = SeenProductStore(str(tmp_path), ttl_seconds=3600)
+    store.mark_enqueued(key)
+    store.close()
+
+    store = SeenProductStore(str(tmp_path), ttl_seconds=3600)
+    assert store.is_recent(key)
+    assert not store.is_recent(SeenProductStore.key({"type": "amazon", "region": "ca"}, "B00DBL0NLQ"))
+    store.close()
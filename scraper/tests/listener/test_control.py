@@ -0,0 +1,22 @@
+import json
+from typing import Any
+
+from pika.spec import Basic
+import listener.control as control
+
+def test_profile_command_applies_to_its_service(monkeypatch: Any) -> None:
+    started: list[tuple[str, float]] = []
+
+    def start_profile(service: str, seconds: float) -> bool:
+        started.append((service, seconds))
+        return True
+
+    monkeypatch.setattr(control, "start_profile", start_profile)
+    on_control_message = getattr(control, "__on_control_message")
+
+    for service in ["parser", "analyzer"]:
+        on_control_message(service, None, Basic.Deliver(), None, json.dumps({"command": "profile", "seconds": 5, "service": "analyzer"}))
+        on_control_message(service, None, Basic.Deliver(), None, json.dumps({"command": "profile"}))
+    on_control_message("parser", None, Basic.Deliver(), None, b"not json")
+
+    assert started == [("parser", 30), ("analyzer", 5), ("analyzer", 30)]
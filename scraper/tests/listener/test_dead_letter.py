@@ -0,0 +1,43 @@
+import json
+from typing import Any, Callable
+
+from listener.dead_letter import dead_letter_items, retry_count, retry_or_dead_letter
+from listener.publisher import json_properties
+
+class FakePublisher:
+    def __init__(self) -> None:
+        self.published: list[tuple[str, Any, Any]] = []
+
+    def publish(self, routing_key: str, body: Any, properties: Any = None, on_confirm: Callable[[], None] | None = None) -> None:
+        self.published.append((routing_key, body, properties))
+        if on_confirm:
+            on_confirm()
+
+def test_retries_then_dead_letters() -> None:
+    publisher: Any = FakePublisher()
+    acked: list[bool] = []
+    properties = json_properties()
+
+    for _ in range(3):
+        retry_or_dead_letter(publisher, "to_analyze", b"[]", properties, ValueError("bad date"), 2, lambda: acked.append(True))
+        properties = publisher.published[-1][2]
+
+    assert [routing_key for routing_key, _, _ in publisher.published] == ["to_analyze", "to_analyze", "to_analyze.dead_letter"]
+    assert retry_count(properties) == 2
+    headers: Any = properties.headers
+    assert headers["x-error"] == "ValueError: bad date"
+    assert headers["x-source-queue"] == "to_analyze"
+    assert len(acked) == 3
+
+def test_dead_letter_items_keeps_error_per_item() -> None:
+    publisher: Any = FakePublisher()
+
+    dead_letter_items(publisher, "to_analyze", [])
+    assert publisher.published == []
+
+    dead_letter_items(publisher, "to_analyze", [({"review_id": "R1"}, KeyError("author_id"))])
+    routing_key, body, _ = publisher.published[0]
+    items = json.loads(body)
+    assert routing_key == "to_analyze.dead_letter"
+    assert items[0]["item"] == {"review_id": "R1"}
+    assert items[0]["error"]["type"] == "KeyError"
@@ -0,0 +1,56 @@
+import json
+import pytest
+
+from listener import envelope
+from listener.publisher import json_properties
+
+reviews = [{
+    "review_id": f"R{i}",
+    "text": "Stopped working after a month. " * (i + 1),
+    "product_name": "Razer Viper Mini",
+    "manufacturer_name": "Razer",
+    "region": "ca"
+} for i in range(50)]
+
+def test_round_trip_hoists_product_fields() -> None:
+    messages = envelope.encode(reviews, "gzip", max_chunk_bytes=10 ** 6)
+    assert len(messages) == 1
+
+    body, properties = messages[0]
+    assert properties.content_encoding == "gzip"
+    raw = json.loads(envelope.decompress(body, "gzip"))
+    assert raw["header"] == {"product_name": "Razer Viper Mini", "manufacturer_name": "Razer", "region": "ca"}
+    assert "product_name" not in raw["items"][0]
+
+    assert envelope.decode(body, properties) == reviews
+    assert len(body) < len(json.dumps(reviews)) / 5
+
+def test_chunks_are_decodable_on_their_own() -> None:
+    messages = envelope.encode(reviews, None, max_chunk_bytes=5000)
+    assert len(messages) > 1
+    headers = [properties.headers or {} for _, properties in messages]
+    assert [header["x-chunk-index"] for header in headers] == list(range(len(messages)))
+    assert {header["x-chunk-count"] for header in headers} == {len(messages)}
+    assert len({properties.message_id for _, properties in messages}) == 1
+
+    decoded = [item for body, properties in messages for item in envelope.decode(body, properties)]
+    assert decoded == reviews
+
+def test_legacy_plain_json_is_still_decoded() -> None:
+    assert envelope.decode(json.dumps(reviews).encode(), json_properties()) == reviews
+    assert envelope.decode(json.dumps(reviews).encode(), None) == reviews
+
+def test_zstd_round_trip() -> None:
+    pytest.importorskip("zstandard")
+    body, properties = envelope.encode(reviews, "zstd", max_chunk_bytes=10 ** 6)[0]
+    assert envelope.decode(body, properties) == reviews
+
+def test_only_configured_queues_use_envelopes(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("QUEUE_ENVELOPE_QUEUES", "to_analyze")
+
+    legacy_body, legacy_properties = envelope.encode_for_queue("parsed_reviews", reviews)[0]
+    assert json.loads(legacy_body) == reviews
+    assert not legacy_properties.headers
+
+    body, properties = envelope.encode_for_queue("to_analyze", reviews)[0]
+    assert envelope.decode(body, properties) == reviews
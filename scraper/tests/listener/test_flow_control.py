@@ -0,0 +1,46 @@
+from listener.flow_control import FlowController
+
+def test_pauses_above_high_water_until_low_water() -> None:
+    now = [0.0]
+    depths = iter([50, 120, 90, 60, 40, 70])
+
+    def sleep(seconds: float) -> None:
+        now[0] += seconds
+
+    flow = FlowController("parse", lambda: next(depths), high_water=100, low_water=50, check_interval=5,
+        clock=lambda: now[0], sleep=sleep)
+
+    assert flow.wait() == 0
+    # Within the check interval the last decision is reused
+    assert flow.wait() == 0
+
+    now[0] += 5
+    assert flow.wait() == 15
+    assert not flow.paused
+    assert flow.last_depth == 40
+    assert flow.paused_seconds == 15
+
+def test_disabled_without_high_water() -> None:
+    flow = FlowController("parse", lambda: 10 ** 6, high_water=0, low_water=0, check_interval=5)
+    assert flow.wait() == 0
+
+def test_probe_errors_do_not_block_producers() -> None:
+    def depth() -> int:
+        raise ConnectionError("broker down")
+
+    flow = FlowController("parse", depth, high_water=1, low_water=0, check_interval=5)
+    assert flow.wait() == 0
+
+def test_stops_waiting_once_should_stop_returns_true() -> None:
+    now = [0.0]
+    stop = [False]
+
+    def sleep(seconds: float) -> None:
+        now[0] += seconds
+        stop[0] = now[0] >= 10
+
+    flow = FlowController("parse", lambda: 10 ** 6, high_water=100, low_water=50, check_interval=5,
+        clock=lambda: now[0], sleep=sleep)
+
+    assert flow.wait(lambda: stop[0]) == 10
+    assert flow.paused
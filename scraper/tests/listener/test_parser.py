@@ -0,0 +1,104 @@
+from typing import Any, Callable
+import pika
+import pytest
+
+import listener.parser as parser
+from listener.flow_control import FlowController
+from listener.publisher import OutgoingMessage
+from listener.scheduling import Lane, job_id_header, lane_of
+from requester.retry_policy import CircuitOpenError
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.callbacks: list[Callable[[], None]] = []
+        self.delays: list[float] = []
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        self.callbacks.append(callback)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> None:
+        self.delays.append(delay)
+        callback()
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.connection = FakeConnection()
+        self.acks: list[int] = []
+        self.nacks: list[tuple[int, bool]] = []
+
+    def basic_ack(self, delivery_tag: int) -> None:
+        self.acks.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag: int, requeue: bool) -> None:
+        self.nacks.append((delivery_tag, requeue))
+
+no_flow_control = FlowController("to_analyze", lambda: 0, high_water=0, low_water=0, check_interval=1)
+
+class FakePublisher:
+    def __init__(self) -> None:
+        self.published: list[tuple[str, pika.BasicProperties]] = []
+
+    def publish_batch(self, messages: list[OutgoingMessage], on_confirm: Callable[[], None]) -> None:
+        self.messages = messages
+        on_confirm()
+
+    def publish(self, routing_key: str, body: bytes, properties: pika.BasicProperties, on_confirm: Callable[[], None]) -> None:
+        self.published.append((routing_key, properties))
+        on_confirm()
+
+def test_worker_acks_on_connection_thread_after_confirm(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(parser, "get_reviews", lambda parsed: [])
+    channel = FakeChannel()
+    publisher = FakePublisher()
+
+    parse_product: Any = getattr(parser, "__parse_product")
+    parse_product(publisher, no_flow_control, parser.WorkerPool(1), channel, 7, b'{"type": "amazon", "region": "ca", "id": "B08B3K9K6P"}')
+
+    assert [message.routing_key for message in publisher.messages] == ["parsed_reviews", "to_analyze"]
+    assert channel.acks == []
+    for callback in channel.connection.callbacks:
+        callback()
+    assert channel.acks == [7]
+
+def test_failed_delivery_is_retried_then_dead_lettered(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("PARSER_MAX_RETRIES", "1")
+    channel = FakeChannel()
+    publisher = FakePublisher()
+    parse_product: Any = getattr(parser, "__parse_product")
+
+    parse_product(publisher, no_flow_control, parser.WorkerPool(1), channel, 1, b"not json")
+    parse_product(publisher, no_flow_control, parser.WorkerPool(1), channel, 2, b"not json", publisher.published[0][1])
+    for callback in channel.connection.callbacks:
+        callback()
+
+    assert [routing_key for routing_key, _ in publisher.published] == ["parse", "parse.dead_letter"]
+    assert channel.acks == [1, 2]
+    assert channel.nacks == []
+
+def test_reviews_are_published_in_the_lane_of_their_product(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(parser, "get_reviews", lambda parsed: [])
+    publisher = FakePublisher()
+    properties = pika.BasicProperties(priority=5, headers={job_id_header: "crawl-1"})
+
+    parse_product: Any = getattr(parser, "__parse_product")
+    parse_product(publisher, no_flow_control, parser.WorkerPool(1), FakeChannel(), 3,
+        b'{"type": "amazon", "region": "ca", "id": "B08B3K9K6P"}', properties)
+
+    assert [lane_of(message.properties) for message in publisher.messages] == [Lane(5, "crawl-1")] * 2
+
+def test_products_of_a_blocked_region_are_requeued_without_counting_a_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    def get_reviews(parsed: Any) -> list[Any]:
+        raise CircuitOpenError("Circuit for ca is open", retry_after=42)
+
+    monkeypatch.setattr(parser, "get_reviews", get_reviews)
+    channel = FakeChannel()
+    publisher = FakePublisher()
+    parse_product: Any = getattr(parser, "__parse_product")
+
+    parse_product(publisher, no_flow_control, parser.WorkerPool(1), channel, 4, b'{"type": "amazon", "region": "ca", "id": "B08B3K9K6P"}')
+    for callback in channel.connection.callbacks:
+        callback()
+
+    assert publisher.published == []
+    assert channel.connection.delays == [42]
+    assert channel.nacks == [(4, True)]
@@ -0,0 +1,88 @@
+from typing import Any
+import pika
+from pika.frame import Method
+
+from listener.publisher import OutgoingMessage, Publisher, json_properties
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.is_open = True
+        self.published: list[tuple[str, Any]] = []
+
+    def add_on_close_callback(self, callback: Any) -> None:
+        pass
+
+    def confirm_delivery(self, callback: Any) -> None:
+        pass
+
+    def basic_publish(self, exchange: str, routing_key: str, body: Any, properties: Any) -> None:
+        self.published.append((routing_key, body))
+
+def ack(delivery_tag: int, multiple: bool = False) -> Method:
+    return Method(1, pika.spec.Basic.Ack(delivery_tag=delivery_tag, multiple=multiple))
+
+def nack(delivery_tag: int) -> Method:
+    return Method(1, pika.spec.Basic.Nack(delivery_tag=delivery_tag))
+
+def open_publisher(batch_size: int, max_in_flight: int) -> tuple[Publisher, FakeChannel]:
+    publisher = Publisher("localhost", 5672, batch_size=batch_size, flush_interval=3600, max_in_flight=max_in_flight)
+    channel = FakeChannel()
+    publisher._on_channel_open(channel) # type: ignore
+    return publisher, channel
+
+def test_buffers_until_batch_size() -> None:
+    publisher, channel = open_publisher(batch_size=3, max_in_flight=10)
+
+    publisher.publish("parse", "1")
+    publisher.publish("parse", "2")
+    publisher._drain()
+    assert channel.published == []
+
+    publisher.publish("parse", "3")
+    publisher._drain()
+    assert [body for _, body in channel.published] == [b"1", b"2", b"3"]
+
+def test_in_flight_window_and_confirm_callbacks() -> None:
+    publisher, channel = open_publisher(batch_size=1, max_in_flight=2)
+    confirmed: list[str] = []
+
+    publisher.publish_batch([
+        OutgoingMessage("parsed_reviews", "a", json_properties()),
+        OutgoingMessage("to_analyze", "a", json_properties())
+    ], on_confirm=lambda: confirmed.append("a"))
+    publisher.publish("parse", "b", on_confirm=lambda: confirmed.append("b"))
+    publisher._drain()
+    assert len(channel.published) == 2
+
+    publisher._on_delivery_confirmation(ack(1))
+    assert confirmed == []
+    assert len(channel.published) == 3
+
+    publisher._on_delivery_confirmation(ack(3, multiple=True))
+    assert confirmed == ["a", "b"]
+    assert publisher.pending_count() == 0
+
+def test_nacked_and_unconfirmed_messages_are_published_again() -> None:
+    publisher, channel = open_publisher(batch_size=1, max_in_flight=10)
+
+    publisher.publish("reports", "x")
+    publisher.publish("reports", "y")
+    publisher._drain()
+    publisher._on_delivery_confirmation(nack(1))
+    assert [body for _, body in channel.published] == [b"x", b"y", b"x"]
+
+    publisher._requeue_in_flight()
+    channel = FakeChannel()
+    publisher._on_channel_open(channel) # type: ignore
+    assert [body for _, body in channel.published] == [b"y", b"x"]
+    assert publisher.republished == 3
+
+def test_close_without_connection_drops_unconfirmed_messages_after_timeout() -> None:
+    publisher = Publisher("localhost", 5672, batch_size=1, flush_interval=3600, max_in_flight=10)
+    confirmed: list[str] = []
+
+    publisher.publish("parse", "a", on_confirm=lambda: confirmed.append("a"))
+    publisher.close(timeout=0.1)
+
+    assert confirmed == []
+    assert (publisher.dropped, publisher.pending_count()) == (1, 0)
@@ -0,0 +1,106 @@
+from pathlib import Path
+import sqlite3
+import time
+from typing import Callable
+
+from analyzer.report import Issue, Keyframe, Report
+from listener.report_sink import ReportDatabase, ReportSink, SqliteReportDatabase, open_report_database
+
+def make_report(review_id: str, issues: int = 1) -> Report:
+    return Report(review_id, 1, [Keyframe(rel_timestamp=0, text="", time_start=0, time_end=0, sentiment=0.5, interp="linear")],
+        [Issue(text=f"Broke {i}", classification=None, criticality=0.9, rel_timestamp=30, frequency=None, image="https://img/1.jpg",
+            resolution=None) for i in range(issues)])
+
+def create_database(path: Path, review_ids: list[str]) -> None:
+    database = SqliteReportDatabase(str(path))
+    database.connection.executemany('INSERT INTO "Review" ("id", "review_id") VALUES (?, ?)',
+        [(f"db-{review_id}", review_id) for review_id in review_ids])
+    database.connection.commit()
+    database.close()
+
+def count(path: Path, table: str) -> int:
+    with sqlite3.connect(path) as connection:
+        return connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+def make_sink(path: Path, batch_size: int = 100, open_database: Callable[[], ReportDatabase] | None = None) -> ReportSink:
+    return ReportSink(open_database or (lambda: open_report_database(f"sqlite:///{path}")), batch_size=batch_size,
+        flush_interval=3600, max_attempts=2, retry_delay=0).start()
+
+def test_reports_of_several_adds_are_committed_together(tmp_path: Path) -> None:
+    path = tmp_path / "reports.db"
+    create_database(path, ["R1", "R2", "R3"])
+    committed: list[str] = []
+    sink = make_sink(path, batch_size=3)
+
+    sink.add([make_report("R1")], on_commit=lambda: committed.append("first"), on_failure=lambda: committed.append("failed"))
+    time.sleep(0.1)
+    assert committed == []
+    sink.add([make_report("R2", issues=2), make_report("R3")], on_commit=lambda: committed.append("second"),
+        on_failure=lambda: committed.append("failed"))
+    assert sink.flush(5)
+
+    assert committed == ["first", "second"]
+    assert count(path, "Report") == 3 and count(path, "Issue") == 4 and count(path, "IssueImage") == 4
+    with sqlite3.connect(path) as connection:
+        assert connection.execute('SELECT "review_id" FROM "Report" ORDER BY "review_id"').fetchall() == [("db-R1",), ("db-R2",), ("db-R3",)]
+        assert connection.execute('SELECT DISTINCT "classification" FROM "Issue"').fetchall() == [("",)]
+    sink.close()
+
+def test_redelivered_reports_replace_the_previous_ones(tmp_path: Path) -> None:
+    path = tmp_path / "reports.db"
+    create_database(path, ["R1", "R2"])
+    sink = make_sink(path)
+
+    for _ in range(2):
+        sink.add([make_report("R1", issues=3), make_report("R2")], on_commit=lambda: None, on_failure=lambda: None)
+        sink.flush(5)
+    sink.add([make_report("R1", issues=1), make_report("R1", issues=2)], on_commit=lambda: None, on_failure=lambda: None)
+    sink.close()
+
+    assert count(path, "Report") == 2 and count(path, "ReliabilityKeyframe") == 2
+    assert count(path, "Issue") == 3 and count(path, "IssueImage") == 3
+
+def test_reports_of_unknown_reviews_are_handed_back(tmp_path: Path) -> None:
+    path = tmp_path / "reports.db"
+    create_database(path, ["R1", "R2"])
+    outcomes: list[str] = []
+    sink = make_sink(path)
+
+    sink.add([make_report("R1"), make_report("missing")], on_commit=lambda: outcomes.append("first committed"),
+        on_failure=lambda: outcomes.append("first failed"))
+    sink.add([make_report("R2")], on_commit=lambda: outcomes.append("second committed"),
+        on_failure=lambda: outcomes.append("second failed"))
+    sink.close()
+
+    # The server inserts reviews one at a time, so the first message goes to the reports queue as a whole
+    assert sorted(outcomes) == ["first failed", "second committed"]
+    assert count(path, "Report") == 1
+
+def test_failing_batches_are_retried_then_handed_back(tmp_path: Path) -> None:
+    path = tmp_path / "reports.db"
+    create_database(path, ["R1"])
+    opened: list[ReportDatabase] = []
+
+    def open_database() -> ReportDatabase:
+        database = SqliteReportDatabase(str(path))
+        if not opened:
+            database.connection.execute('DROP TABLE "Issue"')
+        opened.append(database)
+        return database
+
+    outcomes: list[str] = []
+    sink = make_sink(path, open_database=open_database)
+    sink.add([make_report("R1")], on_commit=lambda: outcomes.append("committed"), on_failure=lambda: outcomes.append("failed"))
+    sink.close()
+
+    # The first connection fails without committing anything, the second one recreates the table
+    assert len(opened) == 2 and outcomes == ["committed"]
+    assert count(path, "Report") == 1
+
+    def unavailable() -> ReportDatabase:
+        raise OSError("database is down")
+
+    sink = make_sink(path, open_database=unavailable)
+    sink.add([make_report("R1")], on_commit=lambda: outcomes.append("committed"), on_failure=lambda: outcomes.append("failed"))
+    sink.close()
+    assert outcomes == ["committed", "failed"]
@@ -0,0 +1,66 @@
+import threading
+
+import pika
+import pytest
+
+from listener.scheduling import FairScheduler, Lane, WorkerPool, lane_of, queue_arguments, queue_wait, with_lane
+
+def test_higher_priorities_are_served_first() -> None:
+    scheduler: FairScheduler[str] = FairScheduler()
+    scheduler.put("crawl", Lane(0, "crawl"))
+    scheduler.put("urgent", Lane(5, "user"))
+    scheduler.put("crawl 2", Lane(0, "crawl"))
+
+    assert [scheduler.pop() for _ in range(len(scheduler))] == ["urgent", "crawl", "crawl 2"]
+    with pytest.raises(IndexError):
+        scheduler.pop()
+
+def test_jobs_of_the_same_priority_take_turns() -> None:
+    scheduler: FairScheduler[str] = FairScheduler()
+    for i in range(3):
+        scheduler.put(f"a{i}", Lane(0, "a"))
+    scheduler.put("b0", Lane(0, "b"))
+    scheduler.put("c0", Lane(0, "c"))
+    scheduler.put("b1", Lane(0, "b"))
+
+    assert [scheduler.pop() for _ in range(len(scheduler))] == ["a0", "b0", "c0", "a1", "b1", "a2"]
+
+def test_lanes_travel_in_message_properties() -> None:
+    properties = with_lane(pika.BasicProperties(headers={"x-retry-count": 1}), Lane(300, "crawl-1"))
+
+    headers = properties.headers or {}
+    assert lane_of(properties) == Lane(255, "crawl-1")
+    assert headers["x-retry-count"] == 1
+    assert lane_of(None) == Lane() and lane_of(pika.BasicProperties()) == Lane()
+
+    waited = queue_wait(properties, now=lambda: headers["x-enqueued-at"] + 2.5)
+    assert waited == pytest.approx(2.5)
+    assert queue_wait(pika.BasicProperties()) is None
+
+def test_only_shared_queues_get_priorities(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert queue_arguments("parse") is None
+    monkeypatch.setenv("QUEUE_MAX_PRIORITY", "10")
+    assert queue_arguments("parse") == {"x-max-priority": 10}
+    assert queue_arguments("parsed_reviews") is None
+
+def test_worker_pool_runs_waiting_work_by_lane() -> None:
+    pool = WorkerPool(1)
+    started = threading.Event()
+    release = threading.Event()
+    order: list[str] = []
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    pool.submit(block)
+    started.wait(5)
+    # Submitted while the only worker is busy, so they are picked by lane once it is free
+    pool.submit(order.append, "crawl 1", lane=Lane(0, "crawl"))
+    pool.submit(order.append, "crawl 2", lane=Lane(0, "crawl"))
+    pool.submit(order.append, "other crawl", lane=Lane(0, "other"))
+    pool.submit(order.append, "user", lane=Lane(5, "user"))
+    release.set()
+    pool.shutdown()
+
+    assert order == ["user", "crawl 1", "other crawl", "crawl 2"]
@@ -0,0 +1,77 @@
+import threading
+from typing import Any
+
+from loadtest.broker import Consumer, InMemoryBroker
+from loadtest.corpus import LogNormal, recorded_pages, synthetic_corpus
+from loadtest.driver import percentile, run_load_test
+from loadtest.recorded import recorded_pages_served
+from parsing.amazon import parse_reviews
+
+def test_recorded_pages_parse_back_to_the_corpus() -> None:
+    corpus = synthetic_corpus(2, LogNormal(23, 0), LogNormal(40, 0.5), seed=3)
+    with recorded_pages_served(recorded_pages(corpus), sessions=1) as pool:
+        reviews = parse_reviews(corpus[1].region, corpus[1].product_id)
+
+    assert reviews == corpus[1].reviews
+    # Three pages of reviews and the empty page after them
+    assert pool.sessions[0].session.requests == 4
+
+def test_corpus_is_reproducible() -> None:
+    assert synthetic_corpus(3, LogNormal(10, 1), LogNormal(30, 1), seed=1) == synthetic_corpus(3, LogNormal(10, 1), LogNormal(30, 1), seed=1)
+
+def test_consumer_respects_prefetch() -> None:
+    broker = InMemoryBroker()
+    received: list[tuple[Consumer, int]] = []
+    both_received = threading.Event()
+
+    def callback(channel: Consumer, method_frame: Any, properties: Any, body: bytes) -> None:
+        received.append((channel, method_frame.delivery_tag))
+        if len(received) == 2:
+            both_received.set()
+
+    for i in range(3):
+        broker.publish("parse", f"{i}")
+    consumer = broker.consume("parse", callback, prefetch=2)
+
+    assert both_received.wait(1)
+    assert broker.depth("parse") == 1 and not broker.idle()
+
+    for channel, delivery_tag in list(received):
+        channel.basic_ack(delivery_tag)
+    broker.close()
+
+    assert consumer.stats.acked == 2
+    assert len(consumer.stats.lag) == consumer.stats.delivered
+
+def test_nacked_deliveries_are_redelivered() -> None:
+    broker = InMemoryBroker()
+    redelivered = threading.Event()
+
+    def callback(channel: Consumer, method_frame: Any, properties: Any, body: bytes) -> None:
+        if method_frame.redelivered:
+            channel.basic_ack(method_frame.delivery_tag)
+            redelivered.set()
+        else:
+            channel.basic_nack(method_frame.delivery_tag, requeue=True)
+
+    broker.publish("parse", "product")
+    broker.consume("parse", callback, prefetch=1)
+    assert redelivered.wait(1)
+    broker.close()
+    assert broker.idle()
+
+def test_percentile() -> None:
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) == 0
+
+def test_load_test_parses_every_product() -> None:
+    corpus = synthetic_corpus(4, LogNormal(15, 0.5), LogNormal(20, 0.5))
+    result = run_load_test(corpus, rate=0, latency=0, prefetch=2, timeout=30)
+
+    assert result.unfinished == []
+    assert len(result.latencies) == 4
+    assert result.stages[0].stats.acked == 4
+    assert result.stages[0].reviews == result.reviews
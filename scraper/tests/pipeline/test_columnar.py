@@ -0,0 +1,114 @@
+from pathlib import Path
+import time
+from typing import Any
+import numpy as np
+import pytest
+
+from analyzer.report import Issue, Keyframe, Report
+from parsing.amazon import Review
+from pipeline.columnar import ColumnarWriter, ReviewExport, StringColumn, column_type, load_columns, scan
+from requester.amazon import AmazonRegion
+
+def make_review(review_id: str, date: int, region: AmazonRegion = AmazonRegion.CA) -> Review:
+    return Review(author_id=None, author_name="Jane", author_image_url="", title="Title", text=f"Review {review_id} é", date=date,
+        date_text="", review_id=review_id, attributes={"Colour": "Black"}, verified_purchase=True, found_helpful_count=2,
+        is_top_positive_review=False, is_top_critical_review=False, images=[], country_reviewed_in="Canada",
+        region=region, product_name="Mouse", product_image_url=None, manufacturer_name=None, manufacturer_id=None)
+
+def make_report(review_id: str) -> Report:
+    return Report(review_id, 1, [Keyframe(rel_timestamp=0, text="", time_start=0, time_end=0, sentiment=0.5, interp=None)],
+        [Issue(text="Broke", classification=None, criticality=0.9, rel_timestamp=30, frequency=None, image=None, resolution=None),
+         Issue(text="Loose", classification="Hinge", criticality=None, rel_timestamp=None, frequency=None, image=None, resolution=None)])
+
+def test_column_types() -> None:
+    assert column_type([True, None]) == "bool"
+    assert column_type([1, None, 2]) == "int64"
+    assert column_type([1, 2.5]) == "float64"
+    assert column_type(["a", None]) == "str"
+    assert column_type([["a"], {"b": 1}]) == "json"
+    assert column_type([1, "a"]) == "json"
+    assert column_type([None, None]) == "null"
+
+@pytest.mark.parametrize("compression", ["identity", "gzip"])
+def test_rows_round_trip(tmp_path: Path, compression: str) -> None:
+    writer = ColumnarWriter(str(tmp_path), part_rows=100, compression=compression)
+    rows: list[dict[str, Any]] = [{"id": "a", "count": 1, "score": 0.5, "ok": True, "tags": ["x"], "missing": None},
+        {"id": "b", "count": None, "score": 1.5, "ok": False, "tags": {"y": 2}, "extra": "only here"}]
+    writer.append("things", {"region": "ca"}, rows)
+    assert list(scan(str(tmp_path), "things")) == []
+    writer.close()
+
+    [part] = scan(str(tmp_path), "things")
+    assert part.partition == {"region": "ca"} and part.rows == 2
+    assert part.types == {"id": "str", "count": "int64", "score": "float64", "ok": "bool", "tags": "json", "missing": "null", "extra": "str"}
+    assert part.values("id").tolist() == ["a", "b"]
+    assert part.values("count").tolist() == [1, None]
+    assert part.values("score").tolist() == [0.5, 1.5]
+    assert part.values("tags").tolist() == [["x"], {"y": 2}]
+    assert part.values("extra").tolist() == [None, "only here"]
+    assert part.values("missing").tolist() == [None, None]
+    assert load_columns(str(tmp_path), "things", ["missing"])["missing"].tolist() == [None, None]
+    if compression == "identity":
+        assert isinstance(part.column("score"), np.memmap)
+
+def test_parts_are_appended_when_full(tmp_path: Path) -> None:
+    writer = ColumnarWriter(str(tmp_path), part_rows=3, compression="gzip")
+    for i in range(7):
+        writer.append("things", {}, [{"i": i}])
+    assert [part.rows for part in scan(str(tmp_path), "things")] == [3, 3]
+    writer.close()
+
+    assert sorted(load_columns(str(tmp_path), "things", ["i"])["i"].tolist()) == list(range(7))
+    assert writer.written == {"things": 7}
+
+def test_string_column_decodes_single_strings() -> None:
+    column = StringColumn(np.array([0, 1, 1, 3]), np.frombuffer("aé".encode(), dtype=np.uint8))
+    assert len(column) == 3
+    assert column[0] == "a" and column[1] == "" and column[-1] == "é"
+
+def test_reviews_and_reports_are_partitioned_by_review(tmp_path: Path) -> None:
+    export = ReviewExport(ColumnarWriter(str(tmp_path), part_rows=100, compression="gzip"))
+    april, may = 1680400000, 1683000000
+    reviews = [make_review("R1", april), make_review("R2", may), make_review("R3", april, AmazonRegion.COM)]
+    export.add_reviews(reviews)
+    export.add_reports([make_report("R1"), make_report("R2"), make_report("R9")], reviews)
+    export.close()
+
+    assert {tuple(part.partition.values()) for part in scan(str(tmp_path), "reviews")} == {("ca", "2023-04"), ("ca", "2023-05"), ("com", "2023-04")}
+    reviews_ca = load_columns(str(tmp_path), "reviews", ["review_id", "text", "attributes"], region="ca", month="2023-04")
+    assert reviews_ca["review_id"].tolist() == ["R1"]
+    assert reviews_ca["text"].tolist() == ["Review R1 é"] and reviews_ca["attributes"].tolist() == [{"Colour": "Black"}]
+
+    issues = load_columns(str(tmp_path), "issues", ["review_id", "text", "classification", "criticality"])
+    assert sorted(issues["review_id"].tolist()) == ["R1", "R1", "R2", "R2", "R9", "R9"]
+    assert sorted(zip(issues["text"].tolist(), issues["classification"].tolist()))[:2] == [("Broke", None)] * 2
+    assert [part.partition for part in scan(str(tmp_path), "keyframes", region="unknown")] == [{"region": "unknown", "month": "unknown"}]
+    assert len(load_columns(str(tmp_path), "reports", ["report_weight"])["report_weight"]) == 3
+
+def test_partial_parts_are_written_when_too_many_rows_wait(tmp_path: Path) -> None:
+    now = [0.0]
+    writer = ColumnarWriter(str(tmp_path), part_rows=100, compression="gzip", max_buffered_rows=5, flush_interval=60, clock=lambda: now[0])
+
+    for month in ["2023-01", "2023-02"]:
+        writer.append("things", {"month": month}, [{"i": 1}, {"i": 2}])
+    assert list(scan(str(tmp_path), "things")) == []
+
+    writer.append("things", {"month": "2023-03"}, [{"i": 3}])
+    assert sorted(part.rows for part in scan(str(tmp_path), "things")) == [1, 2, 2]
+    assert writer.buffered == 0
+
+    writer.append("things", {"month": "2023-03"}, [{"i": 4}])
+    now[0] += 60
+    writer.append("things", {"month": "2023-04"}, [{"i": 5}])
+    assert writer.written == {"things": 7}
+
+def test_idle_writers_write_waiting_rows(tmp_path: Path) -> None:
+    writer = ColumnarWriter(str(tmp_path), part_rows=100, compression="gzip", flush_interval=0.05)
+    writer.append("things", {}, [{"i": 1}])
+
+    for _ in range(200):
+        if list(scan(str(tmp_path), "things")):
+            break
+        time.sleep(0.01)
+    assert [part.rows for part in scan(str(tmp_path), "things")] == [1]
+    writer.close()
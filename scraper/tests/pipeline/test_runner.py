@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any
+import numpy as np
+import pytest
+
+import pipeline.runner as runner
+from analyzer.clustering import IssueClusterer, IssueClusterIndex
+from analyzer.report import Issue, Report
+from parsing.amazon import Review
+from pipeline.runner import Pipeline, analyze_each
+from pipeline.sink import JsonlSink
+from pipeline.stage import Emit, Stage
+from requester.amazon import AmazonRegion
+
+def make_review(product_id: str, i: int) -> Review:
+    return Review(author_id=None, author_name="Jane", author_image_url="", title="Title", text=f"Review {i}", date=0,
+        date_text="", review_id=f"{product_id}-{i}", attributes={}, verified_purchase=True, found_helpful_count=0,
+        is_top_positive_review=False, is_top_critical_review=False, images=[], country_reviewed_in="Canada",
+        region=AmazonRegion.CA, product_name=product_id, product_image_url=None, manufacturer_name=None, manufacturer_id=None)
+
+def parse(product: dict[str, Any]) -> list[Review]:
+    return [make_review(product["id"], i) for i in range(3)]
+
+def process_reviews(reviews: list[Review]) -> list[Report]:
+    if reviews[0].text == "Review 2":
+        raise ValueError("bad review")
+    return [Report(review_id=review.review_id, report_weight=1, reliability_keyframes=[], issues=[]) for review in reviews]
+
+def make_pipeline(tmp_path: Path, **kwargs: Any) -> Pipeline:
+    return Pipeline(JsonlSink(str(tmp_path)), lambda reviews: analyze_each(process_reviews, reviews), crawl_jobs=1, crawl_concurrency=1,
+        parse_workers=2, analyze_workers=1, queue_size=2, parse=parse, **kwargs)
+
+def read_lines(path: Path) -> list[Any]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_products_go_through_every_stage(tmp_path: Path) -> None:
+    pipeline = make_pipeline(tmp_path).start()
+    for product_id in ["A", "B", "C"]:
+        pipeline.add_product({"type": "amazon", "region": "ca", "id": product_id})
+    pipeline.finish()
+
+    reports = read_lines(tmp_path / "reports.jsonl")
+    assert sorted(report["review_id"] for report in reports) == ["A-0", "A-1", "B-0", "B-1", "C-0", "C-1"]
+    assert len(read_lines(tmp_path / "reviews.jsonl")) == 9
+
+    failed = read_lines(tmp_path / "failed_reviews.jsonl")
+    assert sorted(item["item"]["review_id"] for item in failed) == ["A-2", "B-2", "C-2"]
+    assert failed[0]["error"]["message"] == "bad review"
+    assert pipeline.parse_stage.processed == 3 and pipeline.analyze_stage.processed == 3
+
+def test_crawled_products_are_parsed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def crawl_pages(url: str, review_info: dict[str, Any], products_to_ignore: set[str], publish_callback: Any,
+            concurrency: int, seen_store: Any = None) -> set[str]:
+        for product_id in ["X", "Y"]:
+            publish_callback(json.dumps({**review_info, "id": product_id}), lambda: None)
+        return {"X", "Y"}
+    monkeypatch.setattr(runner, "crawl_pages", crawl_pages)
+
+    pipeline = make_pipeline(tmp_path).start()
+    pipeline.crawl("https://www.amazon.ca/s?k=mouse", {"type": "amazon", "region": "ca"})
+    pipeline.finish()
+
+    assert {review["product_name"] for review in read_lines(tmp_path / "reviews.jsonl")} == {"X", "Y"}
+    assert pipeline.crawl_stage.processed == 1
+
+def test_full_queue_holds_back_producers() -> None:
+    release = threading.Event()
+    handled: list[int] = []
+
+    def slow(item: int, emit: Emit) -> None:
+        release.wait()
+        handled.append(item)
+
+    stage = Stage("slow", slow, workers=1, queue_size=1).start()
+    stage.put(1) # Taken by the worker
+    stage.put(2) # Fills the queue
+
+    producer = threading.Thread(target=stage.put, args=(3,))
+    producer.start()
+    time.sleep(0.05)
+    assert producer.is_alive()
+
+    release.set()
+    producer.join(1)
+    stage.close()
+    assert stage.join(1)
+    assert handled == [1, 2, 3]
+    assert stage.backpressure_seconds >= 0.05
+
+def test_failures_do_not_stop_the_stage() -> None:
+    def handle(item: int, emit: Emit) -> None:
+        if item == 2:
+            raise ValueError("bad item")
+        emit(item)
+
+    results: list[int] = []
+    sink = Stage("sink", lambda item, emit: results.append(item), workers=1, queue_size=10).start()
+    stage = Stage("stage", handle, workers=2, queue_size=10, downstream=sink).start()
+    for item in range(4):
+        stage.put(item)
+    stage.close()
+
+    assert stage.join(1) and sink.join(1)
+    assert sorted(results) == [0, 1, 3]
+    assert (stage.processed, stage.failed) == (3, 1)
+
+def test_issues_are_clustered_per_product(tmp_path: Path) -> None:
+    def analyze(reviews: list[Review]) -> runner.AnalyzeResult:
+        return [Report(review.review_id, 1, [], [Issue(text="battery", classification=None, criticality=None, rel_timestamp=None,
+            frequency=None, image=None, resolution=None)]) for review in reviews], []
+
+    clusterer = IssueClusterer(lambda texts: np.ones((len(texts), 4)), lambda: IssueClusterIndex(4, threshold=0.9, bits=4, tables=2))
+    pipeline = Pipeline(JsonlSink(str(tmp_path)), analyze, crawl_jobs=1, crawl_concurrency=1, parse_workers=2, analyze_workers=1,
+        queue_size=2, parse=parse, clusterer=clusterer).start()
+    for product_id in ["A", "B"]:
+        pipeline.add_product({"type": "amazon", "region": "ca", "id": product_id})
+    pipeline.finish()
+
+    assert {(assignment["product_id"], assignment["cluster_id"]) for assignment in read_lines(tmp_path / "issue_assignments.jsonl")} \
+        == {("A", 0), ("B", 0)}
+    clusters = read_lines(tmp_path / "issue_clusters.jsonl")
+    assert sorted((cluster["product_id"], cluster["size"], cluster["classification"]) for cluster in clusters) \
+        == [("A", 3, "UNKNOWN_ISSUE"), ("B", 3, "UNKNOWN_ISSUE")]
@@ -0,0 +1,42 @@
+from requester.rate_limit import DomainRateLimiter, TokenBucket
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+def test_burst_then_paced() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, min_rate=0.1, max_rate=4, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+    assert clock.now == 0.5
+
+def test_captcha_slows_down_and_success_recovers() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, burst=1, min_rate=0.25, max_rate=1, clock=clock, sleep=clock.sleep)
+
+    bucket.record_captcha()
+    assert bucket.rate == 0.5
+    bucket.record_captcha()
+    bucket.record_captcha()
+    assert bucket.rate == 0.25
+
+    for _ in range(10):
+        bucket.record_success()
+    assert bucket.rate == 1
+
+def test_domains_are_independent() -> None:
+    clock = FakeClock()
+    limiter = DomainRateLimiter(rate=1, burst=1, min_rate=0.1, max_rate=1, clock=clock, sleep=clock.sleep)
+
+    limiter.record_captcha("www.amazon.com")
+    assert limiter.bucket("www.amazon.com").rate == 0.5
+    assert limiter.bucket("www.amazon.ca").rate == 1
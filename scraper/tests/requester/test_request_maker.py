@@ -0,0 +1,25 @@
+import pytest
+
+import requester.request_maker as request_maker
+from loadtest.recorded import RecordedSession
+from requester.session_pool import SessionPool
+
+class CountingLimiter:
+    def __init__(self, pool: SessionPool) -> None:
+        self.pool = pool
+        self.available_while_waiting: list[int] = []
+
+    def acquire(self, domain: str) -> None:
+        self.available_while_waiting.append(self.pool.available_count())
+
+    def record_success(self, domain: str) -> None:
+        pass
+
+def test_sessions_are_checked_out_after_the_rate_limiter(monkeypatch: pytest.MonkeyPatch) -> None:
+    pool = SessionPool(1, lambda: RecordedSession({"https://www.amazon.ca/": "<html></html>"}))
+    limiter = CountingLimiter(pool)
+    monkeypatch.setattr(request_maker, "session_pool", pool)
+    monkeypatch.setattr(request_maker, "rate_limiter", limiter)
+
+    assert request_maker.request_page("https://www.amazon.ca/") == "<html></html>"
+    assert limiter.available_while_waiting == [1]
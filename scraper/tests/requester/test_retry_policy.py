@@ -0,0 +1,76 @@
+import random
+import pytest
+
+from requester.retry_policy import CircuitBreaker, CircuitOpenError, CircuitState, RetryBudget, \
+    RetryBudgetExhaustedError, RetryPolicy, call_with_retry
+
+class Flaky:
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise IOError("failed")
+        return "ok"
+
+def test_backoff_is_capped_and_jittered() -> None:
+    policy = RetryPolicy(tries=10, base_delay=1, max_delay=8)
+    rng = random.Random(1)
+
+    delays = [policy.backoff(n, rng) for n in range(10)]
+    assert all(0 <= delay <= min(8, 2 ** n) for n, delay in enumerate(delays))
+    assert len(set(delays)) == len(delays)
+
+def test_retries_until_success() -> None:
+    sleeps: list[float] = []
+    fn = Flaky(2)
+
+    assert call_with_retry(fn, RetryPolicy(tries=3, base_delay=1, max_delay=8), IOError, sleep=sleeps.append) == "ok"
+    assert fn.calls == 3
+    assert len(sleeps) == 2
+
+def test_budget_is_shared_across_calls() -> None:
+    budget = RetryBudget(1)
+    policy = RetryPolicy(tries=5, base_delay=0, max_delay=0)
+
+    call_with_retry(Flaky(1), policy, IOError, budget=budget, sleep=lambda _: None)
+    with pytest.raises(RetryBudgetExhaustedError):
+        call_with_retry(Flaky(1), policy, IOError, budget=budget, sleep=lambda _: None)
+
+def test_circuit_opens_and_recovers() -> None:
+    now = [0.0]
+    breaker = CircuitBreaker("com", failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    policy = RetryPolicy(tries=2, base_delay=0, max_delay=0)
+
+    with pytest.raises(IOError):
+        call_with_retry(Flaky(5), policy, IOError, breaker=breaker, sleep=lambda _: None)
+    assert breaker.state == CircuitState.OPEN
+
+    fn = Flaky(0)
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(fn, policy, IOError, breaker=breaker)
+    assert fn.calls == 0
+
+    now[0] = 31
+    assert call_with_retry(fn, policy, IOError, breaker=breaker) == "ok"
+    assert breaker.state == CircuitState.CLOSED
+
+def test_unexpected_errors_of_the_trial_call_reopen_the_circuit() -> None:
+    now = [0.0]
+    breaker = CircuitBreaker("com", failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+    policy = RetryPolicy(tries=2, base_delay=0, max_delay=0)
+    breaker.record_failure()
+
+    def dns_error() -> str:
+        # Like curl_cffi's DNSError, which is not a RequestError
+        raise RuntimeError("could not resolve host")
+
+    now[0] = 31
+    with pytest.raises(RuntimeError):
+        call_with_retry(dns_error, policy, IOError, breaker=breaker)
+    assert breaker.state == CircuitState.OPEN
+
+    now[0] = 62
+    assert call_with_retry(Flaky(0), policy, IOError, breaker=breaker) == "ok"
@@ -0,0 +1,34 @@
+from typing import Any
+from requester.session_pool import SessionPool
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.cookies: dict[str, Any] = {"session-id": "1"}
+
+def test_round_robin_with_proxies() -> None:
+    pool = SessionPool(size=3, session_factory=FakeSession, proxies=["http://a", "http://b"])
+
+    proxies = []
+    for _ in range(3):
+        with pool.session() as pooled:
+            proxies.append(pooled.proxy)
+
+    assert proxies == ["http://a", "http://b", "http://a"]
+
+def test_retire_only_affects_one_session() -> None:
+    now = [0.0]
+    pool = SessionPool(size=2, session_factory=FakeSession, cooldown=60, clock=lambda: now[0])
+
+    with pool.session() as pooled:
+        pool.retire(pooled)
+        retired = pooled
+
+    assert retired.session.cookies == {}
+    assert pool.available_count() == 1
+    assert pool.sessions[1].session.cookies
+
+    with pool.session() as pooled:
+        assert pooled is not retired
+
+    now[0] = 61
+    assert pool.available_count() == 2
@@ -0,0 +1,84 @@
+import os
+import urllib.request
+
+import pytest
+
+from utils.metrics import MetricsServer, Registry, TextfileWriter
+
+def test_counters_and_gauges_render_in_text_format() -> None:
+    registry = Registry()
+    messages = registry.counter("messages_total", "Messages handled", ("queue", "outcome"))
+    messages.inc(labels=("parse", "processed"))
+    messages.inc(2, labels=("parse", "processed"))
+    busy = registry.gauge("workers_busy", "Busy workers")
+    with busy.track_in_progress():
+        busy.inc()
+        assert busy.value() == 2
+    busy.set(1.5)
+
+    assert registry.render() == (
+        '# HELP messages_total Messages handled\n'
+        '# TYPE messages_total counter\n'
+        'messages_total{queue="parse",outcome="processed"} 3\n'
+        '# HELP workers_busy Busy workers\n'
+        '# TYPE workers_busy gauge\n'
+        'workers_busy 1.5\n'
+    )
+
+def test_histogram_buckets_are_cumulative() -> None:
+    registry = Registry()
+    latency = registry.histogram("request_seconds", "Latency", ("domain",), buckets=(0.1, 1))
+    for value in [0.05, 0.1, 0.5, 3]:
+        latency.observe(value, ("www.amazon.ca",))
+
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'request_seconds_bucket{domain="www.amazon.ca",le="0.1"} 2',
+        'request_seconds_bucket{domain="www.amazon.ca",le="1"} 3',
+        'request_seconds_bucket{domain="www.amazon.ca",le="+Inf"} 4',
+        'request_seconds_sum{domain="www.amazon.ca"} 3.65',
+        'request_seconds_count{domain="www.amazon.ca"} 4',
+    ]
+    assert latency.count(("www.amazon.ca",)) == 4
+
+def test_function_metrics_are_read_when_rendered() -> None:
+    registry = Registry()
+    values = {"published": 1}
+    published = registry.counter_function("published_total", "Published", ("state",))
+    published.track(lambda: values["published"], ("published",))
+    published.track(lambda: 1 / 0, ("broken",))
+    values["published"] = 5
+
+    assert 'published_total{state="published"} 5' in registry.render()
+    assert "broken" not in registry.render()
+
+def test_labels_are_checked_and_escaped() -> None:
+    registry = Registry()
+    counter = registry.counter("errors_total", "Errors", ("reason",))
+    with pytest.raises(ValueError):
+        counter.inc(labels=())
+    with pytest.raises(ValueError):
+        registry.gauge("errors_total", "Errors")
+
+    counter.inc(labels=('say "hi"\n',))
+    assert 'errors_total{reason="say \\"hi\\"\\n"} 1' in registry.render()
+    assert registry.counter("errors_total", "Errors", ("reason",)) is counter
+
+def test_server_and_textfile_export(tmp_path: str) -> None:
+    registry = Registry()
+    registry.counter("requests_total", "Requests").inc()
+
+    server = MetricsServer(0, host="127.0.0.1", metrics=registry)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "requests_total 1" in response.read().decode()
+    finally:
+        server.close()
+
+    path = os.path.join(tmp_path, "scraper.prom")
+    writer = TextfileWriter(path, interval=60, metrics=registry)
+    writer.close()
+    with open(path) as f:
+        assert "requests_total 1" in f.read()
+    assert os.listdir(tmp_path) == ["scraper.prom"]
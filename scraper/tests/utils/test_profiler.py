@@ -0,0 +1,44 @@
+import os
+import threading
+
+from utils.profiler import SamplingProfiler
+
+def busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_samples_stacks_of_other_threads(tmp_path: str) -> None:
+    stop = threading.Event()
+    workers = [threading.Thread(target=busy_loop, args=(stop,), name=f"parse-worker_{i}") for i in range(2)]
+    for worker in workers:
+        worker.start()
+
+    profiler = SamplingProfiler(interval=0.001)
+    try:
+        for _ in range(20):
+            profiler.sample()
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+    assert profiler.samples == 20
+    worker_stacks = {stack: count for stack, count in profiler.stacks.items() if stack.startswith("parse-worker_N;")}
+    assert sum(worker_stacks.values()) == 40
+    assert all("busy_loop (tests/utils/test_profiler.py:6)" in stack for stack in worker_stacks)
+    assert not any("sample (utils/profiler.py" in stack for stack in profiler.stacks)
+
+    collapsed_path, summary_path = profiler.write(os.path.join(tmp_path, "profiles"), "parser")
+    with open(collapsed_path) as f:
+        lines = f.read().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sum(profiler.stacks.values())
+    with open(summary_path) as f:
+        summary = f.read()
+    assert summary.startswith("20 samples of")
+    assert "busy_loop (tests/utils/test_profiler.py:6)" in summary
+
+def test_run_stops_after_duration() -> None:
+    profiler = SamplingProfiler(interval=0.01)
+    profiler.run(0.05)
+    assert 1 <= profiler.samples <= 5
+    assert profiler.stopped_at - profiler.started_at >= 0.05
@@ -0,0 +1,37 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+from utils.metrics import MetricsServer, Registry
+from utils.readiness import Readiness, ServiceState
+
+def test_readiness_file_only_exists_while_ready(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, "ready")
+    readiness = Readiness(path)
+
+    readiness.set(ServiceState.WARMING_UP)
+    assert not readiness.ready and not os.path.exists(path)
+    readiness.set(ServiceState.READY)
+    with open(path) as f:
+        assert json.load(f)["state"] == "ready"
+    readiness.set(ServiceState.STOPPING)
+    assert os.listdir(tmp_path) == []
+
+def test_ready_endpoint_follows_the_state() -> None:
+    readiness = Readiness()
+    server = MetricsServer(0, host="127.0.0.1", metrics=Registry(), readiness=readiness)
+    url = f"http://127.0.0.1:{server.port}/ready"
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url)
+        assert error.value.code == 503
+        assert json.loads(error.value.read())["state"] == "starting"
+
+        readiness.set(ServiceState.READY)
+        with urllib.request.urlopen(url) as response:
+            assert json.loads(response.read())["state"] == "ready"
+    finally:
+        server.close()
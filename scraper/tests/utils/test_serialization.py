@@ -0,0 +1,112 @@
+import dataclasses
+import json
+import attr
+import pytest
+
+from analyzer.report import Issue, Keyframe, Report
+from parsing.amazon import Review, review_schema
+from requester.amazon import AmazonRegion
+from utils import class_to_json
+from utils import serialization
+from utils.serialization import SchemaError
+
+def make_review(**overrides: object) -> Review:
+    fields = dict(
+        author_id="AE2XYZ",
+        author_name="Jane",
+        author_image_url="https://images.example/jane.png",
+        title="Broke after a month",
+        text="The left click stopped working after a month.",
+        date=1672531200,
+        date_text="Reviewed in Canada on January 1, 2023",
+        review_id="R1",
+        attributes={"Colour": "Black"},
+        verified_purchase=True,
+        found_helpful_count=3,
+        is_top_positive_review=False,
+        is_top_critical_review=True,
+        images=["https://images.example/1.png"],
+        country_reviewed_in="Canada",
+        region=AmazonRegion.CA,
+        product_name="Razer Viper Mini",
+        product_image_url=None,
+        manufacturer_name="Razer",
+        manufacturer_id="razer"
+    )
+    fields.update(overrides)
+    return Review(**fields) # type: ignore
+
+report = Report(
+    review_id="R1",
+    report_weight=0.5,
+    reliability_keyframes=[Keyframe(rel_timestamp=1675209600, text="after a month", time_start=4, time_end=17, sentiment=-0.4)],
+    issues=[Issue(text="The left click stopped working", classification="Hardware", criticality=0.8,
+        rel_timestamp=1675209600, frequency=None, image=None, resolution=None)]
+)
+
+def test_review_round_trip() -> None:
+    review = make_review()
+    assert serialization.loads(Review, serialization.dumps([review])) == [review]
+
+def test_report_round_trip() -> None:
+    assert serialization.loads(Report, serialization.dumps([report])) == [report]
+
+def test_matches_legacy_encoding() -> None:
+    review = make_review()
+    expected = json.loads(json.dumps([{**attr.asdict(review), "region": "ca"}, dataclasses.asdict(report)]))
+    assert json.loads(class_to_json([review, report])) == expected
+    assert serialization.to_primitive([review, report]) == expected
+
+def test_decodes_reviews_from_the_server() -> None:
+    data = serialization.to_primitive(make_review())
+    data.update(date="2023-01-01T00:00:00.000Z", author_image_url=None,
+        images=[{"id": "clx", "image_url": "https://images.example/1.png", "reviewId": "cly"}], product={"name": "Razer Viper Mini"})
+    del data["product_image_url"]
+
+    assert review_schema.from_primitive(data) == make_review(author_image_url="")
+
+def test_optional_fields_default_to_none() -> None:
+    keyframe = serialization.from_primitive(Keyframe, {"rel_timestamp": 1, "text": "a", "time_start": 0, "time_end": 1, "sentiment": 0})
+    assert keyframe.interp is None
+    assert keyframe.sentiment == 0.0 and isinstance(keyframe.sentiment, float)
+
+@pytest.mark.parametrize("change, path, reason", [
+    ({"found_helpful_count": "3"}, "Review.found_helpful_count", "expected int, got str ('3')"),
+    ({"verified_purchase": 1}, "Review.verified_purchase", "expected bool, got int (1)"),
+    ({"region": "de"}, "Review.region", "'de' is not a valid AmazonRegion"),
+    ({"attributes": {"Colour": 1}}, "Review.attributes['Colour']", "expected str, got int (1)"),
+    ({"images": ["a", None]}, "Review.images[1]", "expected str, got NoneType (None)"),
+])
+def test_validation_errors_name_the_field(change: dict, path: str, reason: str) -> None:
+    data = serialization.to_primitive(make_review())
+    data.update(change)
+    with pytest.raises(SchemaError) as error:
+        serialization.from_primitive(Review, data)
+    assert error.value.path == path
+    assert error.value.reason == reason
+
+def test_nested_validation_errors() -> None:
+    data = serialization.to_primitive([report, report])
+    data[1]["issues"][0]["criticality"] = "high"
+    with pytest.raises(SchemaError, match=r"^Report\[1\]\.issues\[0\]\.criticality: expected float"):
+        serialization.from_primitive_list(Report, data)
+
+def test_missing_required_field() -> None:
+    data = serialization.to_primitive(report)
+    del data["review_id"]
+    with pytest.raises(SchemaError, match="Report.review_id: missing required field"):
+        serialization.from_primitive(Report, data)
+
+def test_bad_date_is_a_schema_error() -> None:
+    data = serialization.to_primitive(make_review())
+    data["date"] = "not a date"
+    with pytest.raises(SchemaError, match="Review.date: could not convert"):
+        review_schema.from_primitive(data)
+
+def test_records_are_slotted_and_share_repeated_strings() -> None:
+    first = serialization.from_primitive(Review, serialization.to_primitive(make_review()))
+    second = serialization.from_primitive(Review, serialization.to_primitive(make_review()))
+
+    assert not hasattr(first, "__dict__") and not hasattr(report, "__dict__")
+    assert first.product_name is second.product_name
+    assert list(first.attributes)[0] is list(second.attributes)[0]
@@ -1,12 +1,25 @@
-from enum import Enum
-import json
+import sys
 from typing import Any
+from utils.serialization import dumps, to_primitive
 
 
 def class_to_json(obj: Any) -> str:
-    return json.dumps(obj, default=__process_obj)
+    return dumps(obj).decode()
 
-def __process_obj(obj: Any) -> Any:
-    if isinstance(obj, Enum):
-            return obj.value
-    return obj.__dict__ if hasattr(obj, "__dict__") else obj
\ No newline at end of file
+def class_to_primitive(obj: Any) -> Any:
+    """
+    Converts records to plain dicts and lists through their generated schemas, see utils.serialization.
+    """
+    return to_primitive(obj)
+
+def intern_str(value: Any) -> Any:
+    """
+    Interns strings that repeat across many records, e.g. product and manufacturer names, so they share one copy.
+    Other values are returned unchanged.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+def intern_dict(value: Any) -> Any:
+    if not isinstance(value, dict):
+        return value
+    return {intern_str(key): intern_str(item) for key, item in value.items()}
@@ -0,0 +1,36 @@
+"""
+Compression codecs by content encoding name, shared by the queue envelopes and the columnar export.
+zstd needs the optional zstandard package.
+"""
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # type: ignore
+
+def compress(data: bytes, encoding: str | None) -> bytes:
+    match encoding:
+        case None | "" | "identity":
+            return data
+        case "gzip":
+            return gzip.compress(data, compresslevel=6)
+        case "zstd":
+            if not zstandard:
+                raise ValueError("zstd compression needs the zstandard package")
+            return zstandard.ZstdCompressor().compress(data)
+        case _:
+            raise ValueError(f"Unknown content encoding {encoding}")
+
+def decompress(data: bytes, encoding: str | None) -> bytes:
+    match encoding:
+        case None | "" | "identity":
+            return data
+        case "gzip":
+            return gzip.decompress(data)
+        case "zstd":
+            if not zstandard:
+                raise ValueError("zstd compressed data received, but the zstandard package is not installed")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        case _:
+            raise ValueError(f"Unknown content encoding {encoding}")
@@ -11,7 +11,84 @@ defaults = {
     "QUEUE_PREFETCH_COUNT": "10",
     "TRAINING_MODE": "false",
     "QUEUE_HOST": "localhost",
-    "QUEUE_PORT": "5673"
+    "QUEUE_PORT": "5673",
+    "REQUEST_SESSION_POOL_SIZE": "4",
+    "REQUEST_IMPERSONATE": "chrome107",
+    "REQUEST_RATE_PER_SECOND": "1",
+    "REQUEST_MIN_RATE_PER_SECOND": "0.05",
+    "REQUEST_MAX_RATE_PER_SECOND": "4",
+    "REQUEST_BURST": "2",
+    "REQUEST_SESSION_COOLDOWN_SECONDS": "300",
+    "REQUEST_RETRY_TRIES": "6",
+    "REQUEST_RETRY_BASE_DELAY": "1",
+    "REQUEST_RETRY_MAX_DELAY": "60",
+    "REQUEST_RETRY_BUDGET": "50",
+    "REQUEST_BREAKER_FAILURE_THRESHOLD": "10",
+    "REQUEST_BREAKER_RESET_SECONDS": "120",
+    "CRAWLER_PAGE_CONCURRENCY": "4",
+    "CRAWLER_MAX_JOBS": "2",
+    "CRAWLER_SEEN_PRODUCTS_DIR": "seen_products",
+    "CRAWLER_DEDUPE_TTL_HOURS": "168",
+    "PUBLISH_BATCH_SIZE": "100",
+    "PUBLISH_FLUSH_INTERVAL": "0.2",
+    "PUBLISH_MAX_IN_FLIGHT": "1000",
+    "FLOW_CHECK_INTERVAL": "5",
+    "FLOW_PARSE_HIGH_WATER": "5000",
+    "FLOW_PARSE_LOW_WATER": "1000",
+    "FLOW_TO_ANALYZE_HIGH_WATER": "1000",
+    "FLOW_TO_ANALYZE_LOW_WATER": "200",
+    "ANALYZER_MAX_RETRIES": "3",
+    "PARSER_MAX_RETRIES": "3",
+    "QUEUE_ENVELOPE_QUEUES": "to_analyze",
+    "QUEUE_COMPRESSION": "gzip",
+    "QUEUE_CHUNK_BYTES": "4000000",
+    "PIPELINE_OUTPUT_DIR": "results/pipeline",
+    "PIPELINE_QUEUE_SIZE": "20",
+    "PIPELINE_ANALYZE_WORKERS": "1",
+    "METRICS_PORT": "0",
+    "METRICS_TEXTFILE": "",
+    "METRICS_TEXTFILE_INTERVAL": "15",
+    "ANALYZER_CLASSIFIER_CACHE_SIZE": "10000",
+    "PROFILE_DIR": "results/profiles",
+    "PROFILE_INTERVAL": "0.01",
+    "PROFILE_ON_START_SECONDS": "0",
+    "ANALYZER_MAX_VOCAB_GROWTH": "200000",
+    "ANALYZER_MAX_RSS_MB": "0",
+    "ANALYZER_JVM_MAX_HEAP": "1g",
+    "ANALYZER_PUBLISH_AGGREGATES": "false",
+    "ANALYZER_AGGREGATE_BIN_DAYS": "30",
+    "ANALYZER_CLUSTER_SIMILARITY": "0.8",
+    "ANALYZER_CLUSTER_HASH_BITS": "10",
+    "ANALYZER_CLUSTER_HASH_TABLES": "10",
+    "ANALYZER_CLUSTER_MIN_SIZE": "2",
+    "PIPELINE_CLUSTER_ISSUES": "true",
+    "EXPORT_DIR": "",
+    "EXPORT_PART_ROWS": "10000",
+    "EXPORT_COMPRESSION": "gzip",
+    "EXPORT_MAX_BUFFERED_ROWS": "50000",
+    "EXPORT_FLUSH_INTERVAL": "600",
+    "REPORT_SINK_URL": "",
+    "REPORT_SINK_BATCH_SIZE": "500",
+    "REPORT_SINK_FLUSH_INTERVAL": "2",
+    "REPORT_SINK_MAX_ATTEMPTS": "3",
+    "QUEUE_MAX_PRIORITY": "0",
+    "QUEUE_LOOKAHEAD_PARSE": "10",
+    "QUEUE_LOOKAHEAD_TO_ANALYZE": "2",
+    "READINESS_FILE": "",
+    "ANALYZER_WARMUP_CORPUS": "",
+    "ANALYZER_WARMUP_REVIEWS": "20",
+    "ANALYZER_WARMUP_MAX_SECONDS": "120",
+    "SCRAPER_WARMUP_URLS": "",
+    "ANALYZER_TRACE_SAMPLE_RATE": "0",
+    "ANALYZER_TRACE_DIR": "results/traces",
+    "ANALYZER_TRACE_BUFFER": "1000",
+    "ANALYZER_TRACE_FILE_MB": "64",
+    "ANALYZER_TRACE_FILES": "10",
+    "ANALYZER_NLP_MODEL": "en_core_web_lg",
+    "ANALYZER_CASCADE": "false",
+    "ANALYZER_CASCADE_SMALL_MODEL": "en_core_web_sm",
+    "ANALYZER_CASCADE_MARGIN": "0.05",
+    "ANALYZER_CASCADE_AUDIT_RATE": "0.01"
 }
 
 def get_env(name: str) -> str:
@@ -24,5 +101,11 @@ def get_env(name: str) -> str:
 def get_env_int(name: str) -> int:
     return int(get_env(name))
 
+def get_env_float(name: str) -> float:
+    return float(get_env(name))
+
+def get_env_list(name: str) -> list[str]:
+    return [item.strip() for item in get_env(name).split(",") if item.strip()]
+
 def get_env_bool(name: str) -> bool:
     return get_env(name).lower() in ["true", "1", "yes", "y", "t"]
\ No newline at end of file
@@ -0,0 +1,316 @@
+"""
+Counters, gauges and histograms exported in the Prometheus text format, either over HTTP or to a textfile
+for the node exporter's textfile collector.
+
+Updates only take a lock and add to a number, so metrics stay on in production. Values that components already
+count themselves (publisher confirms, retry stats, ...) are read through functions when the metrics are exported.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterator, TypeVar
+
+from utils.env import get_env, get_env_float, get_env_int
+from utils.readiness import Readiness, readiness as service_readiness
+
+Labels = tuple[str, ...]
+Sample = tuple[str, Labels, float]
+M = TypeVar("M", bound="Metric")
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def samples(self) -> list[Sample]:
+        raise NotImplementedError
+
+    def _check(self, labels: Labels) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.__values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        with self._lock:
+            if labels not in self.__values:
+                self._check(labels)
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self.__values.get(labels, 0)
+
+    def samples(self) -> list[Sample]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self.__values.items()]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.__values: dict[Labels, float] = {}
+
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self._check(labels)
+        with self._lock:
+            self.__values[labels] = value
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        with self._lock:
+            if labels not in self.__values:
+                self._check(labels)
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, labels: Labels = ()) -> None:
+        self.inc(-amount, labels)
+
+    @contextmanager
+    def track_in_progress(self, labels: Labels = ()) -> Iterator[None]:
+        self.inc(1, labels)
+        try:
+            yield
+        finally:
+            self.dec(1, labels)
+
+    def value(self, labels: Labels = ()) -> float:
+        return self.__values.get(labels, 0)
+
+    def samples(self) -> list[Sample]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self.__values.items()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = (), buckets: tuple[float, ...] = default_buckets) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: observations per bucket (the last one is +Inf), and their sum
+        self.__counts: dict[Labels, list[int]] = {}
+        self.__sums: dict[Labels, float] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.__counts.get(labels)
+            if counts is None:
+                self._check(labels)
+                counts = self.__counts[labels] = [0] * (len(self.buckets) + 1)
+                self.__sums[labels] = 0
+            counts[index] += 1
+            self.__sums[labels] += value
+
+    @contextmanager
+    def time(self, labels: Labels = ()) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def count(self, labels: Labels = ()) -> int:
+        return sum(self.__counts.get(labels, ()))
+
+    def samples(self) -> list[Sample]:
+        samples: list[Sample] = []
+        with self._lock:
+            for labels, counts in self.__counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", labels + (format_value(bound),), cumulative))
+                samples.append((f"{self.name}_sum", labels, self.__sums[labels]))
+                samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class FunctionMetric(Metric):
+    """
+    Reads its values from functions when exported, for numbers that are already counted elsewhere.
+    Each label set has its own function, tracking the same labels again replaces it.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Labels = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.__functions: dict[Labels, Callable[[], float]] = {}
+
+    def track(self, function: Callable[[], float], labels: Labels = ()) -> None:
+        self._check(labels)
+        with self._lock:
+            self.__functions[labels] = function
+
+    def samples(self) -> list[Sample]:
+        with self._lock:
+            functions = list(self.__functions.items())
+        samples: list[Sample] = []
+        for labels, function in functions:
+            try:
+                samples.append((self.name, labels, float(function())))
+            except Exception as e:
+                print(f"Failed to read metric {self.name}{labels}: {e!r}")
+        return samples
+
+class Registry:
+    def __init__(self) -> None:
+        self.__metrics: dict[str, Metric] = {}
+        self.__lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Labels = ()) -> Counter:
+        return self.__get_or_create(Counter, name, lambda: Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Labels = ()) -> Gauge:
+        return self.__get_or_create(Gauge, name, lambda: Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Labels = (), buckets: tuple[float, ...] = default_buckets) -> Histogram:
+        return self.__get_or_create(Histogram, name, lambda: Histogram(name, documentation, labelnames, buckets))
+
+    def counter_function(self, name: str, documentation: str, labelnames: Labels = ()) -> FunctionMetric:
+        return self.__get_or_create(FunctionMetric, name, lambda: FunctionMetric(name, documentation, "counter", labelnames))
+
+    def gauge_function(self, name: str, documentation: str, labelnames: Labels = ()) -> FunctionMetric:
+        return self.__get_or_create(FunctionMetric, name, lambda: FunctionMetric(name, documentation, "gauge", labelnames))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+
+        lines: list[str] = []
+        for metric in metrics:
+            samples = metric.samples()
+            lines.append(f"# HELP {metric.name} {escape(metric.documentation, help_text=True)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            labelnames = metric.labelnames + (("le",) if isinstance(metric, Histogram) else ())
+            for name, labels, value in samples:
+                label_text = ",".join(f'{label}="{escape(value)}"' for label, value in zip(labelnames, labels))
+                lines.append(f"{name}{{{label_text}}} {format_value(value)}" if label_text else f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def __get_or_create(self, cls: type[M], name: str, create: Callable[[], M]) -> M:
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = self.__metrics[name] = create()
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+registry = Registry()
+registry.gauge_function("scraper_ready", "1 while the service is ready and consuming messages").track(
+    lambda: float(service_readiness.ready))
+
+def escape(value: str, help_text: bool = False) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value if help_text else value.replace('"', '\\"')
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+class MetricsServer:
+    """
+    Serves the registry on GET /metrics from a daemon thread, and the readiness of the service on GET /ready:
+    200 once it is ready, 503 while it is starting, warming up or stopping.
+    """
+
+    def __init__(self, port: int, host: str = "", metrics: Registry = registry, readiness: Readiness = service_readiness) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                match self.path.split("?")[0]:
+                    case "/metrics":
+                        status, body, body_type = 200, metrics.render().encode(), content_type
+                    case "/ready":
+                        status, body, body_type = 200 if readiness.ready else 503, json.dumps(readiness.describe()).encode(), \
+                            "application/json"
+                    case _:
+                        self.send_error(404)
+                        return
+                self.send_response(status)
+                self.send_header("Content-Type", body_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.__thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.__thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+class TextfileWriter:
+    """
+    Writes the registry to a file every interval seconds. The file is replaced atomically,
+    so the node exporter never reads a half written file.
+    """
+
+    def __init__(self, path: str, interval: float, metrics: Registry = registry) -> None:
+        self.path = path
+        self.interval = interval
+        self.__metrics = metrics
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="metrics-textfile", daemon=True)
+        self.__thread.start()
+
+    def write(self) -> None:
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.__metrics.render())
+        os.replace(temporary, self.path)
+
+    def close(self) -> None:
+        self.__stopped.set()
+        self.__thread.join()
+        self.write()
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Failed to write metrics to {self.path}: {e}")
+
+def start_metrics_exporter() -> MetricsServer | TextfileWriter | None:
+    """
+    Starts exporting the registry as configured through METRICS_PORT or METRICS_TEXTFILE, if either is set.
+    """
+    port = get_env_int("METRICS_PORT")
+    path = get_env("METRICS_TEXTFILE")
+    if port > 0:
+        print(f"Serving metrics on port {port}")
+        return MetricsServer(port)
+    if path:
+        print(f"Writing metrics to {path}")
+        return TextfileWriter(path, get_env_float("METRICS_TEXTFILE_INTERVAL"))
+    return None
@@ -0,0 +1,142 @@
+"""
+Sampling profiler for live listeners. A background thread reads the stacks of all other threads with
+sys._current_frames every interval seconds, so the profiled code is not slowed down by tracing hooks.
+
+Results are written as collapsed stacks, the input format of flamegraph.pl and speedscope, and as a summary of
+the time spent in and below each function.
+"""
+from collections import Counter
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+from types import CodeType, FrameType
+from typing import Callable
+
+stdlib_path = sysconfig.get_paths()["stdlib"]
+
+class SamplingProfiler:
+    """
+    Counts how often each stack is seen. Stacks are rooted at the name of their thread, with numbers replaced by N
+    so the threads of one pool are merged, e.g. parse-worker_N.
+    """
+
+    def __init__(self, interval: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self.stacks: Counter[str] = Counter()
+        self.__clock = clock
+        self.__labels: dict[CodeType, str] = {}
+        self.__stopped = threading.Event()
+
+    def run(self, seconds: float) -> None:
+        """
+        Samples on the calling thread until seconds have passed or stop is called.
+        """
+        self.started_at = self.__clock()
+        deadline = self.started_at + seconds
+        while not self.__stopped.wait(self.interval) and self.__clock() < deadline:
+            self.sample()
+        self.stopped_at = self.__clock()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack = []
+            current: FrameType | None = frame
+            while current is not None:
+                stack.append(self.__label(current.f_code))
+                current = current.f_back
+            stack.append(re.sub(r"\d+", "N", names.get(ident, "unknown")))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, limit: int = 100) -> str:
+        """
+        Samples per function: total counts every stack the function is on, self only the stacks it is running in.
+        """
+        total: Counter[str] = Counter()
+        own: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            for function in set(frames):
+                total[function] += count
+            own[frames[-1]] += count
+
+        seen = sum(self.stacks.values()) or 1
+        lines = [f"{self.samples} samples of {len(self.__threads())} threads every {self.interval * 1000:.0f}ms "
+            f"over {self.stopped_at - self.started_at:.1f}s",
+            f"{'total':>8}{'self':>8}  function"]
+        for function, count in total.most_common(limit):
+            lines.append(f"{count / seen:>8.1%}{own[function] / seen:>8.1%}  {function}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str, name: str) -> tuple[str, str]:
+        """
+        Writes <name>.collapsed and <name>.txt to the directory and returns their paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        collapsed_path = os.path.join(directory, f"{name}.collapsed")
+        summary_path = os.path.join(directory, f"{name}.txt")
+        with open(collapsed_path, "w") as f:
+            f.write(self.collapsed())
+        with open(summary_path, "w") as f:
+            f.write(self.summary())
+        return collapsed_path, summary_path
+
+    def __threads(self) -> set[str]:
+        return {stack.split(";", 1)[0] for stack in self.stacks}
+
+    def __label(self, code: CodeType) -> str:
+        label = self.__labels.get(code)
+        if label is None:
+            path = code.co_filename
+            if "site-packages" + os.sep in path:
+                path = path.split("site-packages" + os.sep, 1)[1]
+            elif path.startswith(stdlib_path):
+                path = os.path.relpath(path, stdlib_path)
+            elif path.startswith(os.getcwd()):
+                path = os.path.relpath(path)
+            label = self.__labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ",")
+        return label
+
+__running_lock = threading.Lock()
+
+def profile_in_background(seconds: float, directory: str, name: str, interval: float) -> bool:
+    """
+    Profiles the process for the given duration on a background thread and writes the results to the directory.
+    Returns False without profiling if a profile is already being taken.
+    """
+    if not __running_lock.acquire(blocking=False):
+        return False
+
+    def run() -> None:
+        try:
+            profiler = SamplingProfiler(interval)
+            profiler.run(seconds)
+            paths = profiler.write(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+            print(f"Profiled {profiler.samples} samples over {seconds:.0f}s, written to {', '.join(paths)}")
+        except Exception as e:
+            print(f"Failed to profile: {e!r}")
+        finally:
+            __running_lock.release()
+
+    print(f"Profiling for {seconds:.0f}s")
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+    return True
@@ -0,0 +1,60 @@
+"""
+Readiness of a service for orchestrators and rolling deploys. A service is starting while it loads and warms up,
+ready once it consumes messages, and stopping after that. Probes read it from GET /ready on the metrics port,
+or from READINESS_FILE, which only exists while the service is ready.
+"""
+from enum import Enum
+import json
+import os
+import threading
+import time
+
+from utils.env import get_env
+
+class ServiceState(str, Enum):
+    STARTING = "starting"
+    WARMING_UP = "warming_up"
+    READY = "ready"
+    STOPPING = "stopping"
+
+class Readiness:
+    """
+    Current state of the service, and the time it entered it. Thread safe.
+    """
+
+    def __init__(self, path: str = "") -> None:
+        self.path = path
+        self.state = ServiceState.STARTING
+        self.since = time.time()
+        self.__lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == ServiceState.READY
+
+    def set(self, state: ServiceState) -> None:
+        with self.__lock:
+            self.state = state
+            self.since = time.time()
+            if self.path:
+                self.__write()
+        print(f"Service is {state.value}")
+
+    def describe(self) -> dict[str, str | float]:
+        return {"state": self.state.value, "since": self.since, "pid": os.getpid()}
+
+    def __write(self) -> None:
+        try:
+            if self.state != ServiceState.READY:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            # Replaced atomically, so a probe never reads a half written file
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(self.describe(), f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Failed to update readiness file {self.path}: {e}")
+
+readiness = Readiness(get_env("READINESS_FILE"))
@@ -0,0 +1,406 @@
+"""
+Schemas for the record classes (attrs and stdlib dataclasses), generated once per class from their type annotations.
+
+Encoding walks a precompiled list of fields instead of reflecting on every object, and decoding validates
+every field against its annotation, failing with a SchemaError naming the path of the bad value.
+JSON is encoded with orjson when it is installed, with the standard library json module otherwise.
+"""
+from dataclasses import is_dataclass
+from enum import Enum
+import inspect
+import json
+import threading
+import types
+import typing
+from typing import Any, Callable, Generic, TypeVar
+import attr
+
+try:
+    import orjson
+except ImportError:
+    orjson = None # type: ignore
+
+T = TypeVar("T")
+Encoder = Callable[[Any], Any]
+Decoder = Callable[[Any], Any]
+
+class Missing(Enum):
+    """
+    What decoding does with a field that is not in the data.
+    """
+    REQUIRED = "required"
+    DEFAULT = "default" # Left to the constructor default
+    NONE = "none" # Optional fields without a default become None
+
+class SchemaError(ValueError):
+    """
+    Raised when data does not match a schema. path points at the bad value, e.g. Report.issues[2].criticality.
+    """
+
+    def __init__(self, reason: str, path: str = "") -> None:
+        super().__init__(f"{path}: {reason}" if path else reason)
+        self.reason = reason
+        self.path = path
+
+    def under(self, parent: str) -> "SchemaError":
+        separator = "" if not self.path or self.path.startswith("[") else "."
+        return SchemaError(self.reason, f"{parent}{separator}{self.path}")
+
+class Schema(Generic[T]):
+    """
+    Encoder and validating decoder for one record class. Use schema_for to get the shared instance for a class.
+
+    Encoding and decoding use functions generated for the class's fields. If the generated decoder rejects the data,
+    it is decoded again field by field to find the bad value for the error.
+    """
+
+    def __init__(self, cls: type[T], fields: list[tuple[str, Any, Missing, Any]], coerce: dict[str, Callable[[Any], Any]]) -> None:
+        self.cls = cls
+        self.name = cls.__name__
+        self.fields = [name for name, _, _, _ in fields]
+        self.coerce = coerce
+        self.compiled = False
+        self._encode: Callable[[T], dict[str, Any]] = self.__not_compiled
+        self._decode: Callable[[Any], T] = self.__not_compiled
+        self._decoders: list[tuple[str, Decoder, Missing]] = []
+
+    def to_primitive(self, obj: T) -> dict[str, Any]:
+        return self._encode(obj)
+
+    def from_primitive(self, data: Any) -> T:
+        """
+        Builds an instance from decoded JSON. Unknown keys are ignored, missing keys fall back to the field default,
+        or None for optional fields.
+        """
+        try:
+            return self._decode(data)
+        except SchemaError as e:
+            raise e.under(self.name) from None
+
+    def _validate(self, data: Any) -> T:
+        """
+        Decodes field by field. Raises SchemaError with the path relative to data.
+        """
+        if not isinstance(data, dict):
+            raise SchemaError(f"expected an object, got {type(data).__name__}")
+
+        kwargs: dict[str, Any] = {}
+        for name, decode, missing in self._decoders:
+            if name not in data:
+                if missing is Missing.REQUIRED:
+                    raise SchemaError("missing required field", name)
+                if missing is Missing.NONE:
+                    kwargs[name] = None
+                continue
+            try:
+                value = data[name]
+                if name in self.coerce:
+                    value = self.coerce[name](value)
+                kwargs[name] = decode(value)
+            except SchemaError as e:
+                raise e.under(name) from None
+            except (TypeError, ValueError) as e:
+                raise SchemaError(f"could not convert {value!r}: {e}", name) from None
+        return self.cls(**kwargs)
+
+    def __not_compiled(self, _: Any) -> Any:
+        raise RuntimeError(f"Schema for {self.name} is used before it is compiled")
+
+__schemas: dict[type, Schema] = {}
+__lock = threading.RLock()
+# Defaults that can be inlined into generated decoders
+__plain_defaults = (type(None), str, int, float, bool, Enum)
+
+def is_record(cls: type) -> bool:
+    return is_dataclass(cls) or attr.has(cls)
+
+def schema_for(cls: type[T], coerce: dict[str, Callable[[Any], Any]] | None = None) -> Schema[T]:
+    """
+    Returns the schema for a record class, generating it on first use.
+    coerce maps field names to functions that convert alternative representations before validation,
+    and can only be given the first time a class is registered.
+    """
+    schema = __schemas.get(cls)
+    if schema:
+        if coerce and coerce != schema.coerce:
+            raise ValueError(f"Schema for {cls.__name__} already registered with different coercions")
+        return schema
+
+    with __lock:
+        if cls in __schemas:
+            return schema_for(cls, coerce)
+        if not is_record(cls):
+            raise TypeError(f"{cls.__name__} is not a dataclass or attrs class")
+
+        hints = typing.get_type_hints(cls)
+        parameters = inspect.signature(cls).parameters
+        fields = [(name, hints.get(name, Any), __missing(hints.get(name, Any), parameter), parameter.default)
+            for name, parameter in parameters.items()]
+        schema = Schema(cls, fields, coerce or {})
+        # Registered before compiling, so records that refer to themselves find their own schema
+        __schemas[cls] = schema
+        schema._decoders = [(name, __decoder(field_type), missing) for name, field_type, missing, _ in fields]
+        schema._encode = __generate_encoder(schema, fields)
+        schema._decode = __generate_decoder(schema, fields)
+        schema.compiled = True
+        return schema
+
+def to_primitive(obj: Any) -> Any:
+    """
+    Converts records, enums and containers of them to plain dicts and lists.
+    """
+    schema = __schemas.get(type(obj))
+    if schema:
+        return schema._encode(obj)
+    if isinstance(obj, list | tuple):
+        return [to_primitive(item) for item in obj]
+    if isinstance(obj, dict):
+        return {key: to_primitive(value) for key, value in obj.items()}
+    if isinstance(obj, Enum):
+        return obj.value
+    if is_record(type(obj)):
+        return schema_for(type(obj))._encode(obj)
+    return obj
+
+def from_primitive(cls: type[T], data: Any) -> T:
+    return schema_for(cls).from_primitive(data)
+
+def from_primitive_list(cls: type[T], data: Any) -> list[T]:
+    if not isinstance(data, list):
+        raise SchemaError(f"expected a list, got {type(data).__name__}", cls.__name__)
+    schema = schema_for(cls)
+    result = []
+    for i, item in enumerate(data):
+        try:
+            result.append(schema._decode(item))
+        except SchemaError as e:
+            raise e.under(f"[{i}]").under(schema.name) from None
+    return result
+
+def encode_json(data: Any) -> bytes:
+    """
+    Encodes plain data as compact JSON.
+    """
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+def decode_json(data: bytes | str) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj: Any) -> bytes:
+    return encode_json(to_primitive(obj))
+
+def loads(cls: type[T], data: bytes | str) -> list[T]:
+    """
+    Decodes and validates a JSON list of records.
+    """
+    return from_primitive_list(cls, decode_json(data))
+
+def __is_optional(field_type: Any) -> tuple[bool, Any]:
+    if typing.get_origin(field_type) in (typing.Union, types.UnionType):
+        args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+        if len(args) == 1:
+            return len(args) < len(typing.get_args(field_type)), args[0]
+    return False, field_type
+
+def __missing(field_type: Any, parameter: inspect.Parameter) -> Missing:
+    if parameter.default is not inspect.Parameter.empty:
+        return Missing.DEFAULT
+    return Missing.NONE if __is_optional(field_type)[0] else Missing.REQUIRED
+
+def __generate_encoder(schema: Schema, fields: list[tuple[str, Any, Missing, Any]]) -> Callable[[Any], dict[str, Any]]:
+    """
+    Generates a function returning a dict literal of the fields, calling encoders only for fields that need them.
+    """
+    namespace: dict[str, Any] = {}
+    items = []
+    for i, (name, field_type, _, _) in enumerate(fields):
+        encoder = __encoder(field_type)
+        if encoder is None:
+            items.append(f"{name!r}: obj.{name}")
+        else:
+            namespace[f"encode_{i}"] = encoder
+            items.append(f"{name!r}: None if obj.{name} is None else encode_{i}(obj.{name})")
+
+    source = f"def encode_{schema.name}(obj):\n    return {{{', '.join(items)}}}"
+    exec(source, namespace)
+    return namespace[f"encode_{schema.name}"]
+
+def __generate_decoder(schema: Schema, fields: list[tuple[str, Any, Missing, Any]]) -> Callable[[Any], Any]:
+    """
+    Generates a function that checks plain fields inline and calls validating decoders for the rest.
+    Any failure falls back to Schema._validate, which raises the detailed error.
+    """
+    namespace: dict[str, Any] = {"cls": schema.cls, "validate": schema._validate}
+    lines = ["    try:", "        if type(data) is not dict:", "            raise TypeError"]
+    arguments = []
+
+    for i, (name, field_type, missing, default) in enumerate(fields):
+        if missing is Missing.DEFAULT and not isinstance(default, __plain_defaults):
+            # Factories are left to the slow path
+            return schema._validate
+
+        value = f"value_{i}"
+        if missing is Missing.REQUIRED:
+            lines.append(f"        {value} = data[{name!r}]")
+        else:
+            namespace[f"default_{i}"] = default if missing is Missing.DEFAULT else None
+            lines.append(f"        {value} = data.get({name!r}, default_{i})")
+
+        if name in schema.coerce:
+            namespace[f"coerce_{i}"] = schema.coerce[name]
+            lines.append(f"        {value} = coerce_{i}({value})")
+
+        optional, plain_type = __is_optional(field_type)
+        none_allowed = optional or (missing is Missing.DEFAULT and default is None)
+        check = f"{value} is not None and " if none_allowed else ""
+        if plain_type in (str, int, bool):
+            lines.append(f"        if {check}type({value}) is not {plain_type.__name__}:")
+            lines.append("            raise TypeError")
+        elif plain_type is float:
+            lines.append(f"        if type({value}) is int:")
+            lines.append(f"            {value} = float({value})")
+            lines.append(f"        elif {check}type({value}) is not float:")
+            lines.append("            raise TypeError")
+        elif plain_type is not Any:
+            namespace[f"decode_{i}"] = __decoder(field_type)
+            lines.append(f"        {value} = decode_{i}({value})")
+        arguments.append(f"{name}={value}")
+
+    lines.append(f"        return cls({', '.join(arguments)})")
+    lines += ["    except Exception:", "        return validate(data)"]
+    source = f"def decode_{schema.name}(data):\n" + "\n".join(lines)
+    exec(source, namespace)
+    return namespace[f"decode_{schema.name}"]
+
+def __encoder(field_type: Any) -> Encoder | None:
+    """
+    Encoder for a value of the given type, or None if the value is already plain data.
+    None values are never passed to encoders.
+    """
+    _, field_type = __is_optional(field_type)
+    origin = typing.get_origin(field_type)
+
+    if origin in (list, tuple):
+        args = typing.get_args(field_type)
+        item_encoder = __encoder(args[0]) if args else None
+        if item_encoder is None:
+            return None if origin is list else list
+        return lambda value: [None if item is None else item_encoder(item) for item in value]
+    if origin is dict:
+        args = typing.get_args(field_type)
+        value_encoder = __encoder(args[1]) if len(args) == 2 else None
+        if value_encoder is None:
+            return None
+        return lambda value: {key: None if item is None else value_encoder(item) for key, item in value.items()}
+    if inspect.isclass(field_type) and issubclass(field_type, Enum):
+        return lambda value: value.value
+    if inspect.isclass(field_type) and is_record(field_type):
+        schema = schema_for(field_type)
+        # Only a record that refers to itself is not compiled yet
+        return schema._encode if schema.compiled else lambda value: schema._encode(value)
+    if field_type is Any or origin is not None:
+        return to_primitive
+    return None
+
+def __decoder(field_type: Any) -> Decoder:
+    """
+    Validating decoder for a value of the given type, raising SchemaError with the path relative to the value.
+    """
+    optional, field_type = __is_optional(field_type)
+    origin = typing.get_origin(field_type)
+    decode: Decoder
+
+    if field_type is Any:
+        decode = __identity
+    elif field_type is bool:
+        decode = __expect_type(bool, "bool")
+    elif field_type is int:
+        decode = __decode_int
+    elif field_type is float:
+        decode = __decode_float
+    elif field_type is str:
+        decode = __expect_type(str, "str")
+    elif origin in (list, tuple):
+        args = typing.get_args(field_type)
+        decode = __decode_list(__decoder(args[0]) if args else __identity)
+    elif origin is dict:
+        args = typing.get_args(field_type)
+        decode = __decode_dict(__decoder(args[1]) if len(args) == 2 else __identity)
+    elif inspect.isclass(field_type) and issubclass(field_type, Enum):
+        decode = __decode_enum(field_type)
+    elif inspect.isclass(field_type) and is_record(field_type):
+        decode = __decode_record(field_type)
+    else:
+        raise TypeError(f"No decoder for fields of type {field_type}")
+
+    if not optional:
+        return decode
+    return lambda value: None if value is None else decode(value)
+
+def __identity(value: Any) -> Any:
+    return value
+
+def __describe(value: Any) -> str:
+    text = repr(value)
+    return f"{type(value).__name__} ({text[:40] + '...' if len(text) > 40 else text})"
+
+def __expect_type(expected: type, name: str) -> Decoder:
+    def decode(value: Any) -> Any:
+        if type(value) is not expected and not isinstance(value, expected):
+            raise SchemaError(f"expected {name}, got {__describe(value)}")
+        return value
+    return decode
+
+def __decode_int(value: Any) -> int:
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise SchemaError(f"expected int, got {__describe(value)}")
+    return value
+
+def __decode_float(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, int | float):
+        raise SchemaError(f"expected float, got {__describe(value)}")
+    return float(value)
+
+def __decode_list(decode_item: Decoder) -> Decoder:
+    def decode(value: Any) -> list[Any]:
+        if not isinstance(value, list):
+            raise SchemaError(f"expected list, got {__describe(value)}")
+        result = []
+        for i, item in enumerate(value):
+            try:
+                result.append(decode_item(item))
+            except SchemaError as e:
+                raise e.under(f"[{i}]") from None
+        return result
+    return decode
+
+def __decode_dict(decode_value: Decoder) -> Decoder:
+    def decode(value: Any) -> dict[str, Any]:
+        if not isinstance(value, dict):
+            raise SchemaError(f"expected object, got {__describe(value)}")
+        result = {}
+        for key, item in value.items():
+            try:
+                result[key] = decode_value(item)
+            except SchemaError as e:
+                raise e.under(f"[{key!r}]") from None
+        return result
+    return decode
+
+def __decode_record(record_type: type) -> Decoder:
+    schema: Schema = schema_for(record_type)
+    if schema.compiled:
+        return schema._decode
+    return lambda value: schema._decode(value)
+
+def __decode_enum(enum_type: type[Enum]) -> Decoder:
+    def decode(value: Any) -> Enum:
+        try:
+            return enum_type(value)
+        except ValueError:
+            raise SchemaError(f"{value!r} is not a valid {enum_type.__name__}") from None
+    return decode
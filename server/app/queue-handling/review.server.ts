@@ -17,6 +17,36 @@ export interface Product {
 }
 
 let connection: amqp.Connection | undefined;
+
+// Priority of messages requested from the admin pages, ahead of the default 0 of crawls
+const INTERACTIVE_PRIORITY = 5;
+// Queues with priority lanes, they have to be declared with the same arguments as the scraper does
+const PRIORITY_QUEUES = ["parse", "to_analyze"];
+
+/**
+ * Options to assert a queue with. Priorities are disabled unless QUEUE_MAX_PRIORITY is set above 0,
+ * and changing it means deleting the parse and to_analyze queues first.
+ */
+function queueOptions(queue: string): amqp.Options.AssertQueue {
+  const maxPriority = parseInt(process.env.QUEUE_MAX_PRIORITY || "0");
+  if (maxPriority > 0 && PRIORITY_QUEUES.includes(queue)) {
+    return { durable: true, maxPriority };
+  }
+  return { durable: true };
+}
+
+/**
+ * Message options that put a message in a priority lane of its own job
+ */
+function laneOptions(jobId: string): amqp.Options.Publish {
+  return {
+    priority: INTERACTIVE_PRIORITY,
+    headers: {
+      "x-job-id": jobId,
+      "x-enqueued-at": Date.now() / 1000,
+    },
+  };
+}
 // Used because of hot reload to not create multiple connections each time
 declare global {
   var __queue: amqp.Connection | undefined; //eslint-disable-line
@@ -57,9 +87,7 @@ export async function startListeningForReviews() {
   }
 
   const channel = await connection.createChannel();
-  await channel.assertQueue("parse", {
-    durable: true,
-  });
+  await channel.assertQueue("parse", queueOptions("parse"));
   await channel.assertQueue("parsed_reviews", {
     durable: true,
   });
@@ -278,7 +306,7 @@ export async function getStatusOfQueue(queueId: string): Promise<QueueStatus> {
   }
 
   const channel = await connection.createChannel();
-  const queueData = await channel.assertQueue(queueId);
+  const queueData = await channel.assertQueue(queueId, queueOptions(queueId));
 
   channel.close();
   return {
@@ -294,11 +322,13 @@ export async function sendProductToQueue(product: Product) {
   }
 
   const channel = await connection.createChannel();
-  await channel.assertQueue("parse", {
-    durable: true,
-  });
+  await channel.assertQueue("parse", queueOptions("parse"));
 
-  channel.sendToQueue("parse", Buffer.from(JSON.stringify(product)));
+  channel.sendToQueue(
+    "parse",
+    Buffer.from(JSON.stringify(product)),
+    laneOptions(`product-${product.id}`)
+  );
 }
 
 export async function analyzeProduct(product_id: string) {
@@ -329,7 +359,12 @@ export async function analyzeProduct(product_id: string) {
     manufacturer_id: review.product.manufacturer.id,
   }));
 
-  channel.sendToQueue("to_analyze", Buffer.from(JSON.stringify(reviews)));
+  await channel.assertQueue("to_analyze", queueOptions("to_analyze"));
+  channel.sendToQueue(
+    "to_analyze",
+    Buffer.from(JSON.stringify(reviews)),
+    laneOptions(`analyze-${product_id}`)
+  );
 }
 
 export async function clearParseQueue() {
@@ -339,9 +374,7 @@ export async function clearParseQueue() {
   }
 
   const channel = await connection.createChannel();
-  await channel.assertQueue("parse", {
-    durable: true,
-  });
+  await channel.assertQueue("parse", queueOptions("parse"));
 
   channel.purgeQueue("parse");
 }
@@ -353,9 +386,7 @@ export async function clearToAnalyzeQueue() {
   }
 
   const channel = await connection.createChannel();
-  await channel.assertQueue("to_analyze", {
-    durable: true,
-  });
+  await channel.assertQueue("to_analyze", queueOptions("to_analyze"));
 
   channel.purgeQueue("to_analyze");
 }